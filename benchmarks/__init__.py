@@ -0,0 +1 @@
+#Benchmarks for the ticketing system, run each one as a module from the repository root, e.g. "python -m benchmarks.ioc_extraction"
@@ -0,0 +1,133 @@
+import os
+import random
+import sqlite3
+from datetime import datetime,timedelta
+import database_methods
+import log_ingester
+
+#Builds a large, realistic ticketing database to benchmark against: queues, analysts, tickets spread over a period of days with the
+#status mix of a working queue, comments, key information drawn from the IPs in incident.log (so the same indicators turn up on many
+#tickets, as real ones do), relationships between tickets that share an indicator, knowledge mappings named in ticket titles and the
+#network events from incident.log. Rows are written with bulk inserts in one transaction, the triggers keep every derived table up to date.
+
+INCIDENT_LOG = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),'incident.log')
+
+#Every analyst is created with this password so the load generator can log in as any of them
+PASSWORD = 'benchmark'
+
+QUEUES = ("Network","Endpoint","Identity","Email","Cloud","Insider Threat")
+#Alert titles, filled in with an indicator. The same shape as the emails the ingester turns into tickets.
+ALERTS = (
+    "Multiple SSH Failures at {ip}",
+    "Password Brute Force Attempts at {ip}",
+    "Impossible Travel Activity from {ip}",
+    "Outbound Connection to Known C2 {ip}",
+    "Suspicious LDAP Enumeration by {ip}",
+    "Malware Detected on Host {ip}",
+    "Port Scan Detected from {ip}",
+    "Data Exfiltration over DNS from {ip}",
+)
+ACCOUNTS = ("root","admin","svc_backup","michael","jsmith","administrator","guest")
+COMMENTS = (
+    "Checked the host, no further activity seen.",
+    "Blocked the source IP at the firewall.",
+    "Escalated to the network team for review.",
+    "User confirmed the activity was expected.",
+    "Isolated the endpoint pending investigation.",
+    "Credentials reset and sessions revoked.",
+)
+
+#The IPs in incident.log, most frequent first, used as the key information on tickets
+def log_ips(path=INCIDENT_LOG):
+    counts = {}
+    with open(path) as log:
+        for line in log:
+            event = log_ingester.parse_event(line)
+            if(event):
+                for ip in event[2:4]:
+                    counts[ip] = counts.get(ip,0) + 1
+    return sorted(counts,key=counts.get,reverse=True)
+
+#Fill the database at database_methods.DATABASE with generated data. Sizes are per ticket where they say so.
+#Returns a summary of what was made, including ids and values the load generator can pick from.
+def build(tickets=10000,analysts=20,comments=2,keyinfo=3,related=0.1,knowledge=50,days=90,seed=1,events=True):
+    rng = random.Random(seed)
+    database_methods.table_init()
+    for queue in QUEUES:
+        database_methods.insert_queue(queue)
+    for analyst in range(1,analysts + 1):
+        database_methods.insert_user(f'analyst{analyst}',PASSWORD,f'analyst{analyst}@example.com',1)
+
+    db,cur = database_methods.db_connection()
+    queues = [row[0] for row in cur.execute('SELECT id FROM queue').fetchall()]
+    users = [row[0] for row in cur.execute('SELECT id FROM users WHERE name LIKE "analyst%"').fetchall()]
+    ips = log_ips()
+    #a few indicators are seen far more often than the rest
+    weights = [1/(rank + 1) for rank in range(len(ips))]
+    now = datetime.now()
+    first = cur.execute('SELECT COALESCE(MAX(id),0) FROM tickets').fetchone()[0] + 1
+    first_map = cur.execute('SELECT COALESCE(MAX(id),0) FROM knowledgemap').fetchone()[0] + 1
+
+    try:
+        cur.executemany('INSERT INTO knowledgemap (title,body) VALUES (?,?)',
+                        [(f"{alert.format(ip='a host')} Playbook {number}",f"Steps for handling {alert.format(ip='a host').lower()}.") for number,alert in ((number,rng.choice(ALERTS)) for number in range(knowledge))])
+        cur.executemany('INSERT INTO knowledge (knowledgemap,title,body) VALUES (?,?,?)',
+                        [(first_map + number,f"Step {step}",rng.choice(COMMENTS)) for number in range(knowledge) for step in range(1,4)])
+
+        rows,comment_rows,keyinfo_rows = [],[],[]
+        #the tickets each indicator has been seen on, a share of tickets are related to an earlier ticket with the same indicator
+        sightings = {}
+        pairs = set()
+        for ticket in range(first,first + tickets):
+            created = now - timedelta(seconds=rng.uniform(0,days*24*3600))
+            indicators = list(dict.fromkeys(rng.choices(ips,weights,k=rng.randint(1,keyinfo*2 - 1))))
+            ip = indicators[0]
+            name = rng.choice(ALERTS).format(ip=ip)
+            if(knowledge and rng.random() < 0.5):
+                name = f"INC{first_map + rng.randrange(knowledge)} - {name}"
+            queue = rng.choice(queues)
+            content = f"Host:{ip},Account:{rng.choice(ACCOUNTS)}"
+            #older tickets are more likely to have been dealt with
+            age = (now - created).total_seconds() / (days*24*3600)
+            started = created + timedelta(minutes=rng.expovariate(1/10)) if rng.random() < 0.5 + age/2 else None
+            completed = started + timedelta(minutes=rng.expovariate(1/120)) if started and rng.random() < 0.3 + age*0.7 else None
+            if(completed and completed > now):
+                completed = None
+            status = "Resolved" if completed else ("Under Investigation" if started else "New")
+            determination = rng.choice(("True Positive","False Positive","False Positive")) if completed else None
+            owner = rng.choice(users) if started else 1
+            rows.append((ticket,name,status,owner,queue,content,created,started,completed,determination,created,
+                         database_methods.content_hash(name,queue,content),database_methods.parse_incident_identifier(name)))
+            for number in range(rng.randint(0,comments*2) if started else 0):
+                comment_rows.append((rng.choice(COMMENTS),owner,ticket,started + timedelta(minutes=number*5),rng.randint(1,len(database_methods.FRAMEWORK_STEPS))))
+            for indicator in indicators:
+                keyinfo_rows.append((ticket,"IP",indicator))
+                seen = sightings.setdefault(indicator,[])
+                if(seen and rng.random() < related):
+                    pairs.add((rng.choice(seen),ticket))
+                seen.append(ticket)
+        cur.executemany('''INSERT INTO tickets (id,name,status,owner,queue,content,created,started,completed,determination,lastseen,contenthash,knowledgemap)
+                           VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?)''',rows)
+        cur.executemany('INSERT INTO comments (comment,commenter,post,datetime,stage) VALUES (?,?,?,?,?)',comment_rows)
+        cur.executemany('INSERT OR IGNORE INTO keyinfo (ticket,infotype,info) VALUES (?,?,?)',keyinfo_rows)
+        cur.executemany('INSERT OR IGNORE INTO relationships (ticketone,tickettwo) VALUES (?,?)',sorted(pairs))
+        db.commit()
+    except sqlite3.Error:
+        db.rollback()
+        raise
+    #clusters are worked out in one go rather than joined a relationship at a time
+    database_methods.rebuild_clusters()
+    database_methods.notify_changes()
+    if(events):
+        log_ingester.ingest_file(INCIDENT_LOG,restart=True)
+    return {
+        'tickets':tickets,
+        'comments':len(comment_rows),
+        'keyinfo':len(keyinfo_rows),
+        'relationships':len(pairs),
+        'knowledge':knowledge,
+        'queues':queues,
+        'users':[f'analyst{analyst}' for analyst in range(1,analysts + 1)],
+        'ticket_range':(first,first + tickets - 1),
+        'indicators':ips[0:200],
+    }
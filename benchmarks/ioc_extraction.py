@@ -0,0 +1,107 @@
+import argparse
+import os
+import random
+import re
+import sys
+import time
+import ioc_extractor
+
+#Measures key information extraction throughput (MB/s) over a corpus of large synthetic alert bodies,
+#comparing the single pass extractor against the original per-fragment regexes.
+
+INCIDENT_LOG = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),'incident.log')
+
+#Build count alert bodies of roughly size bytes each, made of incident.log style event lines mixed with emails, hashes, URLs and MAC addresses.
+def build_corpus(count,size,seed=1):
+    rng = random.Random(seed)
+    with open(INCIDENT_LOG) as log:
+        events = [line.strip() for line in log if line.strip()]
+    extras = (
+        lambda: f"User:{rng.choice(['admin','root','svc_backup','michael'])}@corp{rng.randint(1,50)}.com",
+        lambda: f"Hash:{rng.getrandbits(256):064x}",
+        lambda: f"MD5:{rng.getrandbits(128):032x}",
+        lambda: f"URL:https://cdn{rng.randint(1,999)}.badhost.ru/payload.bin",
+        lambda: "MAC:" + ":".join(f"{rng.randint(0,255):02x}" for octet in range(6)),
+        lambda: f"Host:{rng.randint(1,223)}.{rng.randint(0,255)}.{rng.randint(0,255)}.{rng.randint(1,254)}",
+    )
+    corpus = []
+    for body in range(count):
+        parts = []
+        length = 0
+        while length < size:
+            part = rng.choice(events) if rng.random() < 0.7 else rng.choice(extras)()
+            parts.append(part)
+            length += len(part) + 1
+        corpus.append(",".join(parts))
+    return corpus
+
+#The original extraction: split on commas, run three regexes per fragment and de-duplicate with a list.
+def legacy_extract(title,body):
+    results = []
+    for line in [title] + body.split(","):
+        ips = [ip for ip in re.findall(r'[0-9]{1,3}\.[0-9]{1,3}\.[0-9]{1,3}\.[0-9]{1,3}',line) if all(int(octet) <= 255 for octet in ip.split('.'))]
+        emails = re.findall(r'[A-z0-9!#$%&\'*+/=?^_`{|}~-]+(?:\.[a-z0-9!#$%&\'*+/=?^_`{|}~-]+)*@(?:[a-z0-9](?:[a-z0-9-]*[a-z0-9])?\.)+[a-z0-9](?:[a-z0-9-]*[a-z0-9])?',line)
+        macs = re.findall(r'((?:[\da-fA-F]{2}[:\-]){5}[\da-fA-F]{2})',line)
+        for match in (*emails,*ips,*macs):
+            if(match and match not in results):
+                results.append(match)
+    return results
+
+#Alert text the original regexes found indicators in, every one of which the single pass extractor must also find.
+#Includes indicators written straight after a word (IP10.0.0.1), which the original regexes found anywhere in a fragment.
+EQUIVALENCE_CASES = (
+    "Host:10.0.0.1,Account:root",
+    "src IP10.0.0.1 dst",
+    "x10.0.0.1",
+    "srcIP:172.16.0.5 dstIP:192.168.1.20",
+    "Failed password for root from 203.0.113.7 port 22",
+    "ip=10.1.1.1,mac=00:1a:2b:3c:4d:5e",
+    "User:admin@corp12.com",
+    "Reply to jsmith@example.co.uk about 8.8.8.8",
+)
+
+#Check the single pass extractor finds every IP and email the original extraction does, in each case and in the first body of the corpus.
+#MAC addresses aren't compared, the original MAC regex reads the "AC" of a "MAC:" label as the first octet.
+#Returns (text, indicators missed) for every text something was missed in.
+def check_equivalence(corpus):
+    misses = []
+    for text in EQUIVALENCE_CASES + tuple(corpus[0:1]):
+        found = set(ioc_extractor.extract_values(text))
+        missed = [value for value in legacy_extract("",text) if value not in found and not re.fullmatch(r'(?:[\da-fA-F]{2}[:\-]){5}[\da-fA-F]{2}',value)]
+        if(missed):
+            misses.append((text,missed))
+    return misses
+
+#Run function over every body in the corpus, returning the throughput in MB/s and the number of indicators found.
+def measure(function,corpus):
+    megabytes = sum(len(body) for body in corpus) / (1024*1024)
+    found = 0
+    start = time.perf_counter()
+    for body in corpus:
+        found += len(function("Alert",body))
+    elapsed = time.perf_counter() - start
+    return megabytes/elapsed,found
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark key information extraction')
+    parser.add_argument('--bodies',type=int,default=20,help='How many alert bodies to generate')
+    parser.add_argument('--size',type=int,default=256*1024,help='Approximate size of each body in bytes')
+    parser.add_argument('--skip-legacy',action='store_true',help="Don't time the original extraction, it is slow on large bodies")
+    args = parser.parse_args(argv)
+
+    corpus = build_corpus(args.bodies,args.size)
+    print(f"Corpus: {len(corpus)} bodies, {sum(len(body) for body in corpus)/(1024*1024):.1f} MB")
+    misses = check_equivalence(corpus)
+    for text,missed in misses:
+        print(f"Missed {missed} in {text[0:80]!r}")
+    if(misses):
+        return 1
+    throughput,found = measure(lambda title,body: ioc_extractor.extract(title + "\n" + body),corpus)
+    print(f"single pass extractor: {throughput:8.2f} MB/s, {found} indicators")
+    if not(args.skip_legacy):
+        throughput,found = measure(legacy_extract,corpus)
+        print(f"original extraction:   {throughput:8.2f} MB/s, {found} indicators")
+
+#if the script is run as it self and not as a dependancy
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,194 @@
+import argparse
+import json
+import math
+import os
+import random
+import subprocess
+import threading
+import time
+from datetime import datetime
+import database_methods
+from benchmarks import dataset
+
+#Drives the main pages of the Flask app through its test client, from several threads at once, against a generated database
+#(see dataset.py), reporting p50/p95/p99 latency, plus SQL queries and database time per request from the app's X-DB-Queries and X-DB-Time
+#headers, for each page. Results are saved as JSON so a
+#run can be compared against one from an earlier revision with --compare.
+#
+#    python -m benchmarks.load --tickets 100000 --requests 5000 --concurrency 8 --output results.json
+#    python -m benchmarks.load --database bench.db --reuse --compare results.json
+
+#The pages requested and how often, relative to each other
+ROUTES = {
+    'home':4,
+    'queue':4,
+    'ticket':6,
+    'search':2,
+    'keyinfo':2,
+}
+#Words searched for, taken from the generated titles, comments and key information
+SEARCH_TERMS = ("ssh","brute force","exfiltration","firewall","malware","escalated","root","c2")
+#Latency percentiles reported for each page, times are given in milliseconds
+PERCENTILES = (50,95,99)
+
+#Build the list of (route, url) requests to make, picking routes by their weight and pages from the generated data
+def plan_requests(summary,count,seed=1):
+    rng = random.Random(seed)
+    first,last = summary['ticket_range']
+    urls = {
+        'home':lambda: '/',
+        'queue':lambda: f"/ViewQueue/{rng.choice(summary['queues'])}",
+        'ticket':lambda: f"/ViewTicket/{rng.randint(first,last)}",
+        'search':lambda: f"/Search?search={rng.choice(SEARCH_TERMS).replace(' ','+')}",
+        'keyinfo':lambda: f"/ViewKeyInfo/{rng.choice(summary['indicators'])}",
+    }
+    routes = rng.choices(list(ROUTES),list(ROUTES.values()),k=count)
+    return [(route,urls[route]()) for route in routes]
+
+#Log a test client in as user, through the login form like a browser would
+def login(app,user):
+    client = app.test_client()
+    response = client.post('/Login',data={'uname':user,'pword':dataset.PASSWORD})
+    if(response.status_code != 302):
+        raise RuntimeError(f'Could not log in as {user}')
+    return client
+
+#Make every request, spread over concurrency threads each logged in as a different analyst.
+#Returns a list of (route, seconds taken, queries run, milliseconds in the database, status code) in the order they finished, and the total time taken.
+def run(app,requests,concurrency,users):
+    results = []
+    lock = threading.Lock()
+    position = iter(requests)
+    clients = [login(app,users[worker % len(users)]) for worker in range(concurrency)]
+
+    def worker(client):
+        while True:
+            with lock:
+                request = next(position,None)
+            if(request is None):
+                return
+            route,url = request
+            start = time.perf_counter()
+            response = client.get(url)
+            #the response body is read so streamed templates are counted in full
+            response.get_data()
+            elapsed = time.perf_counter() - start
+            with lock:
+                results.append((route,elapsed,int(response.headers.get('X-DB-Queries',0)),float(response.headers.get('X-DB-Time',0)),response.status_code))
+
+    threads = [threading.Thread(target=worker,args=(client,)) for client in clients]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results,time.perf_counter() - start
+
+#Nearest rank percentile of a sorted list
+def percentile(values,percent):
+    if not(values):
+        return 0
+    return values[max(math.ceil(percent/100*len(values)) - 1,0)]
+
+#Latency percentiles (ms), mean queries and database time per request and error count for a set of results
+def summarise(results):
+    times = sorted(elapsed*1000 for route,elapsed,queries,db_time,status in results)
+    summary = {'requests':len(results)}
+    for percent in PERCENTILES:
+        summary[f'p{percent}_ms'] = round(percentile(times,percent),2)
+    summary['mean_ms'] = round(sum(times)/len(times),2) if times else 0
+    summary['queries_per_request'] = round(sum(queries for route,elapsed,queries,db_time,status in results)/len(results),2) if results else 0
+    summary['db_ms_per_request'] = round(sum(db_time for route,elapsed,queries,db_time,status in results)/len(results),2) if results else 0
+    summary['errors'] = sum(1 for route,elapsed,queries,db_time,status in results if status >= 400)
+    return summary
+
+#The git commit the benchmark was run against, if it can be found
+def revision():
+    try:
+        return subprocess.run(['git','rev-parse','--short','HEAD'],capture_output=True,text=True,check=True,
+                              cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))).stdout.strip()
+    except (OSError,subprocess.CalledProcessError):
+        return None
+
+#Print the change in each route's figures from an earlier run
+def compare(report,previous):
+    print(f"\nCompared with {previous.get('revision') or 'earlier run'} ({previous.get('started')})")
+    for route,summary in report['routes'].items():
+        before = previous['routes'].get(route)
+        if not(before):
+            continue
+        changes = []
+        for key in [f'p{percent}_ms' for percent in PERCENTILES] + ['queries_per_request','db_ms_per_request']:
+            if(before.get(key)):
+                changes.append(f"{key} {(summary[key] - before[key])/before[key]*100:+.0f}%")
+        print(f"{route:>8}: " + ", ".join(changes))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the ticketing system pages under concurrent load')
+    parser.add_argument('--database',default='benchmark.db',help='Database file to generate and run against')
+    parser.add_argument('--reuse',action='store_true',help="Run against the database as it is rather than generating it again")
+    parser.add_argument('--tickets',type=int,default=10000,help='How many tickets to generate')
+    parser.add_argument('--comments',type=int,default=2,help='Average comments per ticket that has been taken')
+    parser.add_argument('--keyinfo',type=int,default=3,help='Average key information per ticket')
+    parser.add_argument('--related',type=float,default=0.1,help='Chance a ticket is related to an earlier one sharing key information')
+    parser.add_argument('--knowledge',type=int,default=50,help='How many knowledge mappings to generate')
+    parser.add_argument('--requests',type=int,default=2000,help='How many page requests to make')
+    parser.add_argument('--concurrency',type=int,default=4,help='How many requests to make at once')
+    parser.add_argument('--seed',type=int,default=1,help='Seed for the generated data and requests')
+    parser.add_argument('--output',help='Save the results as JSON to this file')
+    parser.add_argument('--compare',help='JSON results of an earlier run to compare against')
+    args = parser.parse_args(argv)
+
+    database_methods.DATABASE = args.database
+    if not(args.reuse):
+        for path in (args.database,database_methods.archive_path()):
+            for suffix in ('','-wal','-shm'):
+                if(os.path.exists(path + suffix)):
+                    os.remove(path + suffix)
+        start = time.perf_counter()
+        built = dataset.build(args.tickets,comments=args.comments,keyinfo=args.keyinfo,related=args.related,knowledge=args.knowledge,seed=args.seed)
+        print(f"Generated {built['tickets']} tickets, {built['comments']} comments, {built['keyinfo']} key info and {built['relationships']} relationships in {time.perf_counter() - start:.1f}s")
+    database_methods.release_connection()
+
+    import main as webapp
+    app = webapp.create_app({'WTF_CSRF_ENABLED':False})
+
+    db,cur = database_methods.db_connection()
+    summary = {
+        'ticket_range':cur.execute('SELECT MIN(id),MAX(id) FROM tickets').fetchone(),
+        'queues':[row[0] for row in cur.execute('SELECT id FROM queue').fetchall()],
+        'indicators':[row[0] for row in cur.execute('SELECT indicator FROM ioc_stats ORDER BY sightings DESC LIMIT 200').fetchall()],
+    }
+    users = [row[0] for row in cur.execute('SELECT name FROM users WHERE name LIKE "analyst%"').fetchall()]
+    tickets = cur.execute('SELECT COUNT(*) FROM tickets').fetchone()[0]
+    database_methods.release_connection()
+
+    requests = plan_requests(summary,args.requests,args.seed)
+    results,elapsed = run(app,requests,args.concurrency,users)
+    report = {
+        'revision':revision(),
+        'started':datetime.now().isoformat(timespec='seconds'),
+        'settings':{key:value for key,value in vars(args).items() if key not in ('output','compare')},
+        'tickets':tickets,
+        'elapsed_s':round(elapsed,2),
+        'requests_per_s':round(len(results)/elapsed,1),
+        'overall':summarise(results),
+        'routes':{route:summarise([result for result in results if result[0] == route]) for route in ROUTES},
+    }
+    database_methods.close_pool()
+
+    print(f"{len(results)} requests in {elapsed:.1f}s ({report['requests_per_s']} per second) at concurrency {args.concurrency}")
+    print(f"{'route':>8} {'requests':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'queries':>8} {'db ms':>8} {'errors':>6}")
+    for route,summary in list(report['routes'].items()) + [('overall',report['overall'])]:
+        print(f"{route:>8} {summary['requests']:>8} {summary['p50_ms']:>8} {summary['p95_ms']:>8} {summary['p99_ms']:>8} {summary['queries_per_request']:>8} {summary['db_ms_per_request']:>8} {summary['errors']:>6}")
+    if(args.output):
+        with open(args.output,'w') as output:
+            json.dump(report,output,indent=2)
+        print(f"Saved results to {args.output}")
+    if(args.compare):
+        with open(args.compare) as previous:
+            compare(report,json.load(previous))
+
+#if the script is run as it self and not as a dependancy
+if __name__ == "__main__":
+    main()
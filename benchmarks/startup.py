@@ -0,0 +1,65 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+#Measures how long a web server worker takes to start: importing main, create_app() and serving its first request, each in a fresh
+#interpreter as a spawned worker would be. The first start creates the database, the rest start against one that is already up to date,
+#as every worker after the first does. Exits with an error if a worker start goes over --budget milliseconds, so it can be run as a check.
+#
+#    python -m benchmarks.startup --budget 1500
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+#Run in each fresh interpreter, prints the time each step took in milliseconds
+WORKER = '''
+import json,sys,time
+start = time.perf_counter()
+import database_methods
+database_methods.DATABASE = sys.argv[1]
+import main
+imported = time.perf_counter()
+app = main.create_app()
+created = time.perf_counter()
+response = app.test_client().get('/Login')
+served = time.perf_counter()
+print(json.dumps({
+    'import_ms':(imported - start)*1000,
+    'create_app_ms':(created - imported)*1000,
+    'first_request_ms':(served - created)*1000,
+    'total_ms':(served - start)*1000,
+    'status':response.status_code,
+}))
+'''
+
+#Start one worker against the database at path, returning its timings
+def start_worker(path):
+    result = subprocess.run([sys.executable,'-c',WORKER,path],cwd=ROOT,capture_output=True,text=True)
+    if(result.returncode != 0):
+        raise RuntimeError(f'Worker failed to start:\n{result.stderr}')
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measure how long a web server worker takes to start')
+    parser.add_argument('--workers',type=int,default=5,help='How many workers to start after the first, the slowest is checked against the budget')
+    parser.add_argument('--budget',type=float,default=2000,help='Most milliseconds a worker may take to start against an up to date database')
+    parser.add_argument('--directory',help='Where to create the database, a temporary directory by default')
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory(dir=args.directory) as directory:
+        path = os.path.join(directory,'Tickets.db')
+        runs = [('first',start_worker(path))] + [(f'worker {number}',start_worker(path)) for number in range(1,args.workers + 1)]
+    print(f"{'start':>10} {'import ms':>10} {'app ms':>10} {'request ms':>10} {'total ms':>10}")
+    for name,timings in runs:
+        print(f"{name:>10} {timings['import_ms']:>10.1f} {timings['create_app_ms']:>10.1f} {timings['first_request_ms']:>10.1f} {timings['total_ms']:>10.1f}")
+    slowest = max(timings['total_ms'] for name,timings in runs[1:]) if args.workers else 0
+    if(slowest > args.budget):
+        print(f"Slowest worker start took {slowest:.1f}ms, over the {args.budget:.0f}ms budget")
+        return 1
+    print(f"Slowest worker start took {slowest:.1f}ms, within the {args.budget:.0f}ms budget")
+
+#if the script is run as it self and not as a dependancy
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,136 @@
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import time
+from datetime import datetime,timedelta
+
+#Compares the time window queries over ticket timestamps stored as text (the original schema) and as integer epoch milliseconds (schema version 12),
+#on a generated database of tickets spread over the last 90 days. Each query is run against both and the plan SQLite picks is shown alongside the time.
+
+SCHEMAS = {
+    'text':'''CREATE TABLE tickets(id integer PRIMARY KEY, queue integer not null, status text not null, determination text,
+              created text not null, started text, completed text)''',
+    'epochms':'''CREATE TABLE tickets(id integer PRIMARY KEY, queue integer not null, status text not null, determination text,
+                 created epochms integer not null, started epochms integer, completed epochms integer)''',
+}
+INDEXES = (
+    'CREATE INDEX tickets_created ON tickets(created)',
+    'CREATE INDEX tickets_started ON tickets(started)',
+    'CREATE INDEX tickets_completed ON tickets(completed)',
+    'CREATE INDEX tickets_queue_created ON tickets(queue,created)',
+)
+
+#The same questions asked of each representation, the text queries are the ones the ticketing system used before version 12.
+#Parameters are filled in by window(), so both are asked about exactly the same period.
+QUERIES = (
+    ('created in the last day',
+     'SELECT COUNT(id) FROM tickets WHERE created > datetime("now","localtime","-1 days")',
+     'SELECT COUNT(id) FROM tickets WHERE created > ?'),
+    ('created in a queue in the last day',
+     'SELECT COUNT(id) FROM tickets WHERE created > datetime("now","localtime","-1 days") AND queue = 3',
+     'SELECT COUNT(id) FROM tickets WHERE created > ? AND queue = 3'),
+    ('average response in the last day',
+     'SELECT AVG((julianday(started) - julianday(created))*24*60) FROM tickets WHERE started > datetime("now","localtime","-1 days") AND started != "Null"',
+     'SELECT AVG((started - created)/60000.0) FROM tickets WHERE started > ?'),
+    ('false positives resolved in the last day',
+     'SELECT COUNT(id), determination FROM tickets WHERE status = "Resolved" AND completed != "Null" AND completed > datetime("now","localtime","-1 days") GROUP BY determination',
+     'SELECT COUNT(id), determination FROM tickets WHERE status = "Resolved" AND completed > ? GROUP BY determination'),
+    ('taken late in the last day',
+     'SELECT COUNT(id) FROM tickets WHERE started > datetime("now","localtime","-1 days") AND (julianday(started) - julianday(created))*24*60 > 15',
+     'SELECT COUNT(id) FROM tickets WHERE started > ? AND (started - created)/60000.0 > 15'),
+    ('created in one hour a month ago',
+     'SELECT COUNT(id) FROM tickets WHERE created BETWEEN datetime("now","localtime","-30 days") AND datetime("now","localtime","-30 days","+1 hours")',
+     'SELECT COUNT(id) FROM tickets WHERE created BETWEEN ? AND ?'),
+)
+
+def to_epoch_ms(value):
+    return round(value.timestamp()*1000)
+
+#The parameters for an epoch millisecond query, matching the datetime("now",...) windows of the text queries
+def window(sql,now):
+    if('BETWEEN' in sql):
+        start = now - timedelta(days=30)
+        return (to_epoch_ms(start),to_epoch_ms(start + timedelta(hours=1)))
+    return (to_epoch_ms(now - timedelta(days=1)),)
+
+#Generate count tickets over the last 90 days, returned as (queue, status, determination, created, started, completed) datetimes.
+#Open tickets have no completed time and untaken ones no started time, the text schema stores these the way the old code did, as "Null".
+def generate(count,seed=1):
+    rng = random.Random(seed)
+    now = datetime.now()
+    for ticket in range(count):
+        created = now - timedelta(seconds=rng.uniform(0,90*24*3600))
+        started = created + timedelta(minutes=rng.expovariate(1/10)) if rng.random() < 0.9 else None
+        completed = started + timedelta(minutes=rng.expovariate(1/120)) if started and rng.random() < 0.8 else None
+        status = "Resolved" if completed else ("Under Investigation" if started else "New")
+        determination = rng.choice(("True Positive","False Positive")) if completed else None
+        yield rng.randint(1,10),status,determination,created,started,completed
+
+#Build both databases in directory, returning {representation: path}
+def build(directory,count,seed=1):
+    paths = {}
+    connections = {}
+    for representation,schema in SCHEMAS.items():
+        paths[representation] = os.path.join(directory,f'{representation}.db')
+        connections[representation] = sqlite3.connect(paths[representation])
+        connections[representation].execute('PRAGMA journal_mode = OFF')
+        connections[representation].execute('PRAGMA synchronous = OFF')
+        connections[representation].execute(schema)
+    text = lambda value: str(value) if value else "Null"
+    epoch = lambda value: to_epoch_ms(value) if value else None
+    batch = []
+    for ticket in generate(count,seed):
+        batch.append(ticket)
+        if(len(batch) >= 50000 or len(batch) == count):
+            for representation,convert in (('text',text),('epochms',epoch)):
+                connections[representation].executemany('INSERT INTO tickets (queue,status,determination,created,started,completed) VALUES (?,?,?,?,?,?)',
+                                                        [(queue,status,determination,convert(created),convert(started),convert(completed)) for queue,status,determination,created,started,completed in batch])
+            count -= len(batch)
+            batch = []
+    for connection in connections.values():
+        for index in INDEXES:
+            connection.execute(index)
+        connection.execute('ANALYZE')
+        connection.commit()
+        connection.close()
+    return paths
+
+#Run a query repeats times, returning the best time in milliseconds, the result and the query plan
+def measure(connection,sql,parameters,repeats):
+    plan = "; ".join(row[3] for row in connection.execute('EXPLAIN QUERY PLAN ' + sql,parameters).fetchall())
+    best = None
+    for repeat in range(repeats):
+        start = time.perf_counter()
+        result = connection.execute(sql,parameters).fetchall()
+        elapsed = (time.perf_counter() - start)*1000
+        best = elapsed if best is None else min(best,elapsed)
+    return best,result,plan
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark time window queries on text and epoch millisecond timestamps')
+    parser.add_argument('--tickets',type=int,default=1000000,help='How many tickets to generate')
+    parser.add_argument('--repeats',type=int,default=5,help='How many times to run each query, the best time is reported')
+    parser.add_argument('--directory',help='Where to build the databases, a temporary directory by default')
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory(dir=args.directory) as directory:
+        start = time.perf_counter()
+        paths = build(directory,args.tickets)
+        print(f"Built {args.tickets} tickets in each representation in {time.perf_counter() - start:.1f}s")
+        for representation,path in paths.items():
+            print(f"{representation:>8}: {os.path.getsize(path)/(1024*1024):.1f} MB")
+        connections = {representation:sqlite3.connect(path) for representation,path in paths.items()}
+        now = datetime.now()
+        for name,text_sql,epoch_sql in QUERIES:
+            print(f"\n{name}")
+            for representation,sql,parameters in (('text',text_sql,()),('epochms',epoch_sql,window(epoch_sql,now))):
+                elapsed,result,plan = measure(connections[representation],sql,parameters,args.repeats)
+                print(f"{representation:>8}: {elapsed:9.2f} ms  {plan}")
+        for connection in connections.values():
+            connection.close()
+
+#if the script is run as it self and not as a dependancy
+if __name__ == "__main__":
+    main()
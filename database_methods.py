@@ -1,104 +1,999 @@
-from datetime import date, datetime
+from datetime import date, datetime, timedelta
 import sqlite3
+import csv
+import io
 import hashlib
-from time import sleep
+import json
+import re
+import threading
+import queue
+import logging
+import os
+import sys
+import functools
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from time import sleep, perf_counter, monotonic
+#Only available on Unix, where pre-forking servers run. Elsewhere bootstrap relies on run_migrations taking the write lock.
+try:
+	import fcntl
+except ImportError:
+	fcntl = None
+
+#Location of the database file, every pooled connection points at this.
+DATABASE = './Tickets.db'
+#The most connections that can be open at once, and how long (seconds) to wait for one to be freed before giving up.
+POOL_SIZE = 8
+POOL_TIMEOUT = 10
+#Pragmas applied to every new connection. WAL lets readers carry on while a write happens, NORMAL sync is safe under WAL, the cache is ~16MB (negative values are KiB), the file is memory mapped up to 256MB and writers wait up to 5 seconds for a lock instead of failing straight away.
+PRAGMAS = (
+	('journal_mode','WAL'),
+	('synchronous','NORMAL'),
+	('cache_size',-16000),
+	('mmap_size',268435456),
+	('busy_timeout',5000),
+	('temp_store','MEMORY'),
+)
+
+#Resolved tickets are moved out of the hot database into an archive database once they are ARCHIVE_AFTER_DAYS old, see archive_resolved_tickets.
+#Every connection attaches the archive as "archive". None keeps it next to DATABASE, named after it (Tickets.db is archived to Tickets-archive.db).
+ARCHIVE_DATABASE = None
+ARCHIVE_AFTER_DAYS = 90
+#How many tickets are moved in each transaction
+ARCHIVE_BATCH_SIZE = 500
+#The archive's tables, with the same columns in the same order as the hot tables so rows are copied between them with SELECT *.
+#Derived tables (search index, indicator stats, metrics and clusters) stay in the hot database and keep covering archived tickets.
+ARCHIVE_SCHEMA = (
+	'''CREATE TABLE IF NOT EXISTS archive.tickets(id integer PRIMARY KEY, name text not null, status text not null, owner integer not null, queue integer not null,
+	content text not null, created epochms integer not null, started epochms integer, completed epochms integer, determination text, contenthash text,
+	occurrences integer not null default 1, lastseen epochms integer, knowledgemap integer)''',
+	'CREATE TABLE IF NOT EXISTS archive.comments(id integer PRIMARY KEY, comment text not null, commenter integer not null, post integer not null, datetime epochms integer not null, stage integer not null)',
+	'CREATE TABLE IF NOT EXISTS archive.keyinfo(id integer PRIMARY KEY, ticket integer, infotype text, info text)',
+	'CREATE TABLE IF NOT EXISTS archive.relationships(id integer PRIMARY KEY, ticketone not null, tickettwo not null)',
+	'CREATE INDEX IF NOT EXISTS archive.tickets_knowledgemap ON tickets(knowledgemap, created)',
+	'CREATE INDEX IF NOT EXISTS archive.tickets_created ON tickets(created)',
+	'CREATE INDEX IF NOT EXISTS archive.comments_post ON comments(post, datetime)',
+	'CREATE INDEX IF NOT EXISTS archive.keyinfo_ticket ON keyinfo(ticket)',
+	'CREATE INDEX IF NOT EXISTS archive.keyinfo_info ON keyinfo(info)',
+	'CREATE INDEX IF NOT EXISTS archive.relationships_ticketone ON relationships(ticketone)',
+	'CREATE INDEX IF NOT EXISTS archive.relationships_tickettwo ON relationships(tickettwo)',
+)
+
+#Where the archive database is kept
+def archive_path():
+	if(ARCHIVE_DATABASE):
+		return ARCHIVE_DATABASE
+	return os.path.splitext(DATABASE)[0] + '-archive.db'
+
+#Timestamps are stored as integer milliseconds since the Unix epoch, in columns declared "epochms integer", so time windows are plain integer range scans.
+#Python datetimes (naive, in local time like datetime.now()) passed to queries are converted on the way in, and epochms columns come back out as datetimes,
+#so the rest of the code keeps working with datetimes. These two functions are the only place the conversion happens.
+def to_epoch_ms(value):
+	if(value is None or isinstance(value,int)):
+		return value
+	if(isinstance(value,str)):
+		value = value.strip()
+		if(value in ("","Null","NULL","None")):
+			return None
+		value = datetime.fromisoformat(value)
+	return round(value.timestamp() * 1000)
+
+def from_epoch_ms(value):
+	if(value is None):
+		return None
+	return datetime.fromtimestamp(int(value) / 1000)
+
+sqlite3.register_adapter(datetime,to_epoch_ms)
+sqlite3.register_converter('epochms',from_epoch_ms)
+
+#The current time in epoch milliseconds, and a time in epoch milliseconds as an SQLite local time, for use inside SQL.
+EPOCH_MS_NOW = "CAST((julianday('now') - 2440587.5)*86400000 AS INTEGER)"
+def local_time_sql(column):
+	return f"{column}/1000,'unixepoch','localtime'"
+
+#Idle connections ready to be reused. Last in first out so the most recently used connection (with the warmest cache) is handed out first.
+_pool = queue.LifoQueue()
+_pool_lock = threading.Lock()
+_pool_opened = 0
+#Each thread (so each flask request) keeps hold of one connection until release_connection is called.
+_local = threading.local()
+#Counters showing how well the pool is doing: reused connections, newly opened connections, how often a caller had to wait and for how long in total.
+pool_stats = {'hits':0,'misses':0,'waits':0,'wait_time':0.0}
+
+#Statements that take longer than this (seconds), counting the time spent fetching their rows, are written to the slow query log. None turns the log off.
+SLOW_QUERY_THRESHOLD = 0.1
+#How many of the slowest statements are kept for each request
+SLOWEST_KEPT = 5
+slow_query_log = logging.getLogger('database_methods.slow_queries')
+#Totals across every thread since the process started: statements run, seconds spent running them, slow statements and connections opened.
+query_stats = {'queries':0,'time':0.0,'slow':0,'connections':0}
+_query_stats_lock = threading.Lock()
+#Literals and lists of placeholders in SQL, replaced so that statements differing only in their values are reported as one.
+NORMALISE_SQL = (
+	(re.compile(r"'(?:[^']|'')*'"),'?'),
+	(re.compile(r'\b\d+(?:\.\d+)?\b'),'?'),
+	(re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)'),'(...)'),
+	(re.compile(r'\s+'),' '),
+)
+
+def normalise_sql(sql):
+	for pattern,replacement in NORMALISE_SQL:
+		sql = pattern.sub(replacement,sql)
+	return sql.strip()
+
+#The statements, time and connections of the current thread's request, started again by reset_request_stats at the start of each flask request.
+def request_stats():
+	stats = getattr(_local,'stats',None)
+	if(stats is None):
+		stats = reset_request_stats()
+	return stats
+
+def reset_request_stats():
+	_local.stats = {'queries':0,'time':0.0,'connections':0,'slowest':[]}
+	return _local.stats
+
+#Where in the code a statement was run from: the first caller outside the instrumented cursor and connection
+def _call_site():
+	frame = sys._getframe(2)
+	while frame is not None and frame.f_code.co_filename == __file__ and frame.f_code.co_name in ('execute','executemany','executescript','_track'):
+		frame = frame.f_back
+	if(frame is None):
+		return None
+	return f"{os.path.basename(frame.f_code.co_filename)}:{frame.f_lineno} {frame.f_code.co_name}"
+
+#Cursor that times every statement (and the fetching of its rows) and counts it against the current request.
+class InstrumentedCursor(sqlite3.Cursor):
+	_statement = None
+
+	#Record time spent on the current statement, starting a new one if sql is given
+	def _track(self,elapsed,sql=None):
+		stats = request_stats()
+		stats['time'] += elapsed
+		if(sql is not None):
+			stats['queries'] += 1
+			self._statement = {'sql':sql,'time':0.0,'caller':_call_site(),'logged':False}
+			#make room by dropping the quickest of the earlier statements, the new one hasn't been timed yet
+			slowest = stats['slowest']
+			if(len(slowest) >= SLOWEST_KEPT):
+				slowest.remove(min(slowest,key=lambda statement: statement['time']))
+			slowest.append(self._statement)
+		statement = self._statement
+		slow = False
+		if(statement is not None):
+			statement['time'] += elapsed
+			#each statement is logged once, when it first goes over the threshold
+			slow = not statement['logged'] and SLOW_QUERY_THRESHOLD is not None and statement['time'] > SLOW_QUERY_THRESHOLD
+		with _query_stats_lock:
+			query_stats['time'] += elapsed
+			if(sql is not None):
+				query_stats['queries'] += 1
+			if(slow):
+				query_stats['slow'] += 1
+		if(slow):
+			statement['logged'] = True
+			slow_query_log.warning('%.1fms at %s: %s',statement['time']*1000,statement['caller'],normalise_sql(statement['sql']))
+
+	def execute(self,sql,parameters=()):
+		start = perf_counter()
+		try:
+			return super().execute(sql,parameters)
+		finally:
+			self._track(perf_counter() - start,sql)
+
+	def executemany(self,sql,parameters):
+		start = perf_counter()
+		try:
+			return super().executemany(sql,parameters)
+		finally:
+			self._track(perf_counter() - start,sql)
+
+	def executescript(self,script):
+		start = perf_counter()
+		try:
+			return super().executescript(script)
+		finally:
+			self._track(perf_counter() - start,script)
+
+	def fetchone(self):
+		start = perf_counter()
+		try:
+			return super().fetchone()
+		finally:
+			self._track(perf_counter() - start)
+
+	def fetchmany(self,size=None):
+		start = perf_counter()
+		try:
+			return super().fetchmany(self.arraysize if size is None else size)
+		finally:
+			self._track(perf_counter() - start)
+
+	def fetchall(self):
+		start = perf_counter()
+		try:
+			return super().fetchall()
+		finally:
+			self._track(perf_counter() - start)
+
+#Connection whose cursors are instrumented, including the ones made by its execute shortcuts.
+class InstrumentedConnection(sqlite3.Connection):
+	def cursor(self,factory=InstrumentedCursor):
+		return super().cursor(factory)
+
+	def execute(self,sql,parameters=()):
+		return self.cursor().execute(sql,parameters)
+
+	def executemany(self,sql,parameters):
+		return self.cursor().executemany(sql,parameters)
+
+	def executescript(self,script):
+		return self.cursor().executescript(script)
+
+#Open a brand new connection to the database and apply the tuned pragmas to it.
+def _open_connection():
+	#check_same_thread is disabled as pooled connections are handed between threads, but only ever used by one at a time.
+	#detect_types turns epochms columns back into datetimes
+	db = sqlite3.connect(DATABASE,timeout=POOL_TIMEOUT,check_same_thread=False,detect_types=sqlite3.PARSE_DECLTYPES,factory=InstrumentedConnection)
+	request_stats()['connections'] += 1
+	with _query_stats_lock:
+		query_stats['connections'] += 1
+	for pragma,value in PRAGMAS:
+		db.execute(f'PRAGMA {pragma} = {value}')
+	#attach the archive (creating it the first time), so archived tickets can be read alongside hot ones
+	db.execute('ATTACH DATABASE ? AS archive',(archive_path(),))
+	db.execute('PRAGMA archive.journal_mode = WAL')
+	for statement in ARCHIVE_SCHEMA:
+		db.execute(statement)
+	return db
+
+#Every row of a table, from the hot database and the archive, used in a FROM clause in place of the table. Conditions on it are applied to each database's own indexes.
+#columns picks the columns, so it can also be used while migrating a hot table that doesn't have all of its columns yet.
+def hot_and_archived(table,columns='*'):
+	return f'(SELECT {columns} FROM main.{table} UNION ALL SELECT {columns} FROM archive.{table})'
+
+#Take a connection from the pool, opening a new one if the pool isn't full yet, otherwise wait for one to be released.
+def _acquire_connection():
+	global _pool_opened
+	try:
+		db = _pool.get_nowait()
+		with _pool_lock:
+			pool_stats['hits'] += 1
+		return db
+	except queue.Empty:
+		pass
+
+	with _pool_lock:
+		can_open = _pool_opened < POOL_SIZE
+		if(can_open):
+			_pool_opened += 1
+			pool_stats['misses'] += 1
+
+	if(can_open):
+		try:
+			return _open_connection()
+		except sqlite3.Error:
+			#the connection never opened, so give its place in the pool back.
+			with _pool_lock:
+				_pool_opened -= 1
+			raise
+
+	#Every connection is in use, wait for one to be released and record how long it took.
+	start = perf_counter()
+	try:
+		return _pool.get(timeout=POOL_TIMEOUT)
+	except queue.Empty:
+		raise sqlite3.OperationalError('Timed out waiting for a free database connection')
+	finally:
+		with _pool_lock:
+			pool_stats['waits'] += 1
+			pool_stats['wait_time'] += perf_counter() - start
 
 def db_connection():
-	#Connect to or create a database file, store connection as a variable.
-	db = sqlite3.connect('./Tickets.db')
+	#Reuse the connection this thread already holds, otherwise check one out of the pool. It is kept until release_connection is called (at the end of each flask request).
+	db = getattr(_local,'db',None)
+	if(db is None):
+		db = _acquire_connection()
+		_local.db = db
 	#Create a cursor (allows commands/queries to be run)
 	cur = db.cursor()
 	#pass the database connection and cursor connection
 	return db,cur
 
+#Hand the current thread's connection back to the pool. Anything left uncommitted is rolled back so the next user starts clean.
+#A connection that has been closed or can't be rolled back is dropped, and a new one takes its place so threads waiting on the pool still get one.
+def release_connection():
+	global _pool_opened
+	db = getattr(_local,'db',None)
+	if(db is None):
+		return
+	_local.db = None
+	try:
+		if(db.in_transaction):
+			db.rollback()
+	except sqlite3.Error:
+		try:
+			db.close()
+		except sqlite3.Error:
+			pass
+		try:
+			db = _open_connection()
+		except sqlite3.Error:
+			with _pool_lock:
+				_pool_opened -= 1
+			return
+	_pool.put(db)
+
+#Close every idle connection in the pool, used when shutting down.
+def close_pool():
+	global _pool_opened
+	stop_writer()
+	release_connection()
+	while True:
+		try:
+			db = _pool.get_nowait()
+		except queue.Empty:
+			break
+		db.close()
+		with _pool_lock:
+			_pool_opened -= 1
+
+#Return a snapshot of the pool counters, along with how many connections are open and idle.
+def get_pool_stats():
+	with _pool_lock:
+		stats = dict(pool_stats)
+		stats['open'] = _pool_opened
+	stats['idle'] = _pool.qsize()
+	return stats
+
+#All writes go through one writer thread, which owns the only connection that writes. Write functions (marked with @write_operation) are queued,
+#and the writer runs everything waiting in the queue, plus anything arriving within WRITE_BATCH_WINDOW seconds, up to WRITE_BATCH_SIZE writes,
+#in one transaction. Each write gets a savepoint so a failing write is undone on its own without losing the rest of the group.
+#Callers get a Future for each write's result. Under WAL, reads carry on on the pooled connections while the writer commits.
+#If the writer can't open its connection, or stops on an unexpected error, every write waiting on it fails with that error and the next write starts a new writer.
+WRITE_BATCH_WINDOW = 0.002
+WRITE_BATCH_SIZE = 200
+#How long (seconds) a write waits for the writer before giving up. A write that has already started may still commit after this.
+WRITE_TIMEOUT = 30
+_write_queue = queue.Queue()
+_writer = None
+_writer_pid = None
+_writer_cursor = None
+_writer_lock = threading.Lock()
+#Counters showing how well writes are grouped: writes run, writes that failed, and transactions committed.
+writer_stats = {'writes':0,'failures':0,'commits':0}
+writer_log = logging.getLogger('database_methods.writer')
+
+#Return a snapshot of the writer counters, along with how many writes are waiting in the queue.
+def get_writer_stats():
+	with _pool_lock:
+		stats = dict(writer_stats)
+	stats['queued'] = _write_queue.qsize()
+	return stats
+
+#Start the writer thread if it isn't running, or if this is a new process forked from the one that started it. Called holding _writer_lock.
+def _start_writer():
+	global _writer,_writer_pid
+	if(_writer is None or _writer_pid != os.getpid() or not _writer.is_alive()):
+		_writer = threading.Thread(target=_write_loop,name='database-writer',daemon=True)
+		_writer_pid = os.getpid()
+		_writer.start()
+
+#Queue a write, returning a Future for its result. operation is called on the writer thread with the writer's cursor followed by the arguments given.
+#A write made by another write (so on the writer thread) runs straight away, in the same transaction.
+#The write's statements and time are counted against the request that queued it (see request_stats), not the writer thread.
+def submit_write(operation,*args,**kwargs):
+	future = Future()
+	if(threading.current_thread() is _writer and _writer_cursor is not None):
+		future.set_running_or_notify_cancel()
+		try:
+			future.set_result(operation(_writer_cursor,*args,**kwargs))
+		except Exception as error:
+			future.set_exception(error)
+		return future
+	#queued while holding the lock, so a writer that is failing either fails this write too or has already made way for a new writer
+	with _writer_lock:
+		_start_writer()
+		_write_queue.put((future,operation,args,kwargs,request_stats()))
+	return future
+
+#Queue a write and wait (up to WRITE_TIMEOUT seconds) for its result, raising any error it raised.
+def write(operation,*args,**kwargs):
+	future = submit_write(operation,*args,**kwargs)
+	try:
+		return future.result(timeout=WRITE_TIMEOUT)
+	except FutureTimeoutError:
+		#stop it running later if the writer hasn't got to it yet
+		future.cancel()
+		raise sqlite3.OperationalError('Timed out waiting for the database writer')
+
+#Marks a function as a write. The function takes the writer's cursor as its first argument, and must only use that cursor, never db_connection.
+#Calling the decorated function (without the cursor) queues it and waits for its result, calling .submit instead returns a Future.
+def write_operation(function):
+	@functools.wraps(function)
+	def run(*args,**kwargs):
+		return write(function,*args,**kwargs)
+	run.submit = functools.partial(submit_write,function)
+	return run
+
+#Take the next group of writes off the queue: everything waiting, then whatever arrives within the window. A None in the queue stops the writer.
+def _next_write_group():
+	group = [_write_queue.get()]
+	deadline = monotonic() + WRITE_BATCH_WINDOW
+	while(group[-1] is not None and len(group) < WRITE_BATCH_SIZE):
+		remaining = deadline - monotonic()
+		try:
+			group.append(_write_queue.get(timeout=remaining) if remaining > 0 else _write_queue.get_nowait())
+		except queue.Empty:
+			break
+	return group
+
+def _write_loop():
+	global _writer_cursor
+	group = []
+	try:
+		db = _open_connection()
+		#transactions are managed here rather than by the sqlite3 module
+		db.isolation_level = None
+		_writer_cursor = cur = db.cursor()
+		try:
+			while True:
+				group = _next_write_group()
+				stopping = group[-1] is None
+				writes = [item for item in group if item is not None and item[0].set_running_or_notify_cancel()]
+				if(writes):
+					_commit_write_group(cur,writes)
+				if(stopping):
+					return
+		finally:
+			_writer_cursor = None
+			db.close()
+	except Exception as error:
+		writer_log.exception('The database writer stopped')
+		_fail_writes(group,error)
+
+#Fail the writes of the group the writer was working on and every write still queued, once the writer has stopped on an error.
+#The writer is forgotten while holding _writer_lock, so any write queued after this starts a new writer instead of waiting forever.
+def _fail_writes(group,error):
+	global _writer
+	failed = 0
+	with _writer_lock:
+		if(_writer is threading.current_thread()):
+			_writer = None
+		while True:
+			try:
+				group.append(_write_queue.get_nowait())
+			except queue.Empty:
+				break
+	for item in group:
+		if(item is None or item[0].done()):
+			continue
+		future = item[0]
+		#a write still waiting could be cancelled by its caller at any moment, set_running_or_notify_cancel settles which happened first
+		if(future.running() or future.set_running_or_notify_cancel()):
+			future.set_exception(error)
+			failed += 1
+	with _pool_lock:
+		writer_stats['writes'] += failed
+		writer_stats['failures'] += failed
+
+#Run a group of writes in one transaction, then hand each caller its result once the transaction has committed.
+#While each write runs the writer thread counts statements against the stats of the request that queued it, the BEGIN and COMMIT count against its own.
+def _commit_write_group(cur,writes):
+	outcomes = []
+	own_stats = request_stats()
+	try:
+		cur.execute('BEGIN IMMEDIATE')
+		for future,operation,args,kwargs,stats in writes:
+			_local.stats = stats
+			try:
+				cur.execute('SAVEPOINT write')
+				try:
+					result = operation(cur,*args,**kwargs)
+				except Exception as error:
+					cur.execute('ROLLBACK TO write')
+					outcomes.append((future,None,error))
+				else:
+					outcomes.append((future,result,None))
+				cur.execute('RELEASE write')
+			finally:
+				_local.stats = own_stats
+		cur.execute('COMMIT')
+	except sqlite3.Error as error:
+		#the whole group is lost (most likely the database was locked by another process for longer than the busy timeout)
+		if(cur.connection.in_transaction):
+			cur.execute('ROLLBACK')
+		with _pool_lock:
+			writer_stats['writes'] += len(writes)
+			writer_stats['failures'] += len(writes)
+		for future,operation,args,kwargs,stats in writes:
+			future.set_exception(error)
+		return
+	with _pool_lock:
+		writer_stats['writes'] += len(writes)
+		writer_stats['failures'] += sum(1 for future,result,error in outcomes if error is not None)
+		writer_stats['commits'] += 1
+	#let live queue pages know tickets may have changed
+	notify_changes()
+	for future,result,error in outcomes:
+		if(error is None):
+			future.set_result(result)
+		else:
+			future.set_exception(error)
+
+#Finish every queued write and stop the writer thread, used when shutting down.
+def stop_writer():
+	global _writer
+	with _writer_lock:
+		writer = _writer
+		_writer = None
+	if(writer is not None and writer.is_alive() and _writer_pid == os.getpid()):
+		_write_queue.put(None)
+		writer.join()
+
+#Schema migrations, in the order they must be applied. Each is a version number and the steps that bring the database up to that version, steps are either SQL statements or functions that take a cursor.
+#Only ever append to this list, a database remembers the highest version it has reached in the schema_version table.
+MIGRATIONS = [
+	#Version 1, the original tables. IF NOT EXISTS lets databases created before migrations existed adopt the schema without changes.
+	(1,(
+		'''CREATE TABLE IF NOT EXISTS tickets(
+		id integer PRIMARY KEY,
+		name text not null,
+		status text not null,
+		owner integer not null,
+		queue integer not null,
+		content text not null,
+		created text not null,
+		started text,
+		completed text,
+		determination text
+		)''',
+		'''CREATE TABLE IF NOT EXISTS queue(
+		id integer PRIMARY KEY,
+		name text not null
+		)''',
+		'''CREATE TABLE IF NOT EXISTS users(
+		id integer PRIMARY KEY,
+		name text not null,
+		pwd text not null,
+		email text not null,
+		queue integer not null
+		)''',
+		'''CREATE TABLE IF NOT EXISTS keyinfo(
+		id integer PRIMARY KEY,
+		ticket integer,
+		infotype text,
+		info text
+		)''',
+		'''CREATE TABLE IF NOT EXISTS comments(
+		id integer PRIMARY KEY,
+		comment text not null,
+		commenter integer not null,
+		post integer not null,
+		datetime text not null,
+		stage integer not null
+		)''',
+		'''CREATE TABLE IF NOT EXISTS relationships(
+		id integer PRIMARY KEY,
+		ticketone not null,
+		tickettwo not null
+		)''',
+		'''CREATE TABLE IF NOT EXISTS knowledgemap(
+		id integer PRIMARY KEY,
+		title text not null,
+		body text not null
+		)''',
+		'''CREATE TABLE IF NOT EXISTS knowledge(
+		id integer PRIMARY KEY,
+		knowledgemap integer not null,
+		title text not null,
+		body text not null
+		)''',
+	)),
+	#Version 2, indexes for the hot lookups. Duplicate key info and relationships are removed first so the unique indexes can be built.
+	(2,(
+		'DELETE FROM keyinfo WHERE id NOT IN (SELECT MIN(id) FROM keyinfo GROUP BY ticket, info)',
+		'DELETE FROM relationships WHERE id NOT IN (SELECT MIN(id) FROM relationships GROUP BY ticketone, tickettwo)',
+		'CREATE UNIQUE INDEX IF NOT EXISTS keyinfo_ticket_info ON keyinfo(ticket, info)',
+		'CREATE INDEX IF NOT EXISTS keyinfo_info ON keyinfo(info)',
+		'CREATE UNIQUE INDEX IF NOT EXISTS relationships_pair ON relationships(ticketone, tickettwo)',
+		'CREATE INDEX IF NOT EXISTS relationships_tickettwo ON relationships(tickettwo)',
+		'CREATE INDEX IF NOT EXISTS comments_post ON comments(post, datetime)',
+		'CREATE INDEX IF NOT EXISTS tickets_queue_status ON tickets(queue, status)',
+		'CREATE INDEX IF NOT EXISTS tickets_owner_status ON tickets(owner, status)',
+		'CREATE INDEX IF NOT EXISTS tickets_created ON tickets(created)',
+		'CREATE INDEX IF NOT EXISTS tickets_started ON tickets(started)',
+		'CREATE INDEX IF NOT EXISTS tickets_completed ON tickets(completed)',
+		'CREATE INDEX IF NOT EXISTS users_name ON users(name)',
+		'CREATE INDEX IF NOT EXISTS knowledge_knowledgemap ON knowledge(knowledgemap)',
+	)),
+	#Version 3, full text search index over ticket titles and bodies, comments and key info, kept up to date by triggers.
+	#Rows are keyed by the source row's id times 4 plus a source number (0 ticket, 1 comment, 2 key info), so the triggers can find them directly.
+	(3,(
+		'''CREATE VIRTUAL TABLE IF NOT EXISTS search_index USING fts5(
+		ticket UNINDEXED,
+		title,
+		body,
+		tokenize = 'unicode61 remove_diacritics 2'
+		)''',
+		'''CREATE TRIGGER IF NOT EXISTS tickets_search_insert AFTER INSERT ON tickets BEGIN
+		INSERT INTO search_index (rowid,ticket,title,body) VALUES (new.id*4,new.id,new.name,new.content);
+		END''',
+		'''CREATE TRIGGER IF NOT EXISTS tickets_search_update AFTER UPDATE OF name,content ON tickets BEGIN
+		UPDATE search_index SET title = new.name, body = new.content WHERE rowid = new.id*4;
+		END''',
+		'''CREATE TRIGGER IF NOT EXISTS tickets_search_delete AFTER DELETE ON tickets BEGIN
+		DELETE FROM search_index WHERE rowid = old.id*4;
+		END''',
+		'''CREATE TRIGGER IF NOT EXISTS comments_search_insert AFTER INSERT ON comments BEGIN
+		INSERT INTO search_index (rowid,ticket,title,body) VALUES (new.id*4+1,new.post,'',new.comment);
+		END''',
+		'''CREATE TRIGGER IF NOT EXISTS comments_search_update AFTER UPDATE OF comment,post ON comments BEGIN
+		UPDATE search_index SET ticket = new.post, body = new.comment WHERE rowid = new.id*4+1;
+		END''',
+		'''CREATE TRIGGER IF NOT EXISTS comments_search_delete AFTER DELETE ON comments BEGIN
+		DELETE FROM search_index WHERE rowid = old.id*4+1;
+		END''',
+		'''CREATE TRIGGER IF NOT EXISTS keyinfo_search_insert AFTER INSERT ON keyinfo BEGIN
+		INSERT INTO search_index (rowid,ticket,title,body) VALUES (new.id*4+2,new.ticket,'',COALESCE(new.infotype,'') || ' ' || COALESCE(new.info,''));
+		END''',
+		'''CREATE TRIGGER IF NOT EXISTS keyinfo_search_update AFTER UPDATE OF ticket,infotype,info ON keyinfo BEGIN
+		UPDATE search_index SET ticket = new.ticket, body = COALESCE(new.infotype,'') || ' ' || COALESCE(new.info,'') WHERE rowid = new.id*4+2;
+		END''',
+		'''CREATE TRIGGER IF NOT EXISTS keyinfo_search_delete AFTER DELETE ON keyinfo BEGIN
+		DELETE FROM search_index WHERE rowid = old.id*4+2;
+		END''',
+		lambda cur: _fill_search_index(cur),
+	)),
+	#Version 4, a hash of each ticket's queue, title and body so repeated alerts can be spotted with an index lookup, plus a count of how many times the alert was seen and when it was last seen.
+	(4,(
+		'ALTER TABLE tickets ADD COLUMN contenthash text',
+		'ALTER TABLE tickets ADD COLUMN occurrences integer not null default 1',
+		'ALTER TABLE tickets ADD COLUMN lastseen text',
+		'UPDATE tickets SET lastseen = created',
+		lambda cur: _backfill_content_hashes(cur),
+		'CREATE INDEX IF NOT EXISTS tickets_contenthash ON tickets(contenthash)',
+	)),
+	#Version 5, network events read from log files (like incident.log), indexed by source and destination IP so they can be matched to ticket key info, and how far through each log file has been read.
+	(5,(
+		'''CREATE TABLE IF NOT EXISTS events(
+		id integer PRIMARY KEY,
+		occurred text not null,
+		protocol text,
+		source text,
+		destination text,
+		action text,
+		result text
+		)''',
+		'CREATE INDEX IF NOT EXISTS events_source ON events(source, occurred)',
+		'CREATE INDEX IF NOT EXISTS events_destination ON events(destination, occurred)',
+		'CREATE INDEX IF NOT EXISTS events_occurred ON events(occurred)',
+		'''CREATE TABLE IF NOT EXISTS logsources(
+		path text PRIMARY KEY,
+		position integer not null,
+		inode integer
+		)''',
+	)),
+	#Version 6, a log of ticket changes per queue written by triggers, so every process (web workers, email ingestion) sees the same changes. Used to push live updates to open queue pages.
+	#Only the most recent changes are kept, every 1000th change clears out anything more than 10000 changes old.
+	(6,(
+		'''CREATE TABLE IF NOT EXISTS changes(
+		id integer PRIMARY KEY AUTOINCREMENT,
+		ticket integer not null,
+		queue integer not null,
+		change text not null
+		)''',
+		'CREATE INDEX IF NOT EXISTS changes_queue ON changes(queue, id)',
+		'''CREATE TRIGGER IF NOT EXISTS tickets_change_insert AFTER INSERT ON tickets BEGIN
+		INSERT INTO changes (ticket,queue,change) VALUES (new.id,new.queue,'created');
+		END''',
+		'''CREATE TRIGGER IF NOT EXISTS tickets_change_update AFTER UPDATE OF name,status,owner,queue ON tickets BEGIN
+		INSERT INTO changes (ticket,queue,change) VALUES (new.id,new.queue,CASE
+			WHEN new.status = 'Resolved' AND old.status != 'Resolved' THEN 'resolved'
+			WHEN new.owner != old.owner THEN 'taken'
+			WHEN new.status != old.status THEN 'status'
+			ELSE 'updated' END);
+		INSERT INTO changes (ticket,queue,change) SELECT new.id,old.queue,'moved' WHERE old.queue != new.queue;
+		END''',
+		'''CREATE TRIGGER IF NOT EXISTS changes_prune AFTER INSERT ON changes WHEN new.id % 1000 = 0 BEGIN
+		DELETE FROM changes WHERE id <= new.id - 10000;
+		END''',
+	)),
+	#Version 7, indexes over open tickets only, in the order queues and profiles list them, so a page of tickets is read straight from the index.
+	(7,(
+		"CREATE INDEX IF NOT EXISTS tickets_open_queue ON tickets(queue, status, created, id) WHERE status != 'Resolved'",
+		"CREATE INDEX IF NOT EXISTS tickets_open_owner ON tickets(owner, created, id) WHERE status != 'Resolved'",
+	)),
+	#Version 8, incident clusters, the groups of tickets linked to each other directly or through other tickets.
+	#Every ticket with a relationship points at the root ticket of its cluster, tickets without any are a cluster on their own and aren't stored.
+	(8,(
+		'''CREATE TABLE IF NOT EXISTS clusters(
+		ticket integer PRIMARY KEY,
+		root integer not null
+		)''',
+		'CREATE INDEX IF NOT EXISTS clusters_root ON clusters(root)',
+		'''CREATE TABLE IF NOT EXISTS clustersizes(
+		root integer PRIMARY KEY,
+		size integer not null
+		)''',
+		lambda cur: _fill_clusters(cur),
+	)),
+	#Version 9, the knowledge mapping named in a ticket's title (INC<id>), stored when the ticket is created or edited instead of searching titles for it.
+	(9,(
+		'ALTER TABLE tickets ADD COLUMN knowledgemap integer',
+		lambda cur: _backfill_knowledge_mappings(cur),
+		'CREATE INDEX IF NOT EXISTS tickets_knowledgemap ON tickets(knowledgemap, created)',
+	)),
+	#Version 10, reputation of each indicator (key info value, lower cased and trimmed), how often it has been seen, how often its tickets were resolved and false positives,
+	#when it was first and last seen, and sightings per day for recent volume. Kept up to date by triggers whenever key info is added, changed or removed, or a ticket is resolved or reopened.
+	(10,(
+		'''CREATE TABLE IF NOT EXISTS ioc_stats(
+		indicator text PRIMARY KEY,
+		sightings integer not null,
+		resolved integer not null,
+		false_positives integer not null,
+		first_seen text,
+		last_seen text
+		)''',
+		'''CREATE TABLE IF NOT EXISTS ioc_days(
+		indicator text not null,
+		day text not null,
+		sightings integer not null,
+		PRIMARY KEY (indicator, day)
+		)''',
+		'''CREATE TRIGGER IF NOT EXISTS keyinfo_ioc_insert AFTER INSERT ON keyinfo BEGIN
+		INSERT INTO ioc_stats (indicator,sightings,resolved,false_positives,first_seen,last_seen)
+			SELECT lower(trim(new.info)),1,status IS 'Resolved',status IS 'Resolved' AND determination IS 'False Positive',created,created FROM tickets WHERE id = new.ticket
+			ON CONFLICT(indicator) DO UPDATE SET sightings = sightings + 1, resolved = resolved + excluded.resolved, false_positives = false_positives + excluded.false_positives,
+			first_seen = min(COALESCE(first_seen,excluded.first_seen),excluded.first_seen), last_seen = max(COALESCE(last_seen,excluded.last_seen),excluded.last_seen);
+		INSERT INTO ioc_days (indicator,day,sightings) SELECT lower(trim(new.info)),date(created),1 FROM tickets WHERE id = new.ticket
+			ON CONFLICT(indicator,day) DO UPDATE SET sightings = sightings + 1;
+		END''',
+		'''CREATE TRIGGER IF NOT EXISTS keyinfo_ioc_delete AFTER DELETE ON keyinfo BEGIN
+		UPDATE ioc_stats SET sightings = sightings - 1,
+			resolved = resolved - COALESCE((SELECT status IS 'Resolved' FROM tickets WHERE id = old.ticket),0),
+			false_positives = false_positives - COALESCE((SELECT status IS 'Resolved' AND determination IS 'False Positive' FROM tickets WHERE id = old.ticket),0)
+			WHERE indicator = lower(trim(old.info));
+		DELETE FROM ioc_stats WHERE indicator = lower(trim(old.info)) AND sightings <= 0;
+		UPDATE ioc_days SET sightings = sightings - 1 WHERE indicator = lower(trim(old.info)) AND day = (SELECT date(created) FROM tickets WHERE id = old.ticket);
+		DELETE FROM ioc_days WHERE indicator = lower(trim(old.info)) AND sightings <= 0;
+		END''',
+		'''CREATE TRIGGER IF NOT EXISTS keyinfo_ioc_update AFTER UPDATE OF info,ticket ON keyinfo BEGIN
+		UPDATE ioc_stats SET sightings = sightings - 1,
+			resolved = resolved - COALESCE((SELECT status IS 'Resolved' FROM tickets WHERE id = old.ticket),0),
+			false_positives = false_positives - COALESCE((SELECT status IS 'Resolved' AND determination IS 'False Positive' FROM tickets WHERE id = old.ticket),0)
+			WHERE indicator = lower(trim(old.info));
+		DELETE FROM ioc_stats WHERE indicator = lower(trim(old.info)) AND sightings <= 0;
+		UPDATE ioc_days SET sightings = sightings - 1 WHERE indicator = lower(trim(old.info)) AND day = (SELECT date(created) FROM tickets WHERE id = old.ticket);
+		DELETE FROM ioc_days WHERE indicator = lower(trim(old.info)) AND sightings <= 0;
+		INSERT INTO ioc_stats (indicator,sightings,resolved,false_positives,first_seen,last_seen)
+			SELECT lower(trim(new.info)),1,status IS 'Resolved',status IS 'Resolved' AND determination IS 'False Positive',created,created FROM tickets WHERE id = new.ticket
+			ON CONFLICT(indicator) DO UPDATE SET sightings = sightings + 1, resolved = resolved + excluded.resolved, false_positives = false_positives + excluded.false_positives,
+			first_seen = min(COALESCE(first_seen,excluded.first_seen),excluded.first_seen), last_seen = max(COALESCE(last_seen,excluded.last_seen),excluded.last_seen);
+		INSERT INTO ioc_days (indicator,day,sightings) SELECT lower(trim(new.info)),date(created),1 FROM tickets WHERE id = new.ticket
+			ON CONFLICT(indicator,day) DO UPDATE SET sightings = sightings + 1;
+		END''',
+		#resolving, reopening or changing the determination of a ticket moves its indicators' resolved and false positive counts, once for each key info row on the ticket
+		'''CREATE TRIGGER IF NOT EXISTS tickets_ioc_resolve AFTER UPDATE OF status,determination ON tickets
+		WHEN (old.status IS 'Resolved') != (new.status IS 'Resolved') OR (old.status IS 'Resolved' AND old.determination IS 'False Positive') != (new.status IS 'Resolved' AND new.determination IS 'False Positive') BEGIN
+		UPDATE ioc_stats SET
+			resolved = resolved + ((new.status IS 'Resolved') - (old.status IS 'Resolved')) * (SELECT COUNT(*) FROM keyinfo WHERE ticket = new.id AND lower(trim(info)) = ioc_stats.indicator),
+			false_positives = false_positives + ((new.status IS 'Resolved' AND new.determination IS 'False Positive') - (old.status IS 'Resolved' AND old.determination IS 'False Positive')) * (SELECT COUNT(*) FROM keyinfo WHERE ticket = new.id AND lower(trim(info)) = ioc_stats.indicator)
+			WHERE indicator IN (SELECT lower(trim(info)) FROM keyinfo WHERE ticket = new.id);
+		END''',
+		lambda cur: _fill_ioc_stats(cur),
+	)),
+	#Version 11, ticket metrics rolled up per queue and analyst into minute and hour buckets, so reports over any range add up buckets instead of going through every ticket.
+	(11,(
+		'''CREATE TABLE IF NOT EXISTS metrics(
+		granularity text not null,
+		bucket text not null,
+		queue integer not null,
+		analyst integer not null,
+		created integer not null default 0,
+		taken integer not null default 0,
+		resolved integer not null default 0,
+		false_positives integer not null default 0,
+		response_total real not null default 0,
+		responses integer not null default 0,
+		resolution_total real not null default 0,
+		resolutions integer not null default 0,
+		sla_breaches integer not null default 0,
+		PRIMARY KEY (granularity, bucket, queue, analyst)
+		)''',
+		lambda cur: _create_metric_triggers(cur),
+		lambda cur: _fill_metrics(cur),
+	)),
+	#Version 12, timestamps stored as integer epoch milliseconds (see to_epoch_ms) with NULL for missing times, instead of text, so time windows are integer range scans on the indexes.
+	#The tickets and comments tables are rebuilt with the new column types, and everything derived from their timestamps is recreated to match.
+	(12,(
+		lambda cur: _retype_columns(cur,'tickets',('created','started','completed','lastseen')),
+		lambda cur: _retype_columns(cur,'comments',('datetime',)),
+		'DROP TRIGGER IF EXISTS keyinfo_ioc_insert',
+		'DROP TRIGGER IF EXISTS keyinfo_ioc_delete',
+		'DROP TRIGGER IF EXISTS keyinfo_ioc_update',
+		'DROP TABLE IF EXISTS ioc_stats',
+		'''CREATE TABLE ioc_stats(
+		indicator text PRIMARY KEY,
+		sightings integer not null,
+		resolved integer not null,
+		false_positives integer not null,
+		first_seen epochms integer,
+		last_seen epochms integer
+		)''',
+		'''CREATE TRIGGER keyinfo_ioc_insert AFTER INSERT ON keyinfo BEGIN
+		INSERT INTO ioc_stats (indicator,sightings,resolved,false_positives,first_seen,last_seen)
+			SELECT lower(trim(new.info)),1,status IS 'Resolved',status IS 'Resolved' AND determination IS 'False Positive',created,created FROM tickets WHERE id = new.ticket
+			ON CONFLICT(indicator) DO UPDATE SET sightings = sightings + 1, resolved = resolved + excluded.resolved, false_positives = false_positives + excluded.false_positives,
+			first_seen = min(COALESCE(first_seen,excluded.first_seen),excluded.first_seen), last_seen = max(COALESCE(last_seen,excluded.last_seen),excluded.last_seen);
+		INSERT INTO ioc_days (indicator,day,sightings) SELECT lower(trim(new.info)),date(created/1000,'unixepoch','localtime'),1 FROM tickets WHERE id = new.ticket
+			ON CONFLICT(indicator,day) DO UPDATE SET sightings = sightings + 1;
+		END''',
+		'''CREATE TRIGGER keyinfo_ioc_delete AFTER DELETE ON keyinfo BEGIN
+		UPDATE ioc_stats SET sightings = sightings - 1,
+			resolved = resolved - COALESCE((SELECT status IS 'Resolved' FROM tickets WHERE id = old.ticket),0),
+			false_positives = false_positives - COALESCE((SELECT status IS 'Resolved' AND determination IS 'False Positive' FROM tickets WHERE id = old.ticket),0)
+			WHERE indicator = lower(trim(old.info));
+		DELETE FROM ioc_stats WHERE indicator = lower(trim(old.info)) AND sightings <= 0;
+		UPDATE ioc_days SET sightings = sightings - 1 WHERE indicator = lower(trim(old.info)) AND day = (SELECT date(created/1000,'unixepoch','localtime') FROM tickets WHERE id = old.ticket);
+		DELETE FROM ioc_days WHERE indicator = lower(trim(old.info)) AND sightings <= 0;
+		END''',
+		'''CREATE TRIGGER keyinfo_ioc_update AFTER UPDATE OF info,ticket ON keyinfo BEGIN
+		UPDATE ioc_stats SET sightings = sightings - 1,
+			resolved = resolved - COALESCE((SELECT status IS 'Resolved' FROM tickets WHERE id = old.ticket),0),
+			false_positives = false_positives - COALESCE((SELECT status IS 'Resolved' AND determination IS 'False Positive' FROM tickets WHERE id = old.ticket),0)
+			WHERE indicator = lower(trim(old.info));
+		DELETE FROM ioc_stats WHERE indicator = lower(trim(old.info)) AND sightings <= 0;
+		UPDATE ioc_days SET sightings = sightings - 1 WHERE indicator = lower(trim(old.info)) AND day = (SELECT date(created/1000,'unixepoch','localtime') FROM tickets WHERE id = old.ticket);
+		DELETE FROM ioc_days WHERE indicator = lower(trim(old.info)) AND sightings <= 0;
+		INSERT INTO ioc_stats (indicator,sightings,resolved,false_positives,first_seen,last_seen)
+			SELECT lower(trim(new.info)),1,status IS 'Resolved',status IS 'Resolved' AND determination IS 'False Positive',created,created FROM tickets WHERE id = new.ticket
+			ON CONFLICT(indicator) DO UPDATE SET sightings = sightings + 1, resolved = resolved + excluded.resolved, false_positives = false_positives + excluded.false_positives,
+			first_seen = min(COALESCE(first_seen,excluded.first_seen),excluded.first_seen), last_seen = max(COALESCE(last_seen,excluded.last_seen),excluded.last_seen);
+		INSERT INTO ioc_days (indicator,day,sightings) SELECT lower(trim(new.info)),date(created/1000,'unixepoch','localtime'),1 FROM tickets WHERE id = new.ticket
+			ON CONFLICT(indicator,day) DO UPDATE SET sightings = sightings + 1;
+		END''',
+		lambda cur: _fill_ioc_stats(cur),
+		lambda cur: _create_metric_triggers(cur),
+		lambda cur: _fill_metrics(cur),
+	)),
+	#Version 13, a generation number bumped by any change to the users or queue tables, so every process knows when its cached copy of them (see _metadata) is out of date.
+	(13,(
+		'CREATE TABLE IF NOT EXISTS metadata_generation(id integer PRIMARY KEY, generation integer not null)',
+		'INSERT OR IGNORE INTO metadata_generation (id,generation) VALUES (1,0)',
+		'CREATE TRIGGER IF NOT EXISTS users_generation_insert AFTER INSERT ON users BEGIN UPDATE metadata_generation SET generation = generation + 1; END',
+		'CREATE TRIGGER IF NOT EXISTS users_generation_update AFTER UPDATE OF id,name,queue ON users BEGIN UPDATE metadata_generation SET generation = generation + 1; END',
+		'CREATE TRIGGER IF NOT EXISTS users_generation_delete AFTER DELETE ON users BEGIN UPDATE metadata_generation SET generation = generation + 1; END',
+		'CREATE TRIGGER IF NOT EXISTS queue_generation_insert AFTER INSERT ON queue BEGIN UPDATE metadata_generation SET generation = generation + 1; END',
+		'CREATE TRIGGER IF NOT EXISTS queue_generation_update AFTER UPDATE OF id,name ON queue BEGIN UPDATE metadata_generation SET generation = generation + 1; END',
+		'CREATE TRIGGER IF NOT EXISTS queue_generation_delete AFTER DELETE ON queue BEGIN UPDATE metadata_generation SET generation = generation + 1; END',
+	)),
+	#Version 14, the archive (see archive_resolved_tickets). The archiving table holds a row while tickets are being moved to or from the archive,
+	#which holds off the triggers that count rows added to or removed from the hot tables, as the tables they maintain already cover archived tickets.
+	(14,(
+		'CREATE TABLE IF NOT EXISTS archiving(id integer PRIMARY KEY)',
+		lambda cur: _guard_triggers(cur,ARCHIVE_GUARDED_TRIGGERS),
+		lambda cur: _create_metric_triggers(cur),
+	)),
+	#Version 15, ids of tickets, comments, key info and relationships are never handed out again once used. Without AUTOINCREMENT SQLite reuses the highest id
+	#after it is deleted, which could be the id of an archived row (or one the search index still counts through the archive).
+	(15,(
+		lambda cur: _autoincrement_ids(cur,'tickets'),
+		lambda cur: _autoincrement_ids(cur,'comments'),
+		lambda cur: _autoincrement_ids(cur,'keyinfo'),
+		lambda cur: _autoincrement_ids(cur,'relationships'),
+	)),
+]
+
+#The triggers held off while tickets are moved to or from the archive, and the condition that holds them off. tickets_metrics_insert is guarded by _create_metric_triggers.
+ARCHIVE_GUARDED_TRIGGERS = (
+	'tickets_search_insert','tickets_search_delete','tickets_change_insert',
+	'comments_search_insert','comments_search_delete',
+	'keyinfo_search_insert','keyinfo_search_delete','keyinfo_ioc_insert','keyinfo_ioc_delete',
+)
+ARCHIVE_GUARD = 'WHEN NOT EXISTS (SELECT 1 FROM archiving)'
+
+#Recreate triggers with the archive guard as their condition, none of them have a condition of their own.
+def _guard_triggers(cur,triggers):
+	for name in triggers:
+		sql = cur.execute('SELECT sql FROM sqlite_master WHERE type = "trigger" AND name = ?',(name,)).fetchone()[0]
+		cur.execute(f'DROP TRIGGER {name}')
+		cur.execute(re.sub(r'\s+BEGIN\b',f' {ARCHIVE_GUARD} BEGIN',sql,count=1))
+
+#Bring the database schema up to the latest version, applying any migrations it hasn't had yet. Safe to run any number of times and from several processes at once.
+def run_migrations():
+	db,cur = db_connection()
+	cur.execute('CREATE TABLE IF NOT EXISTS schema_version(version integer PRIMARY KEY, applied text not null)')
+	db.commit()
+
+	for version,steps in MIGRATIONS:
+		#Take the write lock before checking the version, so two processes can't both apply the same migration.
+		cur.execute('BEGIN IMMEDIATE')
+		if(cur.execute('SELECT 1 FROM schema_version WHERE version = ?',(version,)).fetchone()):
+			db.rollback()
+			continue
+		try:
+			for step in steps:
+				if(callable(step)):
+					step(cur)
+				else:
+					cur.execute(step)
+			cur.execute('INSERT INTO schema_version (version,applied) VALUES (?,?)',(version,datetime.now(),))
+			db.commit()
+		except sqlite3.Error:
+			#Leave the database at the last version that fully applied.
+			db.rollback()
+			raise
+
+#Returns the version the database schema is currently at, 0 if no migrations have run.
+def schema_version():
+	db,cur = db_connection()
+	if not(cur.execute('SELECT 1 FROM sqlite_master WHERE type = "table" AND name = "schema_version"').fetchone()):
+		return 0
+	return cur.execute('SELECT COALESCE(MAX(version),0) FROM schema_version').fetchone()[0]
+
+#Convert text timestamp columns of a table to epochms integer columns. SQLite can't change a column's type, so the table is rebuilt:
+#a copy is made with the new column types, the rows are copied across converting each timestamp, and the old table is swapped out for it.
+#The table's indexes and triggers are put back afterwards. Text times are local time, as written by datetime.now().
+def _retype_columns(cur,table,columns):
+	saved = [row[0] for row in cur.execute('SELECT sql FROM sqlite_master WHERE tbl_name = ? AND type IN ("index","trigger") AND sql IS NOT NULL',(table,)).fetchall()]
+	definitions,names = [],[]
+	for cid,name,type,notnull,default,primary in cur.execute(f'PRAGMA table_info({table})').fetchall():
+		converted = name
+		if(name in columns):
+			type = 'epochms integer'
+			converted = f'''CASE WHEN {name} IS NULL OR trim({name}) IN ('','Null','NULL','None') THEN NULL
+							WHEN typeof({name}) IN ('integer','real') THEN CAST({name} AS INTEGER)
+							ELSE CAST(round((julianday({name},'utc') - 2440587.5)*86400000) AS INTEGER) END'''
+			#a required time that can't be read is kept as the start of the epoch rather than failing the migration
+			if(notnull):
+				converted = f'COALESCE({converted},0)'
+		definition = f'{name} {type}'.strip()
+		if(primary):
+			definition += ' PRIMARY KEY'
+		if(notnull):
+			definition += ' not null'
+		if(default is not None):
+			definition += f' default {default}'
+		definitions.append(definition)
+		names.append((name,converted))
+	cur.execute(f'CREATE TABLE {table}_retype({", ".join(definitions)})')
+	cur.execute(f'INSERT INTO {table}_retype ({",".join(name for name,converted in names)}) SELECT {",".join(converted for name,converted in names)} FROM {table}')
+	cur.execute(f'DROP TABLE {table}')
+	#legacy renaming leaves triggers on other tables that mention this table alone, they point at the new table once it has the old name
+	cur.execute('PRAGMA legacy_alter_table = ON')
+	try:
+		cur.execute(f'ALTER TABLE {table}_retype RENAME TO {table}')
+	finally:
+		cur.execute('PRAGMA legacy_alter_table = OFF')
+	for sql in saved:
+		cur.execute(sql)
+
+#Rebuild a table with an AUTOINCREMENT id, the same way _retype_columns does, carrying on from the highest id in the table or its archive.
+def _autoincrement_ids(cur,table):
+	sql = cur.execute('SELECT sql FROM sqlite_master WHERE type = "table" AND name = ?',(table,)).fetchone()[0]
+	saved = [row[0] for row in cur.execute('SELECT sql FROM sqlite_master WHERE tbl_name = ? AND type IN ("index","trigger") AND sql IS NOT NULL',(table,)).fetchall()]
+	sql = re.sub(r'\bid integer PRIMARY KEY\b','id integer PRIMARY KEY AUTOINCREMENT',sql,count=1,flags=re.IGNORECASE)
+	cur.execute(re.sub(rf'^CREATE TABLE (IF NOT EXISTS )?"?{table}\b"?',f'CREATE TABLE {table}_autoincrement',sql,count=1,flags=re.IGNORECASE))
+	cur.execute(f'INSERT INTO {table}_autoincrement SELECT * FROM {table}')
+	cur.execute(f'DROP TABLE {table}')
+	cur.execute('PRAGMA legacy_alter_table = ON')
+	try:
+		cur.execute(f'ALTER TABLE {table}_autoincrement RENAME TO {table}')
+	finally:
+		cur.execute('PRAGMA legacy_alter_table = OFF')
+	for statement in saved:
+		cur.execute(statement)
+	highest = cur.execute(f'SELECT MAX(COALESCE((SELECT MAX(id) FROM main.{table}),0),COALESCE((SELECT MAX(id) FROM archive.{table}),0))').fetchone()[0]
+	cur.execute('DELETE FROM sqlite_sequence WHERE name IN (?,?)',(table,f'{table}_autoincrement',))
+	cur.execute('INSERT INTO sqlite_sequence (name,seq) VALUES (?,?)',(table,highest,))
+
 #Initialise tables, ready for the ticketing system to use the database.
 def table_init():
+	#Create or upgrade all of the tables and indexes.
+	run_migrations()
 	db,cur = db_connection()
-	
-	# Create the tickets table if it doesn't already exist.
-	cur.execute('''
-				CREATE TABLE IF NOT EXISTS tickets(
-				id integer PRIMARY KEY,
-				name text not null,
-				status text not null,
-				owner integer not null,
-				queue integer not null,
-				content text not null,
-				created text not null,
-				started text,
-				completed text,
-				determination text
-				);
-				''')
-	
-	#Create queue table if it doesn't exist already
-	cur.execute('''
-				CREATE TABLE IF NOT EXISTS queue(
-				id integer PRIMARY KEY,
-				name text not null
-				);
-				''')
-	
-	#Create users table if it doesn't exist already
-	cur.execute('''
-                CREATE TABLE IF NOT EXISTS users(
-                    id integer PRIMARY KEY,
-                    name text not null,
-                    pwd text not null,
-					email text not null,
-                    queue integer not null
-                );
-                ''')
-	
-	#Create key info table, if it doesn't already exist
-	cur.execute('''
-				CREATE TABLE IF NOT EXISTS keyinfo(
-				id integer PRIMARY KEY,
-				ticket integer,
-				infotype text,
-				info text
-				);
-				''')
-	
-	#Create comments table, if it doesn't exist already.
-	cur.execute('''
-				CREATE TABLE IF NOT EXISTS comments(
-				id integer PRIMARY KEY,
-				comment text not null,
-				commenter integer not null,
-				post integer not null,
-				datetime text not null,
-				stage integer not null
-				);
-				''')
-	
-	#Create relationships table, if it doesn't already exist
-	cur.execute('''
-				CREATE TABLE IF NOT EXISTS relationships(
-				id integer PRIMARY KEY,
-				ticketone not null,
-				tickettwo not null
-				);
-				''')
-	
-	#create the knowledgemap table, if it doesn't exist
-	cur.execute('''
-				CREATE TABLE IF NOT EXISTS knowledgemap(
-				id integer PRIMARY KEY,
-				title text not null,
-				body text not null
-				);	
-				''')
-	
-	#create the knowledge table, if it doesn't exist
-	cur.execute('''
-				CREATE TABLE IF NOT EXISTS knowledge(
-				id integer PRIMARY KEY,
-				knowledgemap integer not null,
-				title text not null,
-				body text not null
-				);
-				''')
+	#Take the write lock before checking, so processes starting together can't both add the default rows.
+	cur.execute('BEGIN IMMEDIATE')
+
 	#Create a default queue if none exist
 	if not(cur.execute('SELECT * FROM queue').fetchone()):
 		cur.execute('INSERT INTO queue(name) VALUES (?)',('Incident Response',))
@@ -108,57 +1003,272 @@ def table_init():
 		cur.execute('INSERT INTO users(name,pwd,email,queue) VALUES (?,?,?,?)',('Nobody',"0","null@null.com",0))
 
 	db.commit()
-	
 
-def insert_user(name,pwd,email,queue):
+#Whether the database is at the latest schema version and has its default rows, so there's nothing for table_init to do.
+def is_bootstrapped():
+	if(schema_version() != MIGRATIONS[-1][0]):
+		return False
+	db,cur = db_connection()
+	return bool(cur.execute('SELECT 1 FROM queue').fetchone() and cur.execute('SELECT 1 FROM users').fetchone())
+
+#Create or upgrade the database once, before a web server starts its workers. An exclusive lock on a file next to the database makes any
+#other process bootstrapping at the same moment wait, then find there's nothing left to do. Everything opened here is closed again, so
+#no connection or writer thread is handed down to forked workers, they set up their own on first use.
+def bootstrap():
+	with open(DATABASE + '.lock','a') as lock:
+		if(fcntl):
+			fcntl.flock(lock,fcntl.LOCK_EX)
+		try:
+			if not(is_bootstrapped()):
+				table_init()
+		finally:
+			close_pool()
+			if(fcntl):
+				fcntl.flock(lock,fcntl.LOCK_UN)
+
+#A forked worker starts with an empty connection pool and no writer thread, both are set up again on first use, as SQLite connections must
+#never be used on both sides of a fork. Locks are replaced too, in case another thread held one at the moment of the fork. Cached data is kept.
+def _reset_after_fork():
+	global _pool,_pool_lock,_pool_opened,_local,_query_stats_lock,_write_queue,_writer,_writer_pid,_writer_cursor,_writer_lock,_metadata_lock,_changes_condition,_stats_lock
+	_pool = queue.LifoQueue()
+	_pool_lock = threading.Lock()
+	_pool_opened = 0
+	_local = threading.local()
+	_query_stats_lock = threading.Lock()
+	_write_queue = queue.Queue()
+	_writer = None
+	_writer_pid = None
+	_writer_cursor = None
+	_writer_lock = threading.Lock()
+	_metadata_lock = threading.Lock()
+	_changes_condition = threading.Condition()
+	_stats_lock = threading.Lock()
+
+if(hasattr(os,'register_at_fork')):
+	os.register_at_fork(after_in_child=_reset_after_fork)
+
+#How many tickets are listed per page on queues and profiles
+LISTING_PAGE_SIZE = 50
+#The statuses of a ticket that still needs work, in the order they are shown on a queue
+OPEN_STATUSES = ("New","Under Investigation","On-Hold")
+
+#Listings are paged by (created, id), oldest first. The next page starts after the last ticket of the previous one, so pages stay cheap however deep they go
+#and don't skip or repeat tickets when new ones arrive. 'Resolved' is single quoted so the planner can match the open ticket indexes.
+QUEUE_STATUS_COUNTS = "SELECT status, COUNT(*) FROM tickets WHERE queue = ? AND status != 'Resolved' GROUP BY status"
+QUEUE_TICKETS_PAGE = "SELECT tickets.id,tickets.name,users.name,tickets.created,tickets.status FROM tickets INNER JOIN users ON tickets.owner = users.id WHERE tickets.queue = ? AND tickets.status = ? AND tickets.status != 'Resolved'"
+USER_TICKET_COUNT = "SELECT COUNT(*) FROM tickets WHERE owner = ? AND status != 'Resolved'"
+USER_TICKETS_PAGE = "SELECT tickets.name, queue.name, tickets.queue, tickets.id FROM tickets INNER JOIN queue ON tickets.queue = queue.id WHERE tickets.owner = ? AND tickets.status != 'Resolved'"
+AFTER_TICKET = " AND (tickets.created, tickets.id) > (SELECT created, id FROM tickets WHERE id = ?)"
+PAGE_ORDER = " ORDER BY tickets.created, tickets.id LIMIT ?"
+
+#Every ticket linked to another, directly or through other tickets, starting from ticket. Only used when relationships are removed, to find how a cluster split.
+CLUSTER_COMPONENT = '''WITH RECURSIVE component(id) AS (
+		SELECT ?
+		UNION SELECT CASE WHEN relationships.ticketone = component.id THEN relationships.tickettwo ELSE relationships.ticketone END
+		FROM component INNER JOIN main.relationships ON relationships.ticketone = component.id OR relationships.tickettwo = component.id
+		UNION SELECT CASE WHEN relationships.ticketone = component.id THEN relationships.tickettwo ELSE relationships.ticketone END
+		FROM component INNER JOIN archive.relationships ON relationships.ticketone = component.id OR relationships.tickettwo = component.id
+	)'''
+
+#A ticket's key info, newest first, with how many times each value has been seen across all tickets. {store} is main, or archive for an archived ticket.
+TICKET_KEYINFO_COUNTS = '''SELECT keyinfo.info, keyinfo.infotype, keyinfo.id, COALESCE(ioc_stats.sightings,1) FROM {store}.keyinfo
+						 LEFT JOIN ioc_stats ON ioc_stats.indicator = lower(trim(keyinfo.info))
+						 WHERE keyinfo.ticket = ? ORDER BY keyinfo.id DESC'''
+
+#A ticket's comments, newest first, with the commenter's name. {store} is main, or archive for an archived ticket.
+TICKET_COMMENTS = 'SELECT comment,name,datetime,stage,commenter,comments.id FROM {store}.comments INNER JOIN users ON commenter = users.id WHERE post = ? ORDER BY datetime DESC'
+
+#The tickets related to a ticket, as (ticket, title, relationship id). Relationships between two archived tickets are archived with them, so either end of a relationship can be in either database.
+TICKET_RELATIONS = '''SELECT related.ticket, COALESCE(tickets.name,archived.name), related.id FROM
+					  (SELECT ticketone AS ticket, id FROM main.relationships WHERE tickettwo = ? UNION ALL SELECT tickettwo, id FROM main.relationships WHERE ticketone = ?
+					   UNION ALL SELECT ticketone, id FROM archive.relationships WHERE tickettwo = ? UNION ALL SELECT tickettwo, id FROM archive.relationships WHERE ticketone = ?) AS related
+					  LEFT JOIN main.tickets ON tickets.id = related.ticket LEFT JOIN archive.tickets AS archived ON archived.id = related.ticket
+					  WHERE COALESCE(tickets.name,archived.name) IS NOT NULL'''
+
+#The tickets in a cluster, hot or archived, as (id, name, status) in ticket id order
+CLUSTER_MEMBERS = '''SELECT clusters.ticket, COALESCE(tickets.name,archived.name), COALESCE(tickets.status,archived.status) FROM clusters
+					 LEFT JOIN main.tickets ON tickets.id = clusters.ticket LEFT JOIN archive.tickets AS archived ON archived.id = clusters.ticket
+					 WHERE clusters.root = ? AND COALESCE(tickets.id,archived.id) IS NOT NULL ORDER BY clusters.ticket'''
+
+#Every ticket a piece of key info is on, hot or archived, as (info, ticket, infotype)
+KEYINFO_TICKETS = f"SELECT info,ticket,infotype FROM {hot_and_archived('keyinfo','info,ticket,infotype')} WHERE info = ?"
+
+#The next batch of tickets to archive, resolved before a time, oldest first.
+ARCHIVE_CANDIDATES = "SELECT id FROM main.tickets WHERE completed < ? AND status = 'Resolved' ORDER BY completed LIMIT ?"
+
+#Totals, false positives and volume since a date for the tickets mapped to knowledge, filtered and grouped by the caller
+KNOWLEDGE_STATS = f"SELECT COUNT(*), COUNT(CASE WHEN determination = 'False Positive' THEN 1 END), COUNT(CASE WHEN created > ? THEN 1 END), knowledgemap FROM {hot_and_archived('tickets','determination,created,knowledgemap')}"
+
+#Queries run on nearly every page, with example parameters. check_query_plans makes sure none of them have to scan a whole table.
+HOT_QUERIES = {
+	'queue_status_counts':(QUEUE_STATUS_COUNTS,(1,)),
+	'queue_tickets_page':(QUEUE_TICKETS_PAGE + AFTER_TICKET + PAGE_ORDER,(1,'New',1,51,)),
+	'user_ticket_count':(USER_TICKET_COUNT,(1,)),
+	'user_tickets_page':(USER_TICKETS_PAGE + AFTER_TICKET + PAGE_ORDER,(1,1,51,)),
+	'ticket_keyinfo':('SELECT info,infotype,id FROM keyinfo WHERE ticket = ?',(1,)),
+	'keyinfo_occurances':('SELECT COUNT(id) FROM keyinfo WHERE info = ?',('127.0.0.1',)),
+	'ticket_keyinfo_counts':(TICKET_KEYINFO_COUNTS.format(store='main'),(1,)),
+	'archived_ticket_keyinfo_counts':(TICKET_KEYINFO_COUNTS.format(store='archive'),(1,)),
+	'ioc_reputation':('SELECT sightings,resolved,false_positives,first_seen,last_seen FROM ioc_stats WHERE indicator = lower(trim(?))',('127.0.0.1',)),
+	'ioc_volume':('SELECT COALESCE(SUM(sightings),0) FROM ioc_days WHERE indicator = lower(trim(?)) AND day > ?',('127.0.0.1','2000-01-01',)),
+	'ticket_comments':(TICKET_COMMENTS.format(store='main'),(1,)),
+	'archived_ticket_comments':(TICKET_COMMENTS.format(store='archive'),(1,)),
+	'ticket_relations':(TICKET_RELATIONS,(1,1,1,1,)),
+	'keyinfo_tickets':(KEYINFO_TICKETS,('127.0.0.1',)),
+	'archive_candidates':(ARCHIVE_CANDIDATES,(0,500,)),
+	'created_lastday':('SELECT COUNT(id) FROM tickets WHERE created > ?',(0,)),
+	'started_lastday':('SELECT COUNT(id) FROM tickets WHERE started > ?',(0,)),
+	'completed_lastday':('SELECT COUNT(id) FROM tickets WHERE completed > ?',(0,)),
+	'user_by_name':('SELECT id FROM users WHERE name = ?',('Nobody',)),
+	'ticket_events':('SELECT occurred,protocol,source,destination,action,result FROM events WHERE source IN (SELECT info FROM keyinfo WHERE ticket = ?) UNION SELECT occurred,protocol,source,destination,action,result FROM events WHERE destination IN (SELECT info FROM keyinfo WHERE ticket = ?) ORDER BY occurred DESC LIMIT 50',(1,1,)),
+	'queue_changes':('SELECT changes.id, changes.change, tickets.id, tickets.name, users.name, tickets.created, tickets.status, tickets.queue FROM changes INNER JOIN tickets ON tickets.id = changes.ticket INNER JOIN users ON users.id = tickets.owner WHERE changes.queue = ? AND changes.id > ? ORDER BY changes.id LIMIT 500',(1,0,)),
+	'cluster_root':('SELECT root FROM clusters WHERE ticket = ?',(1,)),
+	'cluster_members':(CLUSTER_MEMBERS,(1,)),
+	'knowledge_stats':(KNOWLEDGE_STATS + ' WHERE knowledgemap = ?',(0,1,)),
+	'metrics_report':("SELECT queue, analyst, SUM(created) FROM metrics WHERE granularity = ? AND bucket >= ? GROUP BY queue, analyst",('hour','2000-01-01 00:00',)),
+	'mapping_guidance':('SELECT title, body, id FROM knowledge WHERE knowledgemap = ?',(1,)),
+}
+
+#Runs EXPLAIN QUERY PLAN over each hot query and returns the ones that fall back to a full table scan, as (name, plan step) pairs. An empty list means every query uses an index.
+def check_query_plans():
 	db,cur = db_connection()
+	failures = []
+	for name,(query,params) in HOT_QUERIES.items():
+		#subqueries (such as hot_and_archived's) are read in full by the query around them, their own steps are checked for scans instead
+		subqueries = set()
+		for step in cur.execute(f'EXPLAIN QUERY PLAN {query}',params).fetchall():
+			#the last column holds the description, a full scan reads "SCAN table" without an index being used
+			detail = step[-1]
+			if(detail.startswith(('CO-ROUTINE ','MATERIALIZE '))):
+				subqueries.add(detail.split(' ',1)[1])
+			elif(detail.startswith('SCAN') and 'USING' not in detail and 'CONSTANT ROW' not in detail and detail[5:] not in subqueries):
+				failures.append((name,detail))
+	return failures
+	
+def insert_user(name,pwd,email,queue):
 	#Hash the password using Sha-512 secure hashing and translate to hexadecimal
 	pwd = hashlib.sha512(pwd.encode('utf-8')).hexdigest()
+	if(write(_insert_user,name,pwd,email,queue)):
+		invalidate_metadata_cache()
+		return True
+	return False
+
+def _insert_user(cur,name,pwd,email,queue):
 	#If a user with the name doesn't already exist, create user with details passed from form and hashed password
 	if not (cur.execute('SELECT 1 FROM users WHERE name = ?',(name,)).fetchone()):
 		cur.execute('INSERT INTO users(name,pwd,email,queue) VALUES (?,?,?,?)',(name,pwd,email,queue,))
-		db.commit()
 		return True
 	else:
 		return False
 
-#This is used for manual ticket creation, thus the ticket status starts as under investigation
-def insert_ticket(name,queue,content,owner,created,status="Under Investigation"):
-	db,cur = db_connection()
+#Hash identifying a ticket's content, tickets in the same queue with the same title and body share a hash.
+def content_hash(name,queue,content):
+	return hashlib.sha256(f"{queue}\x00{name}\x00{content}".encode('utf-8')).hexdigest()
+
+#Fill in the content hash of every ticket that doesn't have one yet, used when the column is first added.
+def _backfill_content_hashes(cur):
+	rows = cur.execute('SELECT id,name,queue,content FROM tickets WHERE contenthash IS NULL').fetchall()
+	cur.executemany('UPDATE tickets SET contenthash = ? WHERE id = ?',[(content_hash(row[1],row[2],row[3]),row[0]) for row in rows])
+
+#This is used for manual ticket creation, thus the ticket status starts as under investigation. Returns the new ticket's id.
+@write_operation
+def insert_ticket(cur,name,queue,content,owner,created,status="Under Investigation"):
 	#Create ticket using values supplied from the submitted form
-	cur.execute('INSERT INTO tickets (name,queue,content,owner,created,status,started) VALUES (?,?,?,?,?,?,?)',(name,queue,content,owner,created,status,created,))
-	db.commit()
+	cur.execute('INSERT INTO tickets (name,queue,content,owner,created,status,started,lastseen,contenthash,knowledgemap) VALUES (?,?,?,?,?,?,?,?,?,?)',(name,queue,content,owner,created,status,created,created,content_hash(name,queue,content),parse_incident_identifier(name),))
+	return cur.lastrowid
 
 #Creating a new ticket queue
 def insert_queue(name):
-	db,cur = db_connection()
+	if(write(_insert_queue,name)):
+		#the cached queues are now out of date
+		invalidate_metadata_cache()
+		return True
+	return False
+
+def _insert_queue(cur,name):
 	#Create a new ticket queue if one doesn't already exist with the same name, use data supplied from form
 	if not(cur.execute('SELECT 1 FROM queue WHERE name = ?',(name,)).fetchone()):
 		cur.execute('INSERT INTO queue (name) VALUES (?)',(name,))
-		db.commit()
 		return True
 	
 	return False
 
-#Create new key information and add to the database
-def insert_keyinfo(value,tickno,tag):
+#The users and queue tables are small and read on almost every request, so each process keeps a copy of them in memory. None until first loaded.
+#The copy is dropped straight away when this process changes either table, and other processes' changes are noticed through the generation
+#in metadata_generation (bumped by triggers), which is checked at most every METADATA_CHECK_INTERVAL seconds.
+METADATA_CHECK_INTERVAL = 1
+_metadata = None
+_metadata_checked = 0
+_metadata_lock = threading.Lock()
+
+#Forget the cached users and queues, so they are loaded again next time they are needed.
+def invalidate_metadata_cache():
+	global _metadata
+	_metadata = None
+
+#The cached users and queues, loading them if they aren't cached or another process has changed them. refresh loads them again regardless.
+#Returns a dictionary of users by name as (id, queue), user names by id, queues as (id, name) in id order and queue names by id.
+def _load_metadata(refresh=False):
+	global _metadata,_metadata_checked
+	metadata = _metadata
+	if(metadata is not None and not refresh and monotonic() - _metadata_checked < METADATA_CHECK_INTERVAL):
+		return metadata
+	#the connection is checked out before taking the lock, so a thread waiting on the pool never holds up the others
 	db,cur = db_connection()
+	with _metadata_lock:
+		generation = cur.execute('SELECT generation FROM metadata_generation WHERE id = 1').fetchone()[0]
+		_metadata_checked = monotonic()
+		if(_metadata is not None and not refresh and _metadata['generation'] == generation):
+			return _metadata
+		users = cur.execute('SELECT id,name,queue FROM users ORDER BY id').fetchall()
+		queues = cur.execute('SELECT id,name FROM queue ORDER BY id').fetchall()
+		_metadata = {
+			'generation':generation,
+			'users':{name:(id,queue) for id,name,queue in users},
+			'user_names':{id:name for id,name,queue in users},
+			'queues':queues,
+			'queue_names':dict(queues),
+		}
+		return _metadata
+
+#Check a queue exists, using the cached queues. On a miss the queues are loaded again in case another process has just added it.
+def queue_exists(queueid):
+	return queue_name(queueid) is not None
+
+#The name of a queue from its id, or None if there isn't a queue with that id.
+def queue_name(queueid):
+	try:
+		queueid = int(queueid)
+	except (TypeError,ValueError):
+		return None
+	name = _load_metadata()['queue_names'].get(queueid)
+	if(name is None):
+		name = _load_metadata(refresh=True)['queue_names'].get(queueid)
+	return name
+
+#Every queue as (id, name), used to fill in the queue choices on forms and list the queues.
+def queue_choices():
+	return list(_load_metadata()['queues'])
+
+#Create new key information and add to the database
+@write_operation
+def insert_keyinfo(cur,value,tickno,tag):
+	_restore_ticket(cur,tickno)
 	#If a specified ticket doesn't already have the particular key information, add it to the database.
 	if not(cur.execute('SELECT 1 FROM keyinfo WHERE info = ? AND ticket = ?',(value,tickno,)).fetchone()):
 		cur.execute('INSERT INTO keyinfo (info,ticket,infotype) VALUES (?,?,?)',(value,tickno,tag,))
 	else:
 		#If it already exists, update the infotype, which specifies what the data is
 		cur.execute('UPDATE keyinfo SET infotype = ? WHERE ticket = ? AND info = ?',(tag,tickno,value,))
-	db.commit()
 
-#Generate a ticket from an email	
-def generate_email_ticket(name,queue,content,owner,status):
+#Generate a ticket from an email, returning the new ticket's id
+@write_operation
+def generate_email_ticket(cur,name,queue,content,owner,status):
 	#Use the current time as the ticket creation time
-    created = datetime.now()
-    db,cur = db_connection()
+	created = datetime.now()
 	#Insert values supplied by the email body to create a new ticket in the database
-    cur.execute('INSERT INTO tickets (name,queue,content,owner,created,status) VALUES (?,?,?,?,?,?)',(name,queue,content,owner,created,status,))
-    db.commit()
+	cur.execute('INSERT INTO tickets (name,queue,content,owner,created,status,lastseen,contenthash,knowledgemap) VALUES (?,?,?,?,?,?,?,?,?)',(name,queue,content,owner,created,status,created,content_hash(name,queue,content),parse_incident_identifier(name),))
+	return cur.lastrowid
 
 #Check credentials passed from a login attempt
 def check_login(name,pattempt):
@@ -175,29 +1285,40 @@ def check_login(name,pattempt):
 	
 	return False
 
+#A user's (id, queue) from their name, from the cached users, or None if there isn't a user with that name.
+def user_details(name):
+	details = _load_metadata()['users'].get(name)
+	if(details is None):
+		details = _load_metadata(refresh=True)['users'].get(name)
+	return details
+
 #Get a users database ID from the name supplied
 def user_id_from_name(name):
-	db,cur = db_connection()
-	return cur.execute('SELECT id FROM users WHERE name = ?',(name,)).fetchone()[0]
+	details = user_details(name)
+	return details[0] if details else None
 
 #Insert a comment into the database using data supplied from the the add comment form
-def insert_comment(comment,commenter,post,datetime,step):
-	db,cur = db_connection()
+@write_operation
+def insert_comment(cur,comment,commenter,post,datetime,step):
+	_restore_ticket(cur,post)
 	cur.execute('INSERT INTO comments (comment,commenter,post,datetime,stage) VALUES (?,?,?,?,?)',(comment,commenter,post,datetime,step,))
-	db.commit()
+	return cur.lastrowid
 
 #Reopen a ticket that has been closed.
-def reopen_closed_ticket(ticketid):
-	db,cur = db_connection()
+@write_operation
+def reopen_closed_ticket(cur,ticketid):
+	#an archived ticket is moved back into the hot database first
+	_restore_ticket(cur,ticketid)
 	cur.execute(f'UPDATE tickets SET status = "Under Investigation" WHERE id = ?',(ticketid,))
-	db.commit()
 
 #Creates a new relationship in the relationships database table
-def insert_relationship(t1,t2):
-	db,cur = db_connection()
+@write_operation
+def insert_relationship(cur,t1,t2):
 	#Transform the ids of the tickets passed into the function into integers
 	t1 = int(t1)
 	t2 = int(t2)
+	_restore_ticket(cur,t1)
+	_restore_ticket(cur,t2)
 	#If they are for the same ticket, return false since a relationship to the same ticket is not possible
 	if(t1==t2):
 		return False
@@ -206,151 +1327,347 @@ def insert_relationship(t1,t2):
 		#if the tickets are not already linked
 		if not (cur.execute('SELECT 1 FROM relationships WHERE ticketone = ? AND tickettwo = ?',(t1,t2,)).fetchone() or cur.execute('SELECT 1 FROM relationships WHERE ticketone = ? AND tickettwo = ?',(t2,t1,)).fetchone()):
 			cur.execute('INSERT INTO relationships (ticketone,tickettwo) VALUES (?,?)',(t1,t2,))
-			db.commit()
+			_join_clusters(cur,t1,t2)
 			return True
 	
 	return False
 
 #Set a ticket as resolved, set the completed time and update determination in the database
-def resolve_ticket(post,determination):
-	db,cur = db_connection()
+@write_operation
+def resolve_ticket(cur,post,determination):
+	_restore_ticket(cur,post)
 	cur.execute('UPDATE tickets SET status = ?, completed = ?, determination = ? WHERE id = ?',('Resolved',datetime.now(),determination,post,))
-	db.commit()
 
 #Become the owner of a ticket with the status of New
 def take_new_ticket(ticketid,user):
-	db,cur = db_connection()
 	#Get the users id from their name
-	user = user_id_from_name(user)
+	write(_take_new_ticket,ticketid,user_id_from_name(user))
+
+def _take_new_ticket(cur,ticketid,user):
 	#If the ticket is owned by the Nobody user (this is a null account and can only be done on New tickets generated by server), update the user.
 	if(cur.execute('SELECT users.name FROM tickets INNER JOIN users ON users.id = tickets.owner WHERE tickets.id = ?',(ticketid,)).fetchone()[0] == "Nobody"):
 		cur.execute('UPDATE tickets SET status = ?,owner = ?,started=? WHERE id = ?',("Under Investigation",user,datetime.now(),ticketid,))
-		db.commit()
-
-#Fetch all of the tickets that a user owns
-def view_user_tickets(user):
-	db,cur = db_connection()
-	return cur.execute('SELECT tickets.id,tickets.name,queue.name FROM tickets INNER JOIN queue ON tickets.queue = queue.id WHERE owner = ? AND status != "Resolved"',(user,)).fetchall()
 
 #Update a ticket with information passed in by a successful form submission
-def update_ticket(title,content,queue,status,id):
-	db, cur = db_connection()
-	cur.execute('UPDATE tickets SET name = ?, content = ?, queue = ?, status = ? WHERE id = ?',(title,content,queue,status,id,))
-	db.commit()
-
-#Fetch all of the tickets from a queue and organise them into lists based on their current stats
-def tickets_by_status(queue):
+@write_operation
+def update_ticket(cur,title,content,queue,status,id):
+	_restore_ticket(cur,id)
+	cur.execute('UPDATE tickets SET name = ?, content = ?, queue = ?, status = ?, knowledgemap = ? WHERE id = ?',(title,content,queue,status,parse_incident_identifier(title),id,))
+
+#Run a listing query for one page, returning (tickets, id of the last ticket to pass as after for the next page, or None if this is the last page).
+#One extra row is fetched to tell whether there is another page.
+def _listing_page(query,params,after,limit,id_column):
 	db,cur = db_connection()
-	#New, Under Investigation, On-Hold
-	new,ui,oh = [],[],[]
-	tickets = cur.execute('SELECT tickets.id,tickets.name,users.name,tickets.created,tickets.status FROM tickets INNER JOIN users ON tickets.owner = users.id WHERE tickets.queue = ? AND tickets.status != "Resolved"',(queue,)).fetchall()
-	#For each ticket, append ticket data to correct list based on its current status
-	for ticket in tickets:
-		if(ticket[4] == "New"):
-			new.append(ticket)
-		elif(ticket[4] == "Under Investigation"):
-			ui.append(ticket)
-		elif(ticket[4] == "On-Hold"):
-			oh.append(ticket)
-	return new,ui,oh
-
-#Get the number of tickets created in a specified queue in the last day
-def get_queue_created_lastday(id):
+	if(after):
+		query += AFTER_TICKET
+		params += (after,)
+	tickets = cur.execute(query + PAGE_ORDER,params + (limit + 1,)).fetchall()
+	if(len(tickets) > limit):
+		tickets = tickets[:limit]
+		return tickets,tickets[-1][id_column]
+	return tickets,None
+
+#The number of open tickets in a queue for each status, every open status is included even if it has none.
+def queue_status_counts(queue):
 	db,cur = db_connection()
-	lastdaystickets = cur.execute('SELECT COUNT(id) FROM tickets WHERE created > datetime("now","-1 days") AND queue = ?',(id,))
-	return lastdaystickets.fetchone()[0]
+	counts = dict.fromkeys(OPEN_STATUSES,0)
+	counts.update(cur.execute(QUEUE_STATUS_COUNTS,(queue,)).fetchall())
+	return counts
 
-#Get the total amount of tickets created in the last day for all queues combined
-def get_total_created_lastday():
-	db,cur = db_connection()
-	lastdaystickets = cur.execute('SELECT COUNT(id) FROM tickets WHERE created > datetime("now","-1 days")')
-	return lastdaystickets.fetchone()[0]
+#A page of a queue's tickets with a status, as (id, name, owner name, created, status) rows.
+def queue_tickets_page(queue,status,after=None,limit=LISTING_PAGE_SIZE):
+	return _listing_page(QUEUE_TICKETS_PAGE,(queue,status,),after,limit,0)
 
-#Works out the average response time, of all queues or of a specified queue (Optional)
-def get_average_response(id=0):
+#The number of open tickets a user owns
+def user_ticket_count(user):
 	db,cur = db_connection()
-	#If a queue is specified, calculate the average response time of that queue
-	if(id):
-		lastdaystickets = cur.execute('SELECT (julianday(started) - julianday(created))*3600 FROM tickets WHERE started > datetime("now","-1 days") AND queue = ? AND started != "Null"',(id,)).fetchall()
-	#Otherwise calculate the response time for all queues combined
-	else:
-		lastdaystickets = cur.execute('SELECT (julianday(started) - julianday(created))*3600 FROM tickets WHERE started > datetime("now","-1 days") AND started != "Null"').fetchall()
-	#if any tickets have been generated in the last day, workout the average response rate based on the Mean of all response times (sum of all responses / amount of responses)
-	if(lastdaystickets):
-		total = 0
-		for ticket in lastdaystickets:
-			total += ticket[0]
-		#work out mean and round value to 2 decimal places, helps with readability
-		return round(total/len(lastdaystickets),2)
-	else:
-		return 0
+	return cur.execute(USER_TICKET_COUNT,(user,)).fetchone()[0]
+
+#A page of a user's open tickets, as (name, queue name, queue id, id) rows.
+def user_tickets_page(user,after=None,limit=LISTING_PAGE_SIZE):
+	return _listing_page(USER_TICKETS_PAGE,(user,),after,limit,3)
 
-#Returns tickets that have yet to be completed, but have exceeded an acceptable amount of time between being created and started.
-def get_untaken_overdue():
-	#SLA = Service Level Agreement, used in this case to mean how quickly tickets should be taken before it becomes a problem. The value is the amount of minutes.
-	SLA = 15
+#Woken up whenever this process commits a change to a ticket, so live queue pages can send it straight away.
+_changes_condition = threading.Condition()
+#How many live changes are sent at once
+CHANGE_BATCH_SIZE = 500
+
+#Let anything waiting for ticket changes in this process know there may be new ones. Changes made by other processes are picked up when the waiters next check.
+def notify_changes():
+	with _changes_condition:
+		_changes_condition.notify_all()
+
+#Wait up to timeout seconds for this process to change a ticket, returns True if it did.
+def wait_for_changes(timeout):
+	with _changes_condition:
+		return _changes_condition.wait(timeout)
+
+#The id of the latest change to a queue, which changes whenever any of its tickets do. 0 if there are no recorded changes.
+def queue_version(queue):
 	db,cur = db_connection()
-	#Fetch the id and time taken for tickets that are currently exceeding the acceptable time frame as set by SLA, tickets must have been created in the last 24hrs and have been started but not finished.
-	lastdaystickets = cur.execute(f'SELECT id,(julianday(started) - julianday(created))*3600 AS timetaken FROM tickets WHERE created > datetime("now","-1 days") AND timetaken > {SLA} AND started != "Null" AND completed != "Null"').fetchall()
-	return lastdaystickets
+	return cur.execute('SELECT COALESCE(MAX(id),0) FROM changes WHERE queue = ?',(queue,)).fetchone()[0]
 
-#Takes the users name, finds their database id and then uses it to find their selected queue
-def get_user_queue(name):
+#Fetch the changes to a queue's tickets since the change id given, oldest first, with each ticket's current details.
+#Returns (changes, reset) where reset is True if changes have been cleared out since then, and the whole queue needs loading again.
+def queue_changes(queue,since,limit=CHANGE_BATCH_SIZE):
 	db,cur = db_connection()
-	return cur.execute('SELECT queue FROM users WHERE id = ?',(user_id_from_name(name),)).fetchone()[0]
+	oldest = cur.execute('SELECT MIN(id) FROM changes').fetchone()[0]
+	if(since and oldest and since < oldest - 1):
+		return [],True
+	rows = cur.execute('''SELECT changes.id, changes.change, tickets.id, tickets.name, users.name, tickets.created, tickets.status, tickets.queue FROM changes
+						  INNER JOIN tickets ON tickets.id = changes.ticket INNER JOIN users ON users.id = tickets.owner
+						  WHERE changes.queue = ? AND changes.id > ? ORDER BY changes.id LIMIT ?''',(queue,since,limit,)).fetchall()
+	changes = []
+	for row in rows:
+		changes.append({
+			'id':row[0],
+			'change':row[1],
+			#whether the ticket should still be shown in this queue
+			'open':row[6] != "Resolved" and str(row[7]) == str(queue),
+			'ticket':{'id':row[2],'name':row[3],'owner':row[4],'created':str(row[5]),'status':row[6]},
+		})
+	return changes,False
+
+#Takes the users name and finds their selected queue
+def get_user_queue(name):
+	details = user_details(name)
+	return details[1] if details else None
 
 #Updates the queue of the user of the ID that is passed, to the new queue which is also passed in.
 def update_user_queue(newqueue,id):
-	db,cur = db_connection()
+	write(_update_user_queue,newqueue,id)
+	invalidate_metadata_cache()
+
+def _update_user_queue(cur,newqueue,id):
 	cur.execute('UPDATE users SET queue = ? WHERE id = ?',(newqueue,id,))
-	db.commit()
 
 #Fetch the busiest queues (max of top 3), by ticket volume in descending order (largest first). This is grouped by queue and is based on volume in the last 24hrs.
 def get_busiest_queues():
+	return get_dashboard_stats()['busiest_queues']
+
+#How many seconds the dashboard stats are kept before being worked out again, and how many minutes a ticket can wait before it breaches the SLA.
+STATS_TTL = 15
+TICKET_SLA = 15
+
+#The most recently computed dashboard stats and when they go stale, shared by every request in this process.
+_stats_cache = {'expires':0,'stats':None}
+_stats_lock = threading.Lock()
+
+#Works out every 24 hour dashboard statistic from the metric buckets of the last day.
+def compute_dashboard_stats():
+	report = metrics_report('24h')
+	totals = report['totals']
+	#Top three queues by tickets created as (amount, queue name) and top three analysts by tickets resolved as (name, amount)
+	busiest = [(summary['created'],summary['name']) for summary in report['queues'] if summary['created']][:3]
+	effective = [(summary['name'],summary['resolved']) for summary in report['analysts'] if summary['resolved']][:3]
+
+	return {
+		'created':totals['created'],
+		'false_positive':totals['false_positive'],
+		'average_response':totals['average_response'],
+		'average_resolution':totals['average_resolution'],
+		'taken_late':totals['sla_breaches'],
+		'effective_analysts':effective or False,
+		'busiest_queues':busiest,
+	}
+
+#Returns the dashboard stats, only working them out again once the cached copy is older than STATS_TTL seconds. The lock means only one request does the work while the others wait for it.
+def get_dashboard_stats():
+	with _stats_lock:
+		if(_stats_cache['stats'] is None or monotonic() >= _stats_cache['expires']):
+			_stats_cache['stats'] = compute_dashboard_stats()
+			_stats_cache['expires'] = monotonic() + STATS_TTL
+		return _stats_cache['stats']
+
+#Get the stats for the front page, returning them as a tuple to be accessed by index
+def get_frontpage_stats():
+	stats = get_dashboard_stats()
+	return stats['created'],stats['false_positive'],stats['average_response'],stats['average_resolution'],stats['taken_late'],stats['effective_analysts']
+
+#Ticket metrics are rolled up into buckets as tickets are created, taken and resolved, by triggers on the tickets table.
+#Minute buckets give detail for the last day and are cleared out after METRIC_MINUTE_RETENTION days, hour buckets are kept for longer reports.
+METRIC_MINUTE_RETENTION = 2
+#The ranges reports can be asked for
+REPORT_RANGES = {
+	'1h':timedelta(hours=1),
+	'24h':timedelta(days=1),
+	'7d':timedelta(days=7),
+	'30d':timedelta(days=30),
+	'90d':timedelta(days=90),
+}
+#strftime formats turning a time into the start of its bucket
+METRIC_BUCKETS = (('minute','%Y-%m-%d %H:%M'),('hour','%Y-%m-%d %H:00'))
+#The counters each event adds to. Times are in minutes, new is the ticket row.
+METRIC_EVENTS = {
+	'created':('new.created',{
+		'created':'1',
+	}),
+	'taken':('new.started',{
+		'taken':'1',
+		'response_total':'MAX((new.started - new.created)/60000.0,0)',
+		'responses':'1',
+		'sla_breaches':'(new.started - new.created)/60000.0 > {sla}',
+	}),
+	'resolved':(f"COALESCE(new.completed,{EPOCH_MS_NOW})",{
+		'resolved':'1',
+		'false_positives':"new.determination IS 'False Positive'",
+		'resolution_total':f"MAX((COALESCE(new.completed,{EPOCH_MS_NOW}) - new.created)/60000.0,0)",
+		'resolutions':'1',
+	}),
+}
+
+#SQL adding one event for the ticket row called new to the minute and hour buckets of its queue and owner.
+#source is any extra FROM clause and condition any extra filter, used to run it over the whole tickets table.
+def _metric_event_sql(event,source="",condition="TRUE"):
+	time,counters = METRIC_EVENTS[event]
+	buckets = " UNION ALL ".join(f"SELECT '{granularity}' AS granularity, '{format}' AS format" for granularity,format in METRIC_BUCKETS)
+	columns = ",".join(counters)
+	values = ",".join(value.format(sla=TICKET_SLA) for value in counters.values())
+	updates = ", ".join(f"{column} = {column} + excluded.{column}" for column in counters)
+	return f'''INSERT INTO metrics (granularity,bucket,queue,analyst,{columns})
+		SELECT buckets.granularity, strftime(buckets.format,{local_time_sql(time)}), new.queue, new.owner, {values} FROM ({buckets}) AS buckets{source} WHERE {time} IS NOT NULL AND {condition}
+		ON CONFLICT(granularity,bucket,queue,analyst) DO UPDATE SET {updates}'''
+
+#(Re)create the triggers that roll up ticket metrics, run again to pick up a change to TICKET_SLA.
+def _create_metric_triggers(cur):
+	for trigger in ('tickets_metrics_insert','tickets_metrics_taken','tickets_metrics_resolved','metrics_prune'):
+		cur.execute(f'DROP TRIGGER IF EXISTS {trigger}')
+	cur.execute(f'''CREATE TRIGGER tickets_metrics_insert AFTER INSERT ON tickets {ARCHIVE_GUARD} BEGIN
+		{_metric_event_sql('created')};
+		{_metric_event_sql('taken')};
+		END''')
+	cur.execute(f'''CREATE TRIGGER tickets_metrics_taken AFTER UPDATE OF started ON tickets WHEN old.started IS NULL AND new.started IS NOT NULL BEGIN
+		{_metric_event_sql('taken')};
+		END''')
+	cur.execute(f'''CREATE TRIGGER tickets_metrics_resolved AFTER UPDATE OF status ON tickets WHEN new.status IS 'Resolved' AND old.status IS NOT 'Resolved' BEGIN
+		{_metric_event_sql('resolved')};
+		END''')
+	#each new minute bucket clears out minute buckets past their retention
+	cur.execute(f'''CREATE TRIGGER metrics_prune AFTER INSERT ON metrics WHEN new.granularity = 'minute' BEGIN
+		DELETE FROM metrics WHERE granularity = 'minute' AND bucket < strftime('%Y-%m-%d %H:%M',new.bucket,'-{METRIC_MINUTE_RETENTION} days');
+		END''')
+
+#Fill the metrics table from scratch from every ticket, archived ones included. Only the current state of each ticket is known, so every event is counted against its current queue and owner,
+#and tickets that were resolved and reopened only count as resolved if they are resolved now.
+def _fill_metrics(cur):
+	cur.execute('DELETE FROM metrics')
+	tickets = f" CROSS JOIN {hot_and_archived('tickets')} AS new"
+	cur.execute(_metric_event_sql('created',tickets))
+	cur.execute(_metric_event_sql('taken',tickets))
+	cur.execute(_metric_event_sql('resolved',tickets,"new.status IS 'Resolved'"))
+	cur.execute(f"DELETE FROM metrics WHERE granularity = 'minute' AND bucket < strftime('%Y-%m-%d %H:%M','now','localtime','-{METRIC_MINUTE_RETENTION} days')")
+	return cur.execute('SELECT COUNT(*) FROM metrics').fetchone()[0]
+
+#Recreate the metric triggers and rebuild the metrics from the tickets table, returning how many buckets there are.
+def rebuild_metrics():
 	db,cur = db_connection()
-	queues = cur.execute('SELECT COUNT(tickets.id),queue.name FROM tickets INNER JOIN queue ON queue.id = tickets.queue WHERE tickets.created > datetime("now", "-1 Days") GROUP BY queue ORDER BY COUNT(tickets.id) DESC LIMIT 3')
-	return queues.fetchall()
-
-#Calculates the percentage of false positives from the last 24hrs
-def get_falsepos_today():
+	_create_metric_triggers(cur)
+	total = _fill_metrics(cur)
+	db.commit()
+	return total
+
+#Work out the averages and rates for a set of summed counters
+def _metric_summary(created,taken,resolved,false_positives,response_total,responses,resolution_total,resolutions,sla_breaches):
+	return {
+		'created':created,
+		'taken':taken,
+		'resolved':resolved,
+		'false_positive':round(false_positives/resolved*100) if resolved else 0,
+		'average_response':round(response_total/responses,2) if responses else 0,
+		'average_resolution':round(resolution_total/resolutions) if resolutions else 0,
+		'sla_breaches':sla_breaches,
+	}
+
+#Report on ticket metrics over one of the REPORT_RANGES, by adding up buckets. Returns a dict with the range, the totals across every queue and
+#a summary for each queue and analyst (busiest first), or None for an unknown range. queue limits the report to one queue.
+def metrics_report(period='24h',queue=None):
+	if(period not in REPORT_RANGES):
+		return None
+	length = REPORT_RANGES[period]
+	#minute buckets are only kept for recent reports
+	granularity,format = METRIC_BUCKETS[0] if length <= timedelta(days=METRIC_MINUTE_RETENTION - 1) else METRIC_BUCKETS[1]
+	since = (datetime.now() - length).strftime(format)
 	db,cur = db_connection()
-	#Grab all resolved tickets from the last day, group them by determination
-	ticket_by_determ = cur.execute('SELECT COUNT(id), determination FROM tickets WHERE status = "Resolved" AND completed != "Null" AND completed > datetime("now", "-1 Days") GROUP BY determination').fetchall()
-	#If no tickets
-	if(not ticket_by_determ):
-		return 0
-
-	#If there isn't both True and False Positive tickets (means there is only True or False positive)
-	if(len(ticket_by_determ) != 2):
-		#If the only determination isn't True positive, return 100(%), else return 0% (as there is no false positives)
-		if(ticket_by_determ[0][1] != "True Positive"):
-			return 100
-		else:
-			return 0
-
-	#All the amount of false positives to True positives to make a total
-	total = ticket_by_determ[0][0] + ticket_by_determ[1][0]
-	false = 0
-
-	#iterate between the groups of results (True or False positives), once false positive is found get the amount of them that there is
-	for determ in ticket_by_determ:
-		if(determ[1] != "False Positive"):
-			continue
-		false = determ[0]
-	
-	#Return the percentage of false positives to true, with no decimal places
-	return round(false/total*100)
-
-#Get the stats for the front page, using three previously defined functions and returning them as a list to be accessed by index
-def get_frontpage_stats():
+	query = '''SELECT metrics.queue, queue.name, metrics.analyst, users.name, SUM(created), SUM(taken), SUM(resolved), SUM(false_positives),
+			   SUM(response_total), SUM(responses), SUM(resolution_total), SUM(resolutions), SUM(sla_breaches)
+			   FROM metrics LEFT JOIN queue ON queue.id = metrics.queue LEFT JOIN users ON users.id = metrics.analyst
+			   WHERE granularity = ? AND bucket >= ?'''
+	params = (granularity,since,)
+	if(queue is not None):
+		query += ' AND metrics.queue = ?'
+		params += (queue,)
+	groups = cur.execute(query + ' GROUP BY metrics.queue, metrics.analyst',params).fetchall()
+
+	#add the queue and analyst groups up into totals, per queue and per analyst counters
+	totals = [0]*9
+	queues,analysts = {},{}
+	for group in groups:
+		counters = group[4:]
+		for summary,key in ((queues,(group[0],group[1])),(analysts,(group[2],group[3]))):
+			summary[key] = [a + b for a,b in zip(summary.get(key,[0]*9),counters)]
+		totals = [a + b for a,b in zip(totals,counters)]
+
+	return {
+		'range':period,
+		'granularity':granularity,
+		'since':since,
+		'totals':_metric_summary(*totals),
+		'queues':sorted(({'id':key[0],'name':key[1],**_metric_summary(*counters)} for key,counters in queues.items()),key=lambda a: a['created'],reverse=True),
+		'analysts':sorted(({'id':key[0],'name':key[1],**_metric_summary(*counters)} for key,counters in analysts.items()),key=lambda a: a['resolved'],reverse=True),
+	}
+
+#Names of the incident response framework steps, looked up by the step number - 1.
+FRAMEWORK_STEPS = ["Preparation","Detection and Analysis","Containment, Eradication and Recovery","Post-Incident Activity"]
+
+#Loads everything needed to show a ticket in a fixed handful of queries, no matter how much key info or how many comments it has.
+#Returns a dictionary matching the values the ViewTicket template uses, or None if the ticket doesn't exist. user is the id of the user viewing the ticket.
+def load_ticket_detail(ticketid,user):
 	db,cur = db_connection()
-	return get_total_created_lastday(),get_falsepos_today(),get_average_response(),average_timeto_resolution(),tickets_taken_late(),most_effective_analyst()
+	#fetch the ticket data for the ticket held at the id provided, from the archive if it isn't in the hot database. Its comments and key info are kept in the same database as it.
+	for store in ('main','archive'):
+		ticket = cur.execute(f'SELECT name,content,created,id,status,owner,occurrences,lastseen,knowledgemap FROM {store}.tickets WHERE id = ?',(ticketid,)).fetchone()
+		if(ticket):
+			break
+	else:
+		return None
+
+	#fetch all key information for this ticket, newest first, along with how many times each value has been seen across all tickets
+	key = cur.execute(TICKET_KEYINFO_COUNTS.format(store=store),(ticketid,)).fetchall()
+
+	#fetch all of the comments for the ticket, with the commenter's name
+	comments = cur.execute(TICKET_COMMENTS.format(store=store),(ticketid,)).fetchall()
+	#add the name of the framework step after the datetime, and whether the viewing user wrote the comment on the end
+	comments = [(*comment[0:3],FRAMEWORK_STEPS[comment[3]-1],*comment[3:],comment[4] == user) for comment in comments]
+
+	#fetch all the relationships for the ticket.
+	relations = cur.execute(TICKET_RELATIONS,(ticketid,)*4).fetchall()
+
+	#the knowledge mapping named in the ticket's title, if it exists
+	knowledge = cur.execute('SELECT id FROM knowledgemap WHERE id = ?',(ticket[8],)).fetchone()
+	ticket = ticket[0:8]
+
+	#the root of the incident cluster the ticket is in, and how many tickets are in it
+	root = _cluster_root(cur,ticket[3])
+	cluster = (root,_cluster_size(cur,root))
+
+	return {
+		'ticket':ticket,
+		'key':key,
+		'comments':comments,
+		'relations':relations,
+		'cluster':cluster,
+		#the knowledge mapping of the ticket, should it have one that exists. Other wise is false.
+		'knowledge':knowledge[0] if knowledge else False,
+		#network activity involving the ticket's key info
+		'events':ticket_events(ticketid),
+		'Owner':ticket[5] == user,
+	}
 
 #Generate a summary of an incident, based on the id of the ticket.
 def summarise_by_framework(ticket):
 	db,cur = db_connection()
 	#get all comments in order of the stage they were in, then by the date they were posted.
-	comments = cur.execute('SELECT comment, commenter, datetime, stage FROM comments WHERE post = ? ORDER BY stage, datetime',(ticket,)).fetchall()
+	comments = cur.execute(f"SELECT comment, commenter, datetime, stage FROM {hot_and_archived('comments')} WHERE post = ? ORDER BY stage, datetime",(ticket,)).fetchall()
 	
 	#Return false and end the function if no comments
 	if not(comments):
@@ -365,76 +1682,101 @@ def summarise_by_framework(ticket):
 	
 	return sorted_comments
 
-#Searches the database using a value passed from the search box on the Navbar.
-def search(term):
+#How many search results are shown on each page
+SEARCH_PAGE_SIZE = 25
+
+#Empty the full text search index and fill it again from the tickets, comments and keyinfo tables, archived rows included.
+def _fill_search_index(cur):
+	cur.execute('DELETE FROM search_index')
+	cur.execute(f"INSERT INTO search_index (rowid,ticket,title,body) SELECT id*4,id,name,content FROM {hot_and_archived('tickets','id,name,content')}")
+	cur.execute(f"INSERT INTO search_index (rowid,ticket,title,body) SELECT id*4+1,post,'',comment FROM {hot_and_archived('comments','id,post,comment')}")
+	cur.execute(f"INSERT INTO search_index (rowid,ticket,title,body) SELECT id*4+2,ticket,'',COALESCE(infotype,'') || ' ' || COALESCE(info,'') FROM {hot_and_archived('keyinfo','id,ticket,infotype,info')}")
+
+#Rebuild the search index from scratch, used to backfill databases or repair the index. Returns the number of rows indexed.
+def rebuild_search_index():
 	db,cur = db_connection()
-	#fetches all tickets in which the title, content,comments or key information contains the term passed as a a parameter
-	results = cur.execute(f'''SELECT tickets.id, tickets.name, tickets.created, users.name FROM comments INNER JOIN tickets ON tickets.id = comments.post 
-							  INNER JOIN users ON tickets.owner = users.id WHERE comments.comment LIKE "%{term}%" 
-							  UNION SELECT tickets.id, tickets.name, tickets.created, users.name  FROM tickets 
-							  INNER JOIN users ON tickets.owner = users.id WHERE tickets.name LIKE "%{term}%" OR content LIKE "%{term}%"
-							  UNION SELECT tickets.id, tickets.name, tickets.created, users.name FROM keyinfo INNER JOIN tickets ON tickets.id = keyinfo.ticket
-							  INNER JOIN users ON tickets.owner = users.id WHERE keyinfo.infotype LIKE "%{term}%" OR keyinfo.info LIKE "%{term}%"
-							  ORDER BY created DESC''').fetchall()
-	
-	#if no results return false and end function
-	if not(results):
-		return False
+	_fill_search_index(cur)
+	#merge the index into as few segments as possible, making searches quicker
+	cur.execute("INSERT INTO search_index (search_index) VALUES ('optimize')")
+	db.commit()
+	return cur.execute('SELECT COUNT(*) FROM search_index').fetchone()[0]
+
+#Turns the text typed into the search box into an FTS5 query. Each word is quoted so punctuation (IPs, emails, etc) is matched literally, and matches anything starting with that word.
+def build_search_query(term):
+	words = term.split()
+	return " ".join('"' + word.replace('"','""') + '"*' for word in words)
+
+#Searches the database using a value passed from the search box on the Navbar, archived tickets included.
+#Returns a page of results, best match first, and whether there is another page after it.
+def search(term,page=0,per_page=SEARCH_PAGE_SIZE):
+	query = build_search_query(term)
+	if not(query):
+		return [],False
+	db,cur = db_connection()
+	#Each ticket is ranked by its best matching title, body, comment or key info (bm25, title matches weigh more), with a snippet of the text that matched.
+	#The matches are materialised first as the ranking functions can only be used directly against the search index.
+	results = cur.execute('''WITH matches AS MATERIALIZED (
+							  SELECT ticket, bm25(search_index,0,5.0,1.0) AS rank, snippet(search_index,-1,char(2),char(3),'...',12) AS snippet
+							  FROM search_index WHERE search_index MATCH ?)
+							  SELECT best.ticket, COALESCE(tickets.name,archived.name), COALESCE(tickets.created,archived.created), users.name, best.snippet FROM
+							  (SELECT ticket, MIN(rank) AS rank, snippet FROM matches GROUP BY ticket) AS best
+							  LEFT JOIN main.tickets ON tickets.id = best.ticket LEFT JOIN archive.tickets AS archived ON archived.id = best.ticket
+							  INNER JOIN users ON COALESCE(tickets.owner,archived.owner) = users.id
+							  ORDER BY best.rank, best.ticket DESC LIMIT ? OFFSET ?''',(query,per_page+1,page*per_page,)).fetchall()
 	
-	#otherwise return all of the results found
-	return results
+	#COALESCE loses the epochms type of created, so it is converted here rather than by sqlite3
+	results = [(ticket,name,from_epoch_ms(created),owner,snippet) for ticket,name,created,owner,snippet in results]
+	#one extra row is fetched to find out if there is a further page
+	return results[:per_page],len(results) > per_page
 
 #Lookup a ticket a comment (comment id is passed as parameter) was posted on
 def post_from_comment(id):
 	db,cur = db_connection()
-	return cur.execute('SELECT post FROM comments WHERE id = ?',(id,)).fetchone()[0]
+	return cur.execute(f"SELECT post FROM {hot_and_archived('comments')} WHERE id = ?",(id,)).fetchone()[0]
 
 #Updates a comment, to its new value as specified by the submission of a form
-def update_comment(id,new_value):
-	db,cur = db_connection()
+@write_operation
+def update_comment(cur,id,new_value):
+	_restore_ticket_of(cur,'comments','post',id)
 	cur.execute('UPDATE comments SET comment = ? WHERE id = ?',(new_value,id,))
-	db.commit()
 
 #Delete a relationship from a database, based on the supplied relationship id
-def remove_relationship(id):
-	db,cur = db_connection()
+@write_operation
+def remove_relationship(cur,id):
+	_restore_ticket_of(cur,'relationships','ticketone',id)
+	pair = cur.execute('SELECT ticketone,tickettwo FROM relationships WHERE id = ?',(id,)).fetchone()
 	cur.execute('DELETE FROM relationships WHERE id = ?',(id,))
-	db.commit()
+	#the two tickets may no longer be linked, splitting their cluster in two
+	if(pair):
+		_split_cluster(cur,*pair)
 
 #Delete a piece of Key Information based on the key information id
-def remove_keyinfo(keyinfoid):
-	db,cur = db_connection()
+@write_operation
+def remove_keyinfo(cur,keyinfoid):
+	_restore_ticket_of(cur,'keyinfo','ticket',keyinfoid)
 	cur.execute('DELETE FROM keyinfo WHERE id = ?',(keyinfoid,))
-	db.commit()
 
 #Remove a comment from database, based on the id of the comment supplied.
-def remove_comment(commentid):
-	db,cur = db_connection()
+@write_operation
+def remove_comment(cur,commentid):
+	_restore_ticket_of(cur,'comments','post',commentid)
 	cur.execute('DELETE FROM comments WHERE id = ?',(commentid,))
-	db.commit()
 
 #Update a piece of key info, based on values supplied from a submitted form
-def update_keyinfo(keyinfoid,infotype,info):
-	db,cur = db_connection()
+@write_operation
+def update_keyinfo(cur,keyinfoid,infotype,info):
+	_restore_ticket_of(cur,'keyinfo','ticket',keyinfoid)
 	ticket = cur.execute('SELECT ticket FROM keyinfo WHERE id = ?',(keyinfoid,)).fetchone()[0]
-	print(ticket)
 	if not(cur.execute('SELECT 1 FROM keyinfo WHERE info = ? AND ticket = ?',(info,ticket,)).fetchone()):
 		cur.execute('UPDATE keyinfo SET infotype = ?, info = ? WHERE id = ?',(infotype,info,keyinfoid,))
-		db.commit()
 		return True
 	
 	else:
 		return False
 
-#Find a ticket using an exact match of title and body, this is used to find the ticket created from an email and return the id of the ticket, so that key information can be attributed to the correct ticket.
-def find_email_ticket(title,body):
-	db,cur = db_connection()
-	return cur.execute('SELECT id FROM tickets WHERE name = ? AND content = ? ORDER BY created DESC',(title,body,)).fetchone()[0]
-
 #Add key information found at ticket generation to the database, takes in a list of found key info
-def auto_key_info(ticket_id,findings):
-	db,cur = db_connection()
-
+@write_operation
+def auto_key_info(cur,ticket_id,findings):
 	if not(findings):
 		return False
 
@@ -444,195 +1786,590 @@ def auto_key_info(ticket_id,findings):
 			#insert key information to database, the infotype helps to show it was an automatic finding
 			cur.execute('INSERT INTO keyinfo (ticket,info,infotype) VALUES (?,?,?)',(ticket_id,finding,"extracted key info",))
 
-	db.commit()
+#Create many tickets generated from emails, plus their extracted key info, in a single transaction.
+#batch is a list of (title, queue, body, key info findings). Tickets for queues that don't exist go to the default queue (1).
+#If dedup_window (minutes) is set, an alert identical to an unresolved ticket seen within the window is folded into that ticket, increasing its occurrence count, rather than creating a new one.
+#Returns the ticket id for each alert in the same order, and how many of the alerts were folded into a ticket rather than creating one.
+def ingest_tickets(batch,dedup_window=0):
+	#queues are checked against the cached queues before writing, so the writer never has to read through the pool
+	batch = [(title,int(queue) if queue_exists(queue) else 1,body,findings) for title,queue,body,findings in batch]
+	return write(_ingest_tickets,batch,dedup_window)
+
+def _ingest_tickets(cur,batch,dedup_window):
+	created = datetime.now()
+	since = created - timedelta(minutes=dedup_window)
+	ids = []
+	keyinfo = []
+	folded = 0
+	#tickets made or matched earlier in this batch, by content hash
+	seen = {}
+	for title,queue,body,findings in batch:
+		digest = content_hash(title,queue,body)
+		ticket_id = seen.get(digest)
+		if(dedup_window and ticket_id is None):
+			match = cur.execute('SELECT id FROM tickets WHERE contenthash = ? AND status != "Resolved" AND lastseen > ? ORDER BY id DESC LIMIT 1',(digest,since,)).fetchone()
+			ticket_id = match[0] if match else None
+		if(dedup_window and ticket_id is not None):
+			cur.execute('UPDATE tickets SET occurrences = occurrences + 1, lastseen = ? WHERE id = ?',(created,ticket_id,))
+			folded += 1
+		else:
+			#New tickets from emails are owned by the Nobody user (1) until someone takes them.
+			cur.execute('INSERT INTO tickets (name,queue,content,owner,created,status,lastseen,contenthash,knowledgemap) VALUES (?,?,?,?,?,?,?,?,?)',(title,queue,body,1,created,"New",created,digest,parse_incident_identifier(title),))
+			ticket_id = cur.lastrowid
+		seen[digest] = ticket_id
+		ids.append(ticket_id)
+		if(findings):
+			keyinfo.extend((ticket_id,finding,"extracted key info") for finding in findings)
+	#the unique index on (ticket, info) drops any duplicate findings
+	cur.executemany('INSERT OR IGNORE INTO keyinfo (ticket,info,infotype) VALUES (?,?,?)',keyinfo)
+	return ids,folded
+
+#Insert a batch of parsed log events (occurred, protocol, source, destination, action, result) and record how far through the log file has been read, in one transaction so a restart carries on from the right place.
+@write_operation
+def insert_events(cur,events,path,position,inode=None):
+	cur.executemany('INSERT INTO events (occurred,protocol,source,destination,action,result) VALUES (?,?,?,?,?,?)',events)
+	cur.execute('INSERT INTO logsources (path,position,inode) VALUES (?,?,?) ON CONFLICT(path) DO UPDATE SET position = excluded.position, inode = excluded.inode',(path,position,inode,))
+
+#Returns how far (in bytes) through a log file has been read and the inode it had, or (0, None) if it hasn't been read before.
+def get_log_position(path):
+	db,cur = db_connection()
+	row = cur.execute('SELECT position,inode FROM logsources WHERE path = ?',(path,)).fetchone()
+	return row if row else (0,None)
+
+#How many network events are shown on a ticket
+TICKET_EVENT_LIMIT = 50
 
-#Closes linked tickets, leaving a comment to explain why
-def close_linked_tickets(ticket_id,user):
+#Fetch the most recent network events to or from any IP that is key information on the ticket, newest first.
+def ticket_events(ticketid,limit=TICKET_EVENT_LIMIT):
 	db,cur = db_connection()
-	#Fetch all of the related tickets to the selected Root ticket, that haven't been reolved yet.
-	related_tickets = cur.execute(f'SELECT ticketone FROM relationships INNER JOIN tickets on ticketone = tickets.id WHERE tickettwo = {ticket_id} AND status != "Resolved" UNION SELECT tickettwo FROM relationships INNER JOIN tickets ON tickets.id = tickettwo WHERE ticketone = {ticket_id} AND status != "Resolved"').fetchall()
+	keyinfo = hot_and_archived('keyinfo','ticket,info')
+	return cur.execute(f'''SELECT occurred,protocol,source,destination,action,result FROM events WHERE source IN (SELECT info FROM {keyinfo} WHERE ticket = ?)
+						  UNION SELECT occurred,protocol,source,destination,action,result FROM events WHERE destination IN (SELECT info FROM {keyinfo} WHERE ticket = ?)
+						  ORDER BY occurred DESC LIMIT ?''',(ticketid,ticketid,limit,)).fetchall()
+
+#Incident clusters are kept as a flattened union-find. Each clustered ticket points straight at its root, so finding a ticket's root is a single
+#primary key lookup, and listing a cluster is a single index range. Joining two clusters moves the smaller one under the larger one's root,
+#so a ticket changes root at most log2(n) times however the cluster is built up.
+
+#The root of the cluster a ticket is in, the ticket itself if it isn't linked to anything.
+def _cluster_root(cur,ticket):
+	root = cur.execute('SELECT root FROM clusters WHERE ticket = ?',(ticket,)).fetchone()
+	return root[0] if root else ticket
+
+def _cluster_size(cur,root):
+	size = cur.execute('SELECT size FROM clustersizes WHERE root = ?',(root,)).fetchone()
+	return size[0] if size else 1
+
+#Merge the clusters of two newly linked tickets.
+def _join_clusters(cur,t1,t2):
+	root1,root2 = _cluster_root(cur,t1),_cluster_root(cur,t2)
+	if(root1 == root2):
+		return
+	size1,size2 = _cluster_size(cur,root1),_cluster_size(cur,root2)
+	#move the smaller cluster under the larger one
+	if(size1 < size2):
+		root1,root2,size1,size2 = root2,root1,size2,size1
+	cur.execute('INSERT OR IGNORE INTO clusters (ticket,root) VALUES (?,?)',(root1,root1,))
+	cur.execute('INSERT OR IGNORE INTO clusters (ticket,root) VALUES (?,?)',(root2,root1,))
+	cur.execute('UPDATE clusters SET root = ? WHERE root = ?',(root1,root2,))
+	cur.execute('DELETE FROM clustersizes WHERE root = ?',(root2,))
+	cur.execute('INSERT OR REPLACE INTO clustersizes (root,size) VALUES (?,?)',(root1,size1 + size2,))
+
+#Store the cluster containing ticket, found by following its relationships, under its lowest ticket id. Returns the tickets in it.
+def _relabel_component(cur,ticket):
+	members = [row[0] for row in cur.execute(CLUSTER_COMPONENT + ' SELECT id FROM component',(ticket,)).fetchall()]
+	if(len(members) == 1):
+		cur.execute('DELETE FROM clusters WHERE ticket = ?',(ticket,))
+		cur.execute('DELETE FROM clustersizes WHERE root = ?',(ticket,))
+		return members
+	root = min(members)
+	cur.executemany('INSERT OR REPLACE INTO clusters (ticket,root) VALUES (?,?)',[(member,root,) for member in members])
+	cur.execute('INSERT OR REPLACE INTO clustersizes (root,size) VALUES (?,?)',(root,len(members),))
+	return members
+
+#After the relationship between two tickets is removed, split their cluster if nothing else links them.
+def _split_cluster(cur,t1,t2):
+	old_root = _cluster_root(cur,t1)
+	cur.execute('DELETE FROM clustersizes WHERE root = ?',(old_root,))
+	members = _relabel_component(cur,t1)
+	if(t2 not in members):
+		_relabel_component(cur,t2)
+
+#Make a ticket the root of its cluster.
+def _set_cluster_root(cur,ticket):
+	root = _cluster_root(cur,ticket)
+	if(root == ticket):
+		return
+	cur.execute('UPDATE clusters SET root = ? WHERE root = ?',(ticket,root,))
+	cur.execute('UPDATE clustersizes SET root = ? WHERE root = ?',(ticket,root,))
+
+#(Re)build every cluster from the relationships table, running union-find over all of the relationships in memory.
+def _fill_clusters(cur):
+	parent = {}
+	def find(ticket):
+		root = parent.setdefault(ticket,ticket)
+		while root != parent[root]:
+			root = parent[root]
+		#point everything on the way straight at the root
+		while ticket != root:
+			parent[ticket],ticket = root,parent[ticket]
+		return root
+	for t1,t2 in cur.execute(f"SELECT ticketone,tickettwo FROM {hot_and_archived('relationships','ticketone,tickettwo')}").fetchall():
+		root1,root2 = find(t1),find(t2)
+		if(root1 != root2):
+			#the lowest ticket id becomes the root
+			parent[max(root1,root2)] = min(root1,root2)
+	roots = {ticket:find(ticket) for ticket in parent}
+	sizes = {}
+	for root in roots.values():
+		sizes[root] = sizes.get(root,0) + 1
+	cur.execute('DELETE FROM clusters')
+	cur.execute('DELETE FROM clustersizes')
+	cur.executemany('INSERT INTO clusters (ticket,root) VALUES (?,?)',roots.items())
+	cur.executemany('INSERT INTO clustersizes (root,size) VALUES (?,?)',sizes.items())
+	return len(sizes)
+
+#Rebuild the cluster index from scratch, returning how many clusters there are.
+def rebuild_clusters():
+	db,cur = db_connection()
+	total = _fill_clusters(cur)
+	db.commit()
+	return total
+
+#The tickets in a ticket's cluster, including itself, as (id, name, status) rows in ticket id order.
+def _cluster_members(cur,ticket):
+	root = _cluster_root(cur,int(ticket))
+	members = cur.execute(CLUSTER_MEMBERS,(root,)).fetchall()
+	if not(members):
+		members = cur.execute(f"SELECT id, name, status FROM {hot_and_archived('tickets')} WHERE id = ?",(root,)).fetchall()
+	return members
+
+#Closes every other open ticket in the ticket's incident cluster (linked directly or through other tickets), leaving a comment to explain why, and makes the ticket the cluster's root.
+@write_operation
+def close_linked_tickets(cur,ticket_id,user):
+	ticket_id = int(ticket_id)
+	#Fetch all of the tickets in the cluster of the selected Root ticket, that haven't been reolved yet.
+	related_tickets = [(member[0],) for member in _cluster_members(cur,ticket_id) if member[0] != ticket_id and member[2] != "Resolved"]
 	
 	#if tickets that haven't been resolved are found
 	if(related_tickets):
+		now = datetime.now()
 		#update each of them to be resolved and set the closing time as now. This statement is like a for loop.
-		cur.executemany(f'UPDATE tickets SET status = "Resolved", completed = "{str(datetime.now())}" WHERE id = ?',related_tickets)
+		cur.executemany('UPDATE tickets SET status = "Resolved", completed = ? WHERE id = ?',[(now,ticket[0],) for ticket in related_tickets])
 		#Comment to be left on closed tickets.
-		comment = f"This ticket has been deemed to be related to another ticket and as such has been closed and linked to a Root Ticket. Visit the root ticket for further investigation."
+		comment = "This ticket has been deemed to be related to another ticket and as such has been closed and linked to a Root Ticket. Visit the root ticket for further investigation."
 		#Iterate the results of the related_tickets and leave a comment on each that is closed to explain why.
-		cur.executemany(f'INSERT INTO comments (comment,commenter,post,datetime,stage) VALUES ("{comment}","{user}",?,"{datetime.now()}",1)',related_tickets)
-	
-	db.commit()
-
-#Takes a series of ticket ids and links them to one selected ticket, if it isn't already.			
-def bulk_relate_to_root(tickets,root):
-	total = 0
-	if(root):
-		for ticket in tickets:
-			if(insert_relationship(root,ticket)):
-				total += 1
-	
-	#if at least one was added to database.
-	if total >= 1:
-		return True
+		cur.executemany('INSERT INTO comments (comment,commenter,post,datetime,stage) VALUES (?,?,?,?,1)',[(comment,user,ticket[0],now,) for ticket in related_tickets])
+	_set_cluster_root(cur,ticket_id)
+
+#How many ticket ids are checked in one IN query, kept under SQLite's limit on query parameters
+ID_CHUNK_SIZE = 500
+
+#The ids out of a list of ticket ids that belong to existing tickets.
+def _existing_tickets(cur,ids):
+	existing = set()
+	for start in range(0,len(ids),ID_CHUNK_SIZE):
+		chunk = ids[start:start + ID_CHUNK_SIZE]
+		existing.update(row[0] for row in cur.execute(f'SELECT id FROM tickets WHERE id IN ({",".join("?" * len(chunk))})',chunk).fetchall())
+	return existing
+
+#Relate a set of tickets in one transaction, returning how many new relationships were added.
+#With a root every ticket is linked to the root, with star the tickets are linked to the first of them, otherwise every ticket is linked to every other one.
+#Ids that aren't numbers or don't belong to a ticket are ignored, as is everything if the root doesn't exist. Pairs already related either way round are skipped. Archived tickets are restored before they are related.
+@write_operation
+def relate_tickets(cur,tickets,root=None,star=False):
+	ids = list(dict.fromkeys(int(ticket) for ticket in tickets if str(ticket).strip().isdigit()))
+	if(root is not None):
+		root = int(root)
+		ids.insert(0,root)
+	for ticket in ids:
+		_restore_ticket(cur,ticket)
+	existing = _existing_tickets(cur,ids)
+	if(root is not None and root not in existing):
+		return 0
+	ids = [ticket for ticket in dict.fromkeys(ids) if ticket in existing]
+	if(len(ids) < 2):
+		return 0
+	if(root is not None or star):
+		pairs = [(ids[0],ticket) for ticket in ids[1:]]
 	else:
-		False
-
-#Takes a series of tickets and recursively relates them to one another, each ticket will be related to every other one by the end.
-def recursive_relate(tickets):
-	for ticket in tickets:
-		for other in tickets:
-			insert_relationship(ticket,other)
-
-#Takes a tickets title and finds if it has a knowledge mapping ID in it, returning it if so
-def has_incident_identifier(title):
-	identifier_prefix = "INC"
-	identifier = 0
-
-	#splits the title into words looking for the prefix that indicates a knowledge mapping. replaces the prefix with a blank character to get the ID
-	for string in title.split(" "):
-		if(identifier_prefix in string):
-			identifier = string.replace(identifier_prefix,"")
-
-	db,cur = db_connection()
-	#if an identifier is found, return it
-	if(identifier_prefix in title and identifier != 0):
-		if(cur.execute('SELECT 1 FROM knowledgemap WHERE id = ?',(identifier,)).fetchone()):
-			return identifier
-
-	return False
+		pairs = [(ticket,other) for position,ticket in enumerate(ids) for other in ids[position + 1:]]
+	#the unique index on (ticketone, tickettwo) ignores repeats, and the NOT EXISTS skips pairs stored the other way round
+	cur.executemany('''INSERT OR IGNORE INTO relationships (ticketone,tickettwo) SELECT ?,?
+					  WHERE NOT EXISTS (SELECT 1 FROM relationships WHERE ticketone = ? AND tickettwo = ?)''',[(t1,t2,t2,t1,) for t1,t2 in pairs])
+	added = cur.rowcount
+	#linking every ticket to the first is enough to put them all in one cluster
+	for ticket in ids[1:]:
+		_join_clusters(cur,ids[0],ticket)
+	return added
+
+#Takes a series of ticket ids and links them to one selected ticket, if it isn't already. Returns True if at least one was added.
+def bulk_relate_to_root(tickets,root):
+	if not(str(root).strip().isdigit()):
+		return False
+	return relate_tickets(tickets,root) >= 1
+
+#Takes a series of tickets and relates them to one another, each ticket will be related to every other one by the end, or only to the first ticket when star is set.
+def recursive_relate(tickets,star=False):
+	return relate_tickets(tickets,star=star)
+
+#A knowledge mapping identifier in a ticket title, the prefix INC followed by the mapping's id
+INCIDENT_IDENTIFIER = re.compile(r"INC(\d+)\b")
+
+#Finds the knowledge mapping id named in a ticket title, the last one if there are several. Returns None if there isn't one.
+#Only parses the title, the mapping may not exist (yet).
+def parse_incident_identifier(title):
+	identifiers = INCIDENT_IDENTIFIER.findall(title or "")
+	return int(identifiers[-1]) if identifiers else None
+
+#Fill in the knowledge mapping of every existing ticket from its title
+def _backfill_knowledge_mappings(cur):
+	updates = []
+	for ticket,name in cur.execute('SELECT id,name FROM tickets').fetchall():
+		identifier = parse_incident_identifier(name)
+		if(identifier is not None):
+			updates.append((identifier,ticket,))
+	cur.executemany('UPDATE tickets SET knowledgemap = ? WHERE id = ?',updates)
 
 #Add a knowledge mapping to the database, if one with the same name doesn't already exist
-def add_knowledgebase_entry(title,body):
-	db,cur = db_connection()
+@write_operation
+def add_knowledgebase_entry(cur,title,body):
 	if not (cur.execute('SELECT 1 FROM knowledgemap WHERE title = ?',(title,)).fetchone()):
 		cur.execute('INSERT INTO knowledgemap (title,body) VALUES (?,?)',(title,body,))
-		db.commit()
 		return True
 	else:
 		return False
 
 #removes a knowledge mapping from the database if it exists		
-def remove_knowledgebase_entry(knowledgeid):
-	db,cur = db_connection()
+@write_operation
+def remove_knowledgebase_entry(cur,knowledgeid):
 	if not(cur.execute('SELECT 1 FROM knowledgemap WHERE id = ?',(knowledgeid,))):
 		return False
 	
 	cur.execute('DELETE FROM knowledgemap WHERE id = ?',(knowledgeid,))
-	db.commit()
+	#the mapping and its guidance go in the same transaction
 	remove_all_guidance(knowledgeid)
 	return True
 
-#Gets stats about a knowledge mapping, including the total seen (ever), false positive ratio and volume seen in the last seven days
-def stats_by_knowledge(knowledgeid):
-	db,cur = db_connection()
-	search_string = "INC" + str(knowledgeid)
+#Turn a (total, false positives, volume) row into (total, false positive percentage, volume)
+def _knowledge_stats_row(total,false_pos,volume):
 	false_pos_percentage = 0
-
-	#All stats use a LIKE search (works like a contains function) the occurance must have a space after to prevent finding 100 when looking for 1 or 10, etc
-
-	total = cur.execute(f'SELECT COUNT(id) FROM tickets WHERE name LIKE "%{search_string} %"').fetchone()[0]
-
-	false_pos = cur.execute(f'SELECT COUNT(id) FROM tickets WHERE name LIKE "%{search_string} %" AND determination = "False Positive" AND determination != "NULL"').fetchone()[0]
-
-	volume = cur.execute(f'SELECT COUNT(id) FROM tickets WHERE name LIKE "%{search_string} %" AND created > datetime("now", "-7 Days")').fetchone()[0]
-
 	if(false_pos):
 		false_pos_percentage = round((false_pos / total)*100)
-
 	return total,false_pos_percentage,volume
 
+#The start of the last seven days, for knowledge mapping volume
+def _knowledge_volume_since():
+	return datetime.now() - timedelta(days=7)
 
-#Creates a guidance entry for a particular knowledge mapping
-def create_knowledge_guidance(title,body,knowledgemap):
+#Gets stats about a knowledge mapping, including the total seen (ever), false positive ratio and volume seen in the last seven days
+def stats_by_knowledge(knowledgeid):
 	db,cur = db_connection()
+	return _knowledge_stats_row(*cur.execute(KNOWLEDGE_STATS + ' WHERE knowledgemap = ?',(_knowledge_volume_since(),knowledgeid,)).fetchone()[0:3])
+
+#Every knowledge mapping with its stats, as (id, title, total, false positive percentage, volume in the last seven days) in id order. Counted in one pass over the tickets.
+def knowledge_mappings_with_stats():
+	db,cur = db_connection()
+	stats = {}
+	for row in cur.execute(KNOWLEDGE_STATS + ' WHERE knowledgemap IS NOT NULL GROUP BY knowledgemap',(_knowledge_volume_since(),)).fetchall():
+		stats[row[3]] = _knowledge_stats_row(*row[0:3])
+	return [(mapping[0],mapping[1],*stats.get(mapping[0],(0,0,0))) for mapping in cur.execute('SELECT id, title FROM knowledgemap ORDER BY id ASC').fetchall()]
+
+
+#Creates a guidance entry for a particular knowledge mapping
+@write_operation
+def create_knowledge_guidance(cur,title,body,knowledgemap):
 	#if guidance for this mapping exists with the same name, stop. Else enter values to database
 	if(cur.execute('SELECT 1 FROM knowledge WHERE knowledgemap = ? AND title = ?',(knowledgemap,title,)).fetchone()):
 		return False
 
 	cur.execute('INSERT INTO knowledge (title,body,knowledgemap) VALUES (?,?,?)',(title,body,knowledgemap,))
-	db.commit()
 	return True
 
 #removes a piece of guidance from the database, if it exists.
-def remove_guidance_entry_fromdb(guidanceid):
-	db,cur = db_connection()
+@write_operation
+def remove_guidance_entry_fromdb(cur,guidanceid):
 	if not(cur.execute('SELECT 1 FROM knowledge WHERE id = ?',(guidanceid,)).fetchone()):
 		return False
 	
 	cur.execute('DELETE FROM knowledge WHERE id = ?',(guidanceid,))
-	db.commit()
 	return True
 
 #Update the values of a piece of guidance, if it exists.
-def update_guidance_entry_fromdb(guidanceid,newtitle,newbody):
-	db,cur = db_connection()
+@write_operation
+def update_guidance_entry_fromdb(cur,guidanceid,newtitle,newbody):
 	if not(cur.execute('SELECT 1 FROM knowledge WHERE id = ?',(guidanceid,)).fetchone()) or cur.execute('SELECT 1 FROM knowledge WHERE id != ? AND title = ?',(guidanceid,newtitle,)).fetchone():
 		return False
 	
 	cur.execute('UPDATE knowledge SET title = ?, body = ? WHERE id = ?',(newtitle,newbody,guidanceid,))
-	db.commit()
 	return True
 
 #checks that a knowledge map exists and updates it with values sent from a form, after the title is validated to not already exist
-def update_knowledge_mapping_fromdb(mapid,newtitle,newbody):
-	db,cur = db_connection()
+@write_operation
+def update_knowledge_mapping_fromdb(cur,mapid,newtitle,newbody):
 	if not(cur.execute('SELECT 1 FROM knowledgemap WHERE id = ?',(mapid,)).fetchone()) or (cur.execute('SELECT 1 from knowledgemap WHERE title = ? AND id != ?',(newtitle,mapid,)).fetchone()):
 		return False
 	
 	cur.execute('UPDATE knowledgemap SET title = ?, body = ? WHERE id = ?',(newtitle,newbody,mapid,))
-	db.commit()
 	return True
 
 #removes all guidance for a mapping from the database, used when removing a mapping to prevent guidance being inherited.
-def remove_all_guidance(mapid):
-	db,cur = db_connection()
+@write_operation
+def remove_all_guidance(cur,mapid):
 	cur.execute('DELETE FROM knowledge WHERE knowledgemap = ?',(mapid,))
+
+#Fill ioc_stats and ioc_days from scratch, from the key info on every ticket, archived ones included. Returns how many indicators there are.
+def _fill_ioc_stats(cur):
+	cur.execute('DELETE FROM ioc_stats')
+	cur.execute('DELETE FROM ioc_days')
+	keyinfo = hot_and_archived('keyinfo','ticket,info')
+	tickets = hot_and_archived('tickets','id,status,determination,created')
+	cur.execute(f'''INSERT INTO ioc_stats (indicator,sightings,resolved,false_positives,first_seen,last_seen)
+				   SELECT lower(trim(keyinfo.info)), COUNT(*), SUM(status IS 'Resolved'), SUM(status IS 'Resolved' AND determination IS 'False Positive'), MIN(created), MAX(created)
+				   FROM {keyinfo} AS keyinfo INNER JOIN {tickets} AS tickets ON tickets.id = keyinfo.ticket GROUP BY lower(trim(keyinfo.info))''')
+	cur.execute(f'''INSERT INTO ioc_days (indicator,day,sightings)
+				   SELECT lower(trim(keyinfo.info)), date(created/1000,'unixepoch','localtime'), COUNT(*) FROM {keyinfo} AS keyinfo INNER JOIN {tickets} AS tickets ON tickets.id = keyinfo.ticket
+				   GROUP BY lower(trim(keyinfo.info)), date(created/1000,'unixepoch','localtime')''')
+	return cur.execute('SELECT COUNT(*) FROM ioc_stats').fetchone()[0]
+
+#Rebuild the indicator reputation table from the key info, returning how many indicators there are.
+def rebuild_ioc_stats():
+	db,cur = db_connection()
+	total = _fill_ioc_stats(cur)
 	db.commit()
+	return total
 
-#Fetch stats about a specified piece of key information
-def key_info_stats(keyinfovalue):
+#The reputation of an indicator, a dict of its sightings, resolved and false positive counts, first and last seen times and sightings in the last 7 days. None if it has never been seen.
+#Indicators are matched ignoring case and surrounding whitespace.
+def ioc_reputation(value):
 	db,cur = db_connection()
+	stats = cur.execute('SELECT sightings,resolved,false_positives,first_seen,last_seen FROM ioc_stats WHERE indicator = lower(trim(?))',(value,)).fetchone()
+	if not(stats):
+		return None
+	#sightings are counted per day, so the last 7 days are today and the 6 days before it
+	since = (datetime.now() - timedelta(days=7)).strftime('%Y-%m-%d')
+	volume = cur.execute('SELECT COALESCE(SUM(sightings),0) FROM ioc_days WHERE indicator = lower(trim(?)) AND day > ?',(value,since,)).fetchone()[0]
+	return {
+		'sightings':stats[0],
+		'resolved':stats[1],
+		'false_positives':stats[2],
+		'first_seen':stats[3],
+		'last_seen':stats[4],
+		'volume':volume,
+	}
+
+#Fetch stats about a specified piece of key information, (total sightings, false positive percentage of resolved tickets, volume in the last 7 days, first seen, last seen)
+def key_info_stats(keyinfovalue):
+	reputation = ioc_reputation(keyinfovalue)
+	if not(reputation):
+		return 0,0,0,None,None
 	false_positive = 0
-	#get all occurences of the key info
-	tickets = cur.execute('SELECT ticket FROM keyinfo WHERE info = ?',(keyinfovalue,)).fetchall()
-	#find how many occurances there has been
-	total = len(tickets)
-	#Fetch only the amount of tickets that have been resolved, to giver better indication to how many are false positive if lots came in at once.
-	total_resolved = cur.execute('SELECT COUNT(tickets.id) FROM keyinfo INNER JOIN tickets on tickets.id = keyinfo.ticket WHERE info = ? AND status = "Resolved"',(keyinfovalue,)).fetchone()[0]
-	#if there is any occurances, find out how many have been False Positive
-	if(tickets):
-		#find out the percentage that have been false positive, if none have been found will default to zero
-		try:
-			false_positive = round((cur.execute('SELECT COUNT(tickets.id) FROM keyinfo INNER JOIN tickets on tickets.id = keyinfo.ticket WHERE status = "Resolved" AND info = ? AND determination = "False Positive"',(keyinfovalue,)).fetchone()[0] / total_resolved) * 100)
-		except ZeroDivisionError:
-			pass
-		
-	#get the amount of occurences from the last 7 days
-	volume = cur.execute('SELECT COUNT(tickets.id) FROM keyinfo INNER JOIN tickets on keyinfo.ticket = tickets.id WHERE info = ? AND created > datetime("now", "-7 Days")',(keyinfovalue,)).fetchone()[0]
+	#only resolved tickets count towards the false positive rate, to giver better indication to how many are false positive if lots came in at once.
+	if(reputation['resolved']):
+		false_positive = round((reputation['false_positives'] / reputation['resolved']) * 100)
 
 	#return stats as a tuple to be accessed by index
-	return total,false_positive,volume
+	return reputation['sightings'],false_positive,reputation['volume'],reputation['first_seen'],reputation['last_seen']
 
-#Fetches the three most active analysts (By the amount of tickets they've resolved) Last day only.
-def most_effective_analyst():
+#Every ticket, hot or archived, a piece of key information is on, as (info, ticket, infotype)
+def key_info_tickets(keyinfovalue):
 	db,cur = db_connection()
-	analysts = cur.execute('SELECT users.name,COUNT(tickets.id) FROM tickets INNER join users on owner=users.id WHERE created > datetime("now","-1 Days") AND status = "Resolved" ORDER BY COUNT(tickets.id) DESC LIMIT 3').fetchall()
-	if analysts[0][1]==0:
-		return False
-	else:
-		return analysts
+	return cur.execute(KEYINFO_TICKETS,(keyinfovalue,)).fetchall()
 
-#Gets the average time to resolve a ticket, from the last day.
-def average_timeto_resolution():
-	db,cur = db_connection()
-	average = cur.execute('SELECT AVG((julianday(completed) - julianday(created))*24*60) FROM tickets WHERE status="Resolved" AND created > datetime("now","-1 Days")').fetchone()[0]
-	if not(average):
-		return 0
-	return round(average)
+#Move an archived ticket, with its comments, key info and relationships, back into the hot database. Returns False if the ticket isn't archived.
+#Called by every write to a ticket or its rows, so changing an archived ticket makes it live again.
+def _restore_ticket(cur,ticket):
+	if not(cur.execute('SELECT 1 FROM archive.tickets WHERE id = ?',(ticket,)).fetchone()):
+		return False
+	#a ticket still in the hot database has been copied by an archive run that hasn't removed it yet (or stopped before it could), its hot rows are kept and the copy is dropped
+	if not(cur.execute('SELECT 1 FROM main.tickets WHERE id = ?',(ticket,)).fetchone()):
+		#the rows are already counted in the search index, indicator stats and metrics
+		cur.execute('INSERT OR IGNORE INTO archiving (id) VALUES (1)')
+		cur.execute('INSERT INTO main.tickets SELECT * FROM archive.tickets WHERE id = ?',(ticket,))
+		cur.execute('INSERT INTO main.comments SELECT * FROM archive.comments WHERE post = ?',(ticket,))
+		cur.execute('INSERT INTO main.keyinfo SELECT * FROM archive.keyinfo WHERE ticket = ?',(ticket,))
+		#a relationship is only archived while both of its tickets are
+		cur.execute('INSERT OR IGNORE INTO main.relationships SELECT * FROM archive.relationships WHERE ticketone = ? OR tickettwo = ?',(ticket,ticket,))
+		cur.execute('DELETE FROM archiving')
+	cur.execute('DELETE FROM archive.relationships WHERE ticketone = ? OR tickettwo = ?',(ticket,ticket,))
+	cur.execute('DELETE FROM archive.keyinfo WHERE ticket = ?',(ticket,))
+	cur.execute('DELETE FROM archive.comments WHERE post = ?',(ticket,))
+	cur.execute('DELETE FROM archive.tickets WHERE id = ?',(ticket,))
+	return True
 
-#How many tickets have been taken over acceptable limits in  the last day
-def tickets_taken_late():
-	acceptable = 15
+#Restore the ticket a comment, key info or relationship row belongs to, if the row is archived.
+def _restore_ticket_of(cur,table,column,rowid):
+	row = cur.execute(f'SELECT {column} FROM archive.{table} WHERE id = ?',(rowid,)).fetchone()
+	if(row):
+		_restore_ticket(cur,row[0])
+
+#Copy the next batch of tickets due to be archived, with their rows, into the archive. Returns the ids of the tickets copied.
+#The hot tables' ids are AUTOINCREMENT (schema version 15), so an archived row's id is never handed out to a new row.
+@write_operation
+def _copy_to_archive(cur,before,limit):
+	ids = [row[0] for row in cur.execute(ARCHIVE_CANDIDATES,(before,limit,)).fetchall()]
+	if not(ids):
+		return ids
+	batch = json.dumps(ids)
+	cur.execute('INSERT OR REPLACE INTO archive.tickets SELECT * FROM main.tickets WHERE id IN (SELECT value FROM json_each(?))',(batch,))
+	cur.execute('INSERT OR REPLACE INTO archive.comments SELECT * FROM main.comments WHERE post IN (SELECT value FROM json_each(?))',(batch,))
+	cur.execute('INSERT OR REPLACE INTO archive.keyinfo SELECT * FROM main.keyinfo WHERE ticket IN (SELECT value FROM json_each(?))',(batch,))
+	#relationships go once both of their tickets are archived
+	cur.execute('''INSERT OR REPLACE INTO archive.relationships SELECT * FROM main.relationships
+				   WHERE (ticketone IN (SELECT value FROM json_each(?)) OR tickettwo IN (SELECT value FROM json_each(?)))
+				   AND ticketone IN (SELECT id FROM archive.tickets) AND tickettwo IN (SELECT id FROM archive.tickets)''',(batch,batch,))
+	return ids
+
+#Remove tickets copied by _copy_to_archive from the hot database, returning how many were removed. A ticket reopened, or given new comments or key info,
+#since it was copied stays hot and its copy is dropped, it is copied again the next time it is due.
+@write_operation
+def _remove_archived(cur,ids):
+	batch = json.dumps(ids)
+	moved = [row[0] for row in cur.execute('''SELECT id FROM main.tickets WHERE id IN (SELECT value FROM json_each(?)) AND status = 'Resolved' AND id IN (SELECT id FROM archive.tickets)
+											  AND NOT EXISTS (SELECT 1 FROM main.comments WHERE post = tickets.id AND id NOT IN (SELECT id FROM archive.comments))
+											  AND NOT EXISTS (SELECT 1 FROM main.keyinfo WHERE ticket = tickets.id AND id NOT IN (SELECT id FROM archive.keyinfo))''',(batch,)).fetchall()]
+	stayed = json.dumps(list(set(ids) - set(moved)))
+	moved_batch = json.dumps(moved)
+	cur.execute('INSERT OR IGNORE INTO archiving (id) VALUES (1)')
+	cur.execute('DELETE FROM main.comments WHERE post IN (SELECT value FROM json_each(?))',(moved_batch,))
+	cur.execute('DELETE FROM main.keyinfo WHERE ticket IN (SELECT value FROM json_each(?))',(moved_batch,))
+	cur.execute('DELETE FROM main.tickets WHERE id IN (SELECT value FROM json_each(?))',(moved_batch,))
+	cur.execute('''DELETE FROM main.relationships WHERE (ticketone IN (SELECT value FROM json_each(?)) OR tickettwo IN (SELECT value FROM json_each(?)))
+				   AND id IN (SELECT id FROM archive.relationships)''',(moved_batch,moved_batch,))
+	cur.execute('DELETE FROM archiving')
+	cur.execute('DELETE FROM archive.relationships WHERE ticketone IN (SELECT value FROM json_each(?)) OR tickettwo IN (SELECT value FROM json_each(?))',(stayed,stayed,))
+	cur.execute('DELETE FROM archive.keyinfo WHERE ticket IN (SELECT value FROM json_each(?))',(stayed,))
+	cur.execute('DELETE FROM archive.comments WHERE post IN (SELECT value FROM json_each(?))',(stayed,))
+	cur.execute('DELETE FROM archive.tickets WHERE id IN (SELECT value FROM json_each(?))',(stayed,))
+	return len(moved)
+
+#Move tickets resolved more than days ago, with their comments, key info and relationships, into the archive database, batch tickets at a time.
+#Returns how many tickets were moved. SQLite only commits each attached database atomically on its own, so each batch is copied to the archive in one
+#transaction and removed from the hot database in the next: if the process stops in between, the tickets are in both until the next run moves them.
+def archive_resolved_tickets(days=ARCHIVE_AFTER_DAYS,batch=ARCHIVE_BATCH_SIZE):
+	before = datetime.now() - timedelta(days=days)
+	moved = 0
+	while True:
+		ids = _copy_to_archive(before,batch)
+		if(ids):
+			moved += _remove_archived(ids)
+		if(len(ids) < batch):
+			return moved
+
+#How many tickets are in the hot database and the archive
+def archive_counts():
 	db,cur = db_connection()
-	tickets = cur.execute('SELECT COUNT(id) FROM tickets WHERE started > datetime("now","-1 Days") AND (julianday(started) - julianday(created))*24*60 > ?',(acceptable,)).fetchone()[0]
-	return tickets
\ No newline at end of file
+	return cur.execute('SELECT (SELECT COUNT(*) FROM main.tickets), (SELECT COUNT(*) FROM archive.tickets)').fetchone()
+
+#Exports read this many tickets at a time from the cursor, fetching the comments and key info for each batch in one go, and send the output in chunks of about
+#EXPORT_CHUNK_SIZE characters, so an export of any size only holds one batch in memory.
+EXPORT_BATCH_SIZE = 500
+EXPORT_CHUNK_SIZE = 65536
+#One arm of the export query, run against the hot database and the archive. The two arms are both read in created order from their tickets_created
+#index and merged, rather than sorted.
+EXPORT_TICKETS = '''SELECT tickets.id, tickets.name, tickets.status, queue.name, users.name, tickets.created, tickets.started, tickets.completed, tickets.determination, tickets.content
+	FROM {store}.tickets AS tickets LEFT JOIN queue ON queue.id = tickets.queue LEFT JOIN users ON users.id = tickets.owner WHERE {conditions}'''
+EXPORT_COMMENTS = f'''SELECT comments.post, comments.datetime, users.name, comments.stage, comments.comment FROM {hot_and_archived('comments')} AS comments
+	LEFT JOIN users ON users.id = comments.commenter WHERE comments.post IN (SELECT value FROM json_each(?)) ORDER BY comments.post, comments.datetime'''
+EXPORT_KEYINFO = f"SELECT ticket, infotype, info FROM {hot_and_archived('keyinfo')} WHERE ticket IN (SELECT value FROM json_each(?)) ORDER BY ticket"
+#The columns of a CSV export, one row per ticket. Key info and comments are each put in one column, a line per entry.
+EXPORT_CSV_COLUMNS = ('id','name','status','queue','owner','created','started','completed','determination','response_minutes','resolution_minutes','content','keyinfo','comments')
+
+#The export query for tickets created from start up to (not including) end, in one queue or all of them. Either end of the range can be left open.
+#The unary + keeps SQLite from reading a queue's tickets through tickets_queue_status, which would mean sorting them all before the first is returned.
+#Returns the SQL and its parameters.
+def _export_query(start,end,queue):
+	conditions,params = ['1'],[]
+	for condition,value in (('tickets.created >= ?',start),('tickets.created < ?',end),('+tickets.queue = ?',queue)):
+		if(value is not None):
+			conditions.append(condition)
+			params.append(value)
+	arms = [EXPORT_TICKETS.format(store=store,conditions=' AND '.join(conditions)) for store in ('main','archive')]
+	return ' UNION ALL '.join(arms) + ' ORDER BY 6, 1',params*2
+
+#Minutes between two times, or None if the second hasn't happened
+def _minutes_between(start,end):
+	if(start is None or end is None):
+		return None
+	return round((end - start).total_seconds()/60,1)
+
+#Every ticket created between start and end (datetimes, None leaves that end open), optionally in one queue, oldest first, hot and archived alike.
+#Yields a dictionary per ticket with its timings and determination, its key info and its comments. The tickets are read a batch at a time from one
+#cursor on a connection of the export's own, so a long export doesn't hold a pooled connection, and it sees the database as it was when it started.
+def export_tickets(start=None,end=None,queue=None,batch=EXPORT_BATCH_SIZE):
+	db = _open_connection()
+	try:
+		cur = db.cursor()
+		lookup = db.cursor()
+		cur.execute(*_export_query(start,end,queue))
+		while True:
+			rows = cur.fetchmany(batch)
+			if not(rows):
+				return
+			ids = json.dumps([row[0] for row in rows])
+			keyinfo,comments = {},{}
+			for ticket,infotype,info in lookup.execute(EXPORT_KEYINFO,(ids,)).fetchall():
+				keyinfo.setdefault(ticket,[]).append({'infotype':infotype,'info':info})
+			for ticket,posted,commenter,stage,comment in lookup.execute(EXPORT_COMMENTS,(ids,)).fetchall():
+				stage = FRAMEWORK_STEPS[stage - 1] if 0 < stage <= len(FRAMEWORK_STEPS) else None
+				comments.setdefault(ticket,[]).append({'datetime':posted,'commenter':commenter,'stage':stage,'comment':comment})
+			for id,name,status,queuename,owner,created,started,completed,determination,content in rows:
+				yield {
+					'id':id,
+					'name':name,
+					'status':status,
+					'queue':queuename,
+					'owner':owner,
+					'created':created,
+					'started':started,
+					'completed':completed,
+					'determination':determination,
+					'response_minutes':_minutes_between(created,started),
+					'resolution_minutes':_minutes_between(created,completed),
+					'content':content,
+					'keyinfo':keyinfo.get(id,[]),
+					'comments':comments.get(id,[]),
+				}
+	finally:
+		db.close()
+
+#Join the strings from lines into chunks of about EXPORT_CHUNK_SIZE characters
+def _export_chunks(lines):
+	chunk,size = [],0
+	for line in lines:
+		chunk.append(line)
+		size += len(line)
+		if(size >= EXPORT_CHUNK_SIZE):
+			yield ''.join(chunk)
+			chunk,size = [],0
+	if(chunk):
+		yield ''.join(chunk)
+
+#Exported tickets as CSV text, a header and then a row per ticket, in chunks
+def export_csv(tickets):
+	def rows():
+		buffer = io.StringIO()
+		writer = csv.writer(buffer)
+		writer.writerow(EXPORT_CSV_COLUMNS)
+		for ticket in tickets:
+			row = dict(ticket)
+			row['keyinfo'] = '\n'.join(f"{entry['infotype']}: {entry['info']}" for entry in ticket['keyinfo'])
+			row['comments'] = '\n'.join(f"{entry['datetime']} {entry['commenter']} ({entry['stage']}): {entry['comment']}" for entry in ticket['comments'])
+			writer.writerow([row[column] for column in EXPORT_CSV_COLUMNS])
+			#the header goes out with the first ticket, or on its own if there are none
+			yield buffer.getvalue()
+			buffer.seek(0)
+			buffer.truncate()
+		if(buffer.tell()):
+			yield buffer.getvalue()
+	return _export_chunks(rows())
+
+#Exported tickets as JSON Lines, one object per ticket with times in ISO format, in chunks
+def export_jsonl(tickets):
+	return _export_chunks(json.dumps(ticket,default=lambda value: value.isoformat() if isinstance(value,datetime) else str(value)) + '\n' for ticket in tickets)
+
+#Each export format and the function that writes it
+EXPORT_FORMATS = {
+	'csv':export_csv,
+	'jsonl':export_jsonl,
+}
@@ -1,7 +1,13 @@
 import imaplib
 import email
 import database_methods
-import re
+import ioc_extractor
+import argparse
+import logging
+import queue
+import random
+import select
+import threading
 
 #Credentials - INSERT YOUR OWN HERE!!!
 email_address = ''
@@ -9,49 +15,49 @@ password = ''
 #The email address to check for to generate tickets from
 target_email = ''
 
+#IMAP server to connect to, with SSL unless told otherwise (the fake server used for offline testing doesn't use it)
+imap_host = 'imap.gmail.com'
+imap_port = 993
+use_ssl = True
+mailbox = 'inbox'
+
+#How many messages are fetched in one request, how many tickets can be waiting to be created before fetching pauses and how many threads create them.
+FETCH_BATCH_SIZE = 50
+#The most emails a worker turns into tickets in one database transaction
+INSERT_BATCH_SIZE = 200
+#Identical alerts (same queue, title and body) arriving within this many minutes of an unresolved ticket are added to its occurrence count instead of making a new ticket, 0 turns this off.
+DEDUP_WINDOW = 10
+QUEUE_SIZE = 500
+WORKERS = 2
+#How long (seconds) to wait in IDLE before checking in with the server, and how often to poll when the server doesn't support IDLE.
+IDLE_TIMEOUT = 300
+POLL_INTERVAL = 30
+#Reconnection waits start small and double on each failure, up to the maximum.
+BACKOFF_START = 1
+BACKOFF_MAX = 300
+
+logger = logging.getLogger('email_ingester')
+
+#Returns the values of the indicators of a given type found in a string, or an empty list if there are none.
+def IndicatorsOfType(testcase,kind):
+    return [value for value,found in ioc_extractor.extract(testcase) if found == kind]
+
 #Takes a string, checks if for VALID email addresses, then returns a list of them should it find any. Otherwise it returns an empty list
 def EmailRegex(testcase):
-    return re.findall(r'[A-z0-9!#$%&\'*+/=?^_`{|}~-]+(?:\.[a-z0-9!#$%&\'*+/=?^_`{|}~-]+)*@(?:[a-z0-9](?:[a-z0-9-]*[a-z0-9])?\.)+[a-z0-9](?:[a-z0-9-]*[a-z0-9])?',testcase)
+    return IndicatorsOfType(testcase,"email")
 
+#Takes a string, checks if for valid IP addresses (each octet 0-255), then returns a list of them should it find any. Otherwise it returns an empty list
 def IPRegex(testcase):
-    #Takes a string, checks if for IP addresses, then returns a list of them should it find any. Otherwise it returns an empty list
-    results = re.findall(r'[0-9]{1,3}\.[0-9]{1,3}\.[0-9]{1,3}\.[0-9]{1,3}',testcase)
-    for index,result in enumerate(results):
-        #Split each of the results of the regex at the . to get the seperate octets of the IP addresses
-        octets = result.split('.')
-        #Perform a check to see if each octet is valid, if it isn't remove the result from the results list
-        for value in octets:
-            if(int(value) > 255):
-                results.pop(index)
-                break
-    
-    #return all valid IP addresses 
-    if(results):
-        return results
-    else:
-        return []
+    return IndicatorsOfType(testcase,"ipv4")
 
 #Takes a string, checks if for VALID mac addresses, then returns a list of them should it find any. Otherwise it returns an empty list
 def MACRegex(testcase):
-    return re.findall(r'((?:[\da-fA-F]{2}[:\-]){5}[\da-fA-F]{2})',testcase)
+    return IndicatorsOfType(testcase,"mac")
 
+#Finds every piece of key information (IPs, CIDR ranges, emails, MACs, URLs, domains, hashes, CVE ids) in the title and body with one scan over the text.
+#Returns them in the order they first appear without duplicates, or False if none are found.
 def CheckForKeyinfo(title,body):
-    #Create an empty list, ready to hold any key information values
-    results = []
-        #Each of the pieces of information in the email should be comma seperated. This helps to break down the information line by line but the code would work either way
-    lines = body.split(",")
-    #adds the title to the lines list, so that it can be checked for key information. Inserted in position 0 (start).
-    lines.insert(0,title)
-    for line in lines:
-        #This line runs each of the regexes created above, unpacks (*) any results and generates a list of all of the results.
-        matches = *EmailRegex(line),*IPRegex(line),*MACRegex(line)
-
-        #Checks if any matches were found at all, if none then return False
-        if(matches):
-            for match in matches:
-                #Checks that match is not blank, regexes that find nothing return blank lists. Also checks for duplicates and stops them being added again.
-                if(match and match not in results):
-                    results.append(match)
+    results = ioc_extractor.extract_values(title + "\n" + body)
     if not(results):
         return False
     
@@ -59,65 +65,262 @@ def CheckForKeyinfo(title,body):
 
 #Takes a integer, checks if a ticket queue exists
 def check_queue_exists(queueid):
-    db,cur = database_methods.db_connection()
     #if a queue is found with the id, return true else false
-    if(cur.execute(f'SELECT 1 FROM queue WHERE id = {queueid}').fetchone()):
-        return True
-    
-    return False
-
-def MailRead(Mail):
-    #For each email in the list that has been passed in
-    for id in Mail[0].split():
-        #Fetch mail, using RFC822 format for emails
-        result,data = mail.fetch(id,"(RFC822)")
-        #fetch the email body from the data returned by the fetch, ignoring uneccessary metadata
-        message = email.message_from_bytes(data[0][1])
-        
-        #Get the email Subject
-        title = message.get("Subject")
-
-        #Fetch the body/message of the email and decode it into UTF-8
-        body = message.get_payload(decode=True).decode('utf-8')
-
-        #Generate the ticket, get the new tickets id as a return value
-        ticket_id = GenerateTicket(title,body)
-
-        #Search for key information, add any key information found to the database
-        database_methods.auto_key_info(ticket_id,CheckForKeyinfo(title,body))
+    return database_methods.queue_exists(queueid)
 
+#Pull the text out of an email, using the first plain text part of multipart emails.
+def MessageBody(message):
+    if(message.is_multipart()):
+        for part in message.walk():
+            if(part.get_content_type() == "text/plain" and not part.is_multipart()):
+                message = part
+                break
+        else:
+            return ""
+    payload = message.get_payload(decode=True) or b""
+    return payload.decode(message.get_content_charset() or 'utf-8',errors='replace')
 
-def GenerateTicket(title,body):
+#Splits an email subject into the queue id (the number before the first hyphen) and the true title of the ticket.
+def ParseTitle(title):
     queue = 1
     #Take the number from before the first hyphen, this is used to indicate the queue id, remove wany whitespace
     if("-" in title):
         queue = title.split("-")[0].strip()
         #Generate the true title, removing the queue ID as that has no value once the ticket is made
         title = "".join(title.split("-")[1:]).strip()
-    
-    #if a queue is specified but doesn't exist, set to default as 1, as one always exists
-    if not(check_queue_exists(queue)):
-        queue = 1
-    
+    return title,queue
+
+#Turn a raw RFC822 email into the (title, queue, body, key info) needed to create its ticket.
+def ParseMessage(raw):
+    #fetch the email body from the data returned by the fetch, ignoring uneccessary metadata
+    message = email.message_from_bytes(raw)
+    #Get the email Subject
+    subject = message.get("Subject") or ""
+    #Fetch the body/message of the email and decode it
+    body = MessageBody(message)
+    title,queue = ParseTitle(subject)
+    #Search for key information, it is added to the database with the ticket
+    return title,queue,body,CheckForKeyinfo(subject,body)
+
+#Create a ticket (and its key info) from a raw RFC822 email.
+def ProcessMessage(raw):
+    return ProcessMessages([raw])[0][0]
+
+#Create tickets (and their key info) from many raw emails in one transaction. Duplicate alerts are folded into one ticket.
+#Returns the ticket id for each email and how many were folded into a ticket rather than creating one.
+def ProcessMessages(raws,dedup_window=DEDUP_WINDOW):
+    return database_methods.ingest_tickets([ParseMessage(raw) for raw in raws],dedup_window)
+
+def GenerateTicket(title,body):
+    title,queue = ParseTitle(title)
     #Generate a ticket based on the information of the email, with the name of ticket being the title of email, the content of the ticket being the email body, the status as new and the owner as Nobody, a predefined user in the database.
-    database_methods.generate_email_ticket(title,queue,body,1,"New")
-    #return the id of the ticket so it can be used to find any key info contained inside of it.
-    return database_methods.find_email_ticket(title,body)
+    #if a queue is specified but doesn't exist it is set to the default of 1, as one always exists. The id of the new ticket is returned.
+    return database_methods.ingest_tickets([(title,queue,body,False)])[0][0]
+
+#Split a list of message UIDs into comma separated sets of at most size UIDs, so each set can be fetched in one request.
+def UIDBatches(uids,size):
+    for start in range(0,len(uids),size):
+        yield b",".join(uids[start:start+size])
+
+#Long running ingestion service. Keeps one logged in IMAP connection, waits for new mail with IDLE (or polls if IDLE isn't supported),
+#fetches new mail in batches and hands it to a pool of worker threads which create the tickets.
+class MailIngester:
+    def __init__(self,host=None,port=None,ssl=None,user=None,pwd=None,sender=None,workers=WORKERS,queue_size=QUEUE_SIZE,batch_size=FETCH_BATCH_SIZE,dedup_window=DEDUP_WINDOW):
+        self.host = host or imap_host
+        self.port = port or imap_port
+        self.ssl = use_ssl if ssl is None else ssl
+        self.user = user if user is not None else email_address
+        self.pwd = pwd if pwd is not None else password
+        self.sender = sender if sender is not None else target_email
+        self.batch_size = batch_size
+        self.dedup_window = dedup_window
+        self.worker_count = workers
+        self.mail = None
+        self.stopping = threading.Event()
+        #Bounded so that fetching blocks (backpressure) when the workers fall behind
+        self.jobs = queue.Queue(maxsize=queue_size)
+        self.workers = []
+        #counters for monitoring the service
+        #deduplicated counts alerts folded into an existing ticket, they aren't counted as created
+        self.stats = {'fetched':0,'created':0,'deduplicated':0,'failed':0,'reconnects':0}
+        self.stats_lock = threading.Lock()
+
+    def _count(self,name,amount=1):
+        with self.stats_lock:
+            self.stats[name] += amount
+
+    #Connect and log in to the IMAP server, selecting the mailbox to watch.
+    def connect(self):
+        if(self.ssl):
+            self.mail = imaplib.IMAP4_SSL(self.host,self.port)
+        else:
+            self.mail = imaplib.IMAP4(self.host,self.port)
+        self.mail.login(self.user,self.pwd)
+        self.mail.select(mailbox)
+
+    def disconnect(self):
+        if(self.mail is None):
+            return
+        try:
+            self.mail.logout()
+        except (imaplib.IMAP4.error,OSError):
+            pass
+        self.mail = None
+
+    #Search for unread mail from the target address and queue it in batches for the workers. Fetching the full RFC822 message marks it as read, so it won't be fetched again.
+    def fetch_new(self):
+        result,data = self.mail.uid('SEARCH',None,f'(FROM "{self.sender}" UNSEEN)')
+        uids = data[0].split() if data and data[0] else []
+        for batch in UIDBatches(uids,self.batch_size):
+            result,data = self.mail.uid('FETCH',batch,'(RFC822)')
+            for item in data:
+                #Message data comes back as (envelope, raw message) tuples, with the closing bracket as a separate item
+                if(isinstance(item,tuple)):
+                    self._count('fetched')
+                    #blocks while the queue is full, so fetching never gets too far ahead of ticket creation
+                    self.jobs.put(item[1])
+        return len(uids)
+
+    #Wait for the server to announce new mail with IDLE, returns True if new mail has arrived. Gives up after timeout seconds or when stopping.
+    def idle(self,timeout):
+        #imaplib (before python 3.14) has no IDLE support, so the command is sent by hand
+        tag = self.mail._new_tag()
+        self.mail.send(tag + b' IDLE\r\n')
+        if not(self.mail.readline().startswith(b'+')):
+            raise imaplib.IMAP4.error('Server refused IDLE')
+
+        new_mail = False
+        waited = 0
+        #check in once a second so that stopping the service doesn't have to wait for the whole timeout
+        while(waited < timeout and not new_mail and not self.stopping.is_set()):
+            if(select.select([self.mail.sock],[],[],1)[0]):
+                new_mail = b'EXISTS' in self.mail.readline()
+            waited += 1
+
+        #End IDLE and read up to the server's reply to it
+        self.mail.send(b'DONE\r\n')
+        while True:
+            line = self.mail.readline()
+            if(not line):
+                raise imaplib.IMAP4.abort('Connection closed during IDLE')
+            if(line.startswith(tag)):
+                break
+            if(b'EXISTS' in line):
+                new_mail = True
+        return new_mail
+
+    #Wait until there might be new mail, using IDLE where the server supports it and polling where it doesn't.
+    def wait_for_mail(self):
+        if('IDLE' in self.mail.capabilities):
+            self.idle(IDLE_TIMEOUT)
+        else:
+            self.stopping.wait(POLL_INTERVAL)
+
+    #Worker thread, creates tickets from queued emails until it is given None.
+    #Whatever is waiting in the queue (up to INSERT_BATCH_SIZE emails) is written in one transaction, so bursts of alerts are inserted in bulk.
+    def work(self):
+        running = True
+        while running:
+            batch = [self.jobs.get()]
+            while(len(batch) < INSERT_BATCH_SIZE and batch[-1] is not None):
+                try:
+                    batch.append(self.jobs.get_nowait())
+                except queue.Empty:
+                    break
+            if(batch[-1] is None):
+                running = False
+                batch.pop()
+            try:
+                if(batch):
+                    self.create_tickets(batch)
+            finally:
+                #give the database connection back between batches
+                database_methods.release_connection()
+                for item in range(len(batch) + (0 if running else 1)):
+                    self.jobs.task_done()
+
+    #Create tickets for a batch of emails, if the batch fails each email is tried on its own so one bad email doesn't lose the rest.
+    def create_tickets(self,batch):
+        try:
+            ids,folded = ProcessMessages(batch,self.dedup_window)
+            self._count('created',len(ids) - folded)
+            self._count('deduplicated',folded)
+            return
+        except Exception:
+            if(len(batch) == 1):
+                self._count('failed')
+                logger.exception('Failed to create a ticket from an email')
+                return
+        for raw in batch:
+            self.create_tickets([raw])
 
+    def start_workers(self):
+        for number in range(self.worker_count):
+            worker = threading.Thread(target=self.work,name=f'ingest-worker-{number}',daemon=True)
+            worker.start()
+            self.workers.append(worker)
 
+    def stop_workers(self):
+        for worker in self.workers:
+            self.jobs.put(None)
+        for worker in self.workers:
+            worker.join()
+        self.workers = []
 
-#Connects to gmail's IMAP server with SSL Encryption
-mail = imaplib.IMAP4_SSL('imap.gmail.com')
-#Login to account using supplied credentials
-mail.login(email_address,password)
+    #Fetch whatever unread mail is waiting, create the tickets and stop. Like the original cron job.
+    def run_once(self):
+        self.start_workers()
+        try:
+            self.connect()
+            self.fetch_new()
+        finally:
+            self.stop_workers()
+            self.disconnect()
 
-#Select mail only from the Inbox
-mail.select('inbox')
+    #Run until stop() is called, reconnecting with backoff whenever the connection fails.
+    def run(self):
+        self.start_workers()
+        backoff = BACKOFF_START
+        try:
+            while not(self.stopping.is_set()):
+                try:
+                    self.connect()
+                    backoff = BACKOFF_START
+                    while not(self.stopping.is_set()):
+                        self.fetch_new()
+                        self.wait_for_mail()
+                except (imaplib.IMAP4.error,OSError) as error:
+                    self.disconnect()
+                    if(self.stopping.is_set()):
+                        break
+                    self._count('reconnects')
+                    #wait a random amount up to the backoff, so many clients don't all retry at once
+                    wait = random.uniform(backoff/2,backoff)
+                    logger.warning('IMAP connection failed (%s), reconnecting in %.1f seconds',error,wait)
+                    self.stopping.wait(wait)
+                    backoff = min(backoff*2,BACKOFF_MAX)
+        finally:
+            self.disconnect()
+            self.stop_workers()
 
-#Search for mail from the target email address, that hasn't been seen yet.
-result,data=mail.search(None,f'(FROM "{target_email}" UNSEEN)')
+    def stop(self):
+        self.stopping.set()
 
-#Try to read emails from the target email address, if it fails generate a log file (if it doesn't exist) and write the error to it.
-    #Process all emails that were found that were unread
-MailRead(data)
+#if the script is run as it self and not as a dependancy
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description='Create tickets from alert emails')
+    parser.add_argument('--once',action='store_true',help='Process unread mail once and exit, instead of running as a service')
+    args = parser.parse_args()
 
+    ingester = MailIngester()
+    try:
+        if(args.once):
+            ingester.run_once()
+        else:
+            ingester.run()
+    except KeyboardInterrupt:
+        ingester.stop()
+    finally:
+        #Close the database connections now that every email has been processed.
+        database_methods.close_pool()
@@ -0,0 +1,185 @@
+import socketserver
+import threading
+import select
+import re
+from email.message import EmailMessage
+
+#A small in-memory IMAP server, enough of IMAP4rev1 for email_ingester.py to run against it without a real mail account.
+#Supports LOGIN, SELECT, UID SEARCH (FROM and UNSEEN), UID FETCH (RFC822), IDLE, NOOP and LOGOUT.
+#
+#    server = FakeIMAPServer()
+#    server.start()
+#    server.add_message("1 - Multiple SSH Failures at 10.0.0.1","Host:10.0.0.1,Account:root","alerts@example.com")
+#    ingester = email_ingester.MailIngester(host="127.0.0.1",port=server.port,ssl=False,user="any",pwd="any",sender="alerts@example.com")
+
+#Matches FROM "address" inside a search query
+FROM_SEARCH = re.compile(r'FROM\s+"?([^"\s)]+)"?',re.IGNORECASE)
+
+class FakeIMAPHandler(socketserver.StreamRequestHandler):
+    def send(self,line):
+        if(isinstance(line,str)):
+            line = line.encode()
+        self.wfile.write(line + b"\r\n")
+
+    def handle(self):
+        self.server.connections.append(self.connection)
+        self.send("* OK Fake IMAP server ready")
+        try:
+            while True:
+                line = self.rfile.readline()
+                if(not line):
+                    return
+                parts = line.decode().strip().split(" ",2)
+                if(len(parts) < 2):
+                    continue
+                tag,command = parts[0],parts[1].upper()
+                args = parts[2] if len(parts) > 2 else ""
+                if(command == "UID"):
+                    command,_,args = args.partition(" ")
+                    command = "UID " + command.upper()
+                if(not self.dispatch(tag,command,args)):
+                    return
+        except (ConnectionError,OSError,ValueError):
+            return
+        finally:
+            if(self.connection in self.server.connections):
+                self.server.connections.remove(self.connection)
+
+    #Run one command, returns False when the connection should be closed.
+    def dispatch(self,tag,command,args):
+        store = self.server.store
+        if(command == "CAPABILITY"):
+            self.send("* CAPABILITY " + " ".join(self.server.capabilities))
+        elif(command == "LOGIN"):
+            pass
+        elif(command in ("SELECT","EXAMINE")):
+            self.send(f"* {store.count()} EXISTS")
+            self.send("* 0 RECENT")
+            self.send("* OK [UIDVALIDITY 1] UIDs valid")
+            self.send(f"* OK [UIDNEXT {store.next_uid}] Predicted next UID")
+            self.send(f"{tag} OK [READ-WRITE] {command} completed")
+            return True
+        elif(command == "NOOP"):
+            pass
+        elif(command == "LOGOUT"):
+            self.send("* BYE Logging out")
+            self.send(f"{tag} OK LOGOUT completed")
+            return False
+        elif(command == "UID SEARCH"):
+            sender = FROM_SEARCH.search(args)
+            uids = store.search(sender.group(1) if sender else None,"UNSEEN" in args.upper())
+            self.send("* SEARCH " + " ".join(str(uid) for uid in uids))
+        elif(command == "UID FETCH"):
+            uid_set = args.split(" ",1)[0]
+            for sequence,uid,raw in store.fetch(uid_set):
+                self.wfile.write(f"* {sequence} FETCH (UID {uid} RFC822 {{{len(raw)}}}\r\n".encode() + raw + b")\r\n")
+        elif(command == "IDLE"):
+            return self.idle(tag)
+        else:
+            self.send(f"{tag} BAD Unknown command")
+            return True
+        self.send(f"{tag} OK {command} completed")
+        return True
+
+    #Announce new messages until the client sends DONE.
+    def idle(self,tag):
+        self.send("+ idling")
+        seen = self.server.store.count()
+        while True:
+            if(select.select([self.connection],[],[],0.05)[0]):
+                line = self.rfile.readline()
+                if(not line):
+                    return False
+                if(line.strip().upper() == b"DONE"):
+                    self.send(f"{tag} OK IDLE terminated")
+                    return True
+            count = self.server.store.count()
+            if(count != seen):
+                seen = count
+                self.send(f"* {count} EXISTS")
+
+#The mailbox, shared by every connection.
+class MessageStore:
+    def __init__(self):
+        self.messages = []
+        self.next_uid = 1
+        self.lock = threading.Lock()
+
+    def add(self,raw,sender):
+        with self.lock:
+            self.messages.append({'uid':self.next_uid,'raw':raw,'from':sender,'seen':False})
+            self.next_uid += 1
+            return self.next_uid - 1
+
+    def count(self):
+        with self.lock:
+            return len(self.messages)
+
+    def search(self,sender,unseen):
+        with self.lock:
+            return [message['uid'] for message in self.messages if (not sender or sender in message['from']) and not (unseen and message['seen'])]
+
+    #Returns (sequence number, uid, raw message) for every message in a UID set such as "1,4,7:9" or "3:*", marking them as read.
+    def fetch(self,uid_set):
+        wanted = []
+        for part in uid_set.split(","):
+            start,_,end = part.partition(":")
+            start = self.next_uid if start == "*" else int(start)
+            end = start if not end else (self.next_uid if end == "*" else int(end))
+            wanted.append((min(start,end),max(start,end)))
+        results = []
+        with self.lock:
+            for sequence,message in enumerate(self.messages,start=1):
+                if(any(low <= message['uid'] <= high for low,high in wanted)):
+                    message['seen'] = True
+                    results.append((sequence,message['uid'],message['raw']))
+        return results
+
+class FakeIMAPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    #Port 0 picks any free port, idle controls whether the server offers IDLE (to test the polling fallback).
+    def __init__(self,host="127.0.0.1",port=0,idle=True):
+        super().__init__((host,port),FakeIMAPHandler)
+        self.store = MessageStore()
+        self.capabilities = ["IMAP4rev1"] + (["IDLE"] if idle else [])
+        self.connections = []
+        self.thread = None
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever,daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.drop_connections()
+        self.shutdown()
+        self.server_close()
+
+    #Add an email to the mailbox, returning its UID.
+    def add_message(self,subject,body,sender="alerts@example.com"):
+        message = EmailMessage()
+        message['From'] = sender
+        message['To'] = sender
+        message['Subject'] = subject
+        message.set_content(body)
+        return self.store.add(message.as_bytes(),sender)
+
+    #Cut off every connected client, used to test that clients reconnect.
+    def drop_connections(self):
+        for connection in list(self.connections):
+            try:
+                connection.shutdown(2)
+            except OSError:
+                pass
+
+#if the script is run as it self and not as a dependancy, serve on port 1143 until stopped
+if __name__ == "__main__":
+    server = FakeIMAPServer(port=1143)
+    print(f"Fake IMAP server listening on 127.0.0.1:{server.port}")
+    server.serve_forever()
@@ -0,0 +1,28 @@
+import multiprocessing
+import os
+import database_methods
+
+#Production settings for gunicorn, run from the repository root with "gunicorn" (this file is picked up automatically).
+#Set TICKETING_BIND, TICKETING_WORKERS or TICKETING_THREADS to override the defaults.
+
+#The app is built once in the master by the factory, which creates or upgrades the database before any worker is forked.
+wsgi_app = 'main:create_app()'
+preload_app = True
+
+bind = os.environ.get('TICKETING_BIND','0.0.0.0:8000')
+#One worker per core. Each worker has its own connection pool and writer thread, SQLite's locking keeps the workers' writes apart.
+workers = int(os.environ.get('TICKETING_WORKERS',multiprocessing.cpu_count()))
+#Threaded workers, so live queue pages (server sent events and long polls) don't each hold a whole process.
+#Each open queue page holds a thread for as long as its stream lasts (main.QUEUE_STREAM_DURATION, five minutes), but hands its database
+#connection back between checks. So threads are sized for the open queue pages plus ordinary requests, not for database_methods.POOL_SIZE:
+#at most POOL_SIZE threads use the database at once, the rest wait briefly for a connection.
+worker_class = 'gthread'
+threads = int(os.environ.get('TICKETING_THREADS',database_methods.POOL_SIZE*8))
+#How long a worker's main loop may go without checking in before it is restarted. Requests run on the worker's threads, so a stream or a
+#long poll (up to main.QUEUE_MAX_WAIT, half a minute) being open doesn't count against it.
+timeout = 60
+graceful_timeout = 30
+
+#Finish any queued writes before a worker exits.
+def worker_exit(server,worker):
+	database_methods.close_pool()
@@ -0,0 +1,83 @@
+import re
+import ipaddress
+
+#Finds indicators of compromise (key information) in alert text. Every indicator pattern is compiled into one regex
+#so the text is scanned once, rather than running a separate regex per indicator over every comma separated fragment.
+
+#Top level domains accepted for bare domain names, along with any two letter country code, so that file names like report.xlsm aren't mistaken for domains.
+COMMON_TLDS = {
+    "com","net","org","edu","gov","mil","int","info","biz","io","co","app","dev","xyz","top","online","site","club",
+    "live","tech","store","cloud","shop","onion","local","corp","lan","internal",
+}
+#Two letter endings that are far more likely to be file extensions than country codes.
+FILE_EXTENSIONS = {"py","js","sh","md","ps","db","gz","7z","rb","pl","cs","vb"}
+
+#Each indicator type and its pattern, in the order they are tried at each position. Longer or more specific indicators come first, so a URL isn't reported as a domain or a SHA256 as an MD5.
+PATTERNS = (
+    ("url",r"\b(?:https?|ftp)://[^\s,<>\"'()\[\]{}]+"),
+    ("email",r"(?<![a-z0-9!#$%&'*+/=?^_`{|}~.-])[a-z0-9!#$%&'*+/=?^_`{|}~-]+(?:\.[a-z0-9!#$%&'*+/=?^_`{|}~-]+)*@(?:[a-z0-9](?:[a-z0-9-]*[a-z0-9])?\.)+[a-z0-9](?:[a-z0-9-]*[a-z0-9])?"),
+    ("cve",r"\bCVE-\d{4}-\d{4,7}\b"),
+    ("mac",r"(?<![0-9a-z])(?:[0-9a-f]{2}[:-]){5}[0-9a-f]{2}(?![0-9a-f])"),
+    ("cidr",r"(?<![\d.])(?:(?:25[0-5]|2[0-4]\d|1\d\d|[1-9]?\d)\.){3}(?:25[0-5]|2[0-4]\d|1\d\d|[1-9]?\d)/(?:3[0-2]|[12]?\d)(?!\d)"),
+    ("ipv4",r"(?<![\d.])(?:(?:25[0-5]|2[0-4]\d|1\d\d|[1-9]?\d)\.){3}(?:25[0-5]|2[0-4]\d|1\d\d|[1-9]?\d)(?!\d|\.\d)"),
+    #IPv6 addresses (with optional prefix length), either all eight groups or shortened with ::. Checked properly once found.
+    ("ipv6",r"(?<![\w:.])(?:[0-9a-f]{1,4}(?::[0-9a-f]{1,4}){7}|(?:[0-9a-f]{1,4}(?::[0-9a-f]{1,4}){0,6})?::(?:[0-9a-f]{1,4}(?::[0-9a-f]{1,4}){0,6})?)(?:/\d{1,3})?(?![\w:])"),
+    ("sha256",r"\b[0-9a-f]{64}\b"),
+    ("sha1",r"\b[0-9a-f]{40}\b"),
+    ("md5",r"\b[0-9a-f]{32}\b"),
+    ("domain",r"\b(?:[a-z0-9](?:[a-z0-9-]{0,61}[a-z0-9])?\.)+[a-z]{2,63}\b"),
+)
+
+#Every indicator starts at the beginning of a word, and contains a . @ : / or - (or is a long run of hex for hashes).
+#Checking this once before trying the alternatives means most positions in the text are skipped after a single cheap test.
+#IPs are the exception to starting a word, one written straight after a letter (IP10.0.0.1) is still found, so a digit after a letter gets through too.
+GATE = r"(?:(?<![0-9a-z.])|(?<=[a-z])(?=\d))(?=[\w!#$%&'*+/=?^`{|}~-]*[.@:/-]|[0-9a-f]{32})"
+
+#All of the patterns joined into one alternation behind the gate, with each pattern in a named group so the type of a match is known.
+INDICATOR_REGEX = re.compile(GATE + "(?:" + "|".join(f"(?P<{name}>{pattern})" for name,pattern in PATTERNS) + ")",re.IGNORECASE)
+
+#Checks that need more than a regex, a match failing its check is dropped.
+def _valid_ipv6(value):
+    try:
+        ipaddress.ip_interface(value)
+    except ValueError:
+        return False
+    #a bare :: is valid but never a useful indicator
+    return value.split("/")[0] != "::"
+
+def _valid_domain(value):
+    tld = value.rsplit(".",1)[-1].lower()
+    return tld in COMMON_TLDS or (len(tld) == 2 and tld not in FILE_EXTENSIONS)
+
+VALIDATORS = {
+    "ipv6":_valid_ipv6,
+    "domain":_valid_domain,
+}
+
+#Scan text once, returning (value, indicator type) for every indicator found, in the order they first appear with duplicates removed.
+def extract(text):
+    found = {}
+    position = 0
+    search = INDICATOR_REGEX.search
+    while True:
+        match = search(text,position)
+        if(match is None):
+            break
+        kind = match.lastgroup
+        value = match.group()
+        if(kind == "url"):
+            #punctuation at the end of a URL is almost always the end of the sentence
+            value = value.rstrip(".,;:!?")
+        validator = VALIDATORS.get(kind)
+        if(validator and not validator(value)):
+            #a false match, carry on from the next character so anything it overlapped can still be found
+            position = match.start() + 1
+            continue
+        if(value not in found):
+            found[value] = kind
+        position = match.end()
+    return list(found.items())
+
+#Same as extract, but only returns the values.
+def extract_values(text):
+    return [value for value,kind in extract(text)]
@@ -0,0 +1,120 @@
+import argparse
+import logging
+import os
+import time
+import database_methods
+
+#Reads network event logs like incident.log into the events table, where they are matched to tickets by the IPs in their key info.
+#Each line is "timestamp,protocol,source IP,destination IP,action,result". Files are read a line at a time so memory use stays
+#the same however big the log is, and how far each file has been read is saved so ingestion carries on where it left off.
+
+logger = logging.getLogger('log_ingester')
+
+#How many events are written to the database in one transaction
+BATCH_SIZE = 5000
+#How long (seconds) to wait for more lines when following a file
+FOLLOW_INTERVAL = 1
+
+#Yields (line, position after the line, inode of the file) for each line of a file, starting from position.
+#When follow is set it keeps waiting for new lines (like tail -f) and starts again from the top if the file is rotated or truncated.
+#Each time it runs out of lines to follow it yields None in place of a line first, so the caller can save what it has before waiting.
+def tail(path,position=0,follow=False,stopping=None):
+    log = open(path,'rb')
+    inode = os.fstat(log.fileno()).st_ino
+    #a different file (rotated) or a shorter one (truncated) since last time, so start from the beginning
+    if(position > os.fstat(log.fileno()).st_size):
+        position = 0
+    log.seek(position)
+    try:
+        while True:
+            line = log.readline()
+            #a complete line, or the last line of a file that isn't being followed
+            if(line.endswith(b"\n") or (line and not follow)):
+                position += len(line)
+                yield line.decode('utf-8',errors='replace'),position,inode
+                continue
+            if(not follow or (stopping is not None and stopping.is_set())):
+                return
+            yield None,position,inode
+            #half written line, wait for the rest of it
+            log.seek(position)
+            time.sleep(FOLLOW_INTERVAL)
+            try:
+                current = os.stat(path)
+            except FileNotFoundError:
+                continue
+            if(current.st_ino != inode or current.st_size < position):
+                logger.info('%s was rotated, reading from the start',path)
+                log.close()
+                log = open(path,'rb')
+                inode = os.fstat(log.fileno()).st_ino
+                position = 0
+    finally:
+        log.close()
+
+#Turn a log line into (occurred, protocol, source, destination, action, result), or None if it isn't a valid event.
+#Some actions are followed by an empty field, so everything between the destination and the last field is the action.
+def parse_event(line):
+    fields = line.strip().split(",")
+    if(len(fields) < 6):
+        return None
+    occurred,protocol,source,destination = (field.strip() for field in fields[0:4])
+    action = ",".join(fields[4:-1]).strip(", ")
+    return occurred,protocol,source,destination,action,fields[-1].strip()
+
+#Read a log file into the database in batches, returning (events added, lines skipped). Carries on from where the last run stopped unless restart is set.
+#When following, a part filled batch is written as soon as the file goes quiet, rather than waiting for the batch to fill or the ingester to stop.
+def ingest_file(path,follow=False,restart=False,batch_size=BATCH_SIZE,stopping=None):
+    path = os.path.abspath(path)
+    position,inode = (0,None) if restart else database_methods.get_log_position(path)
+    #the file has been replaced since it was last read
+    if(inode is not None and inode != os.stat(path).st_ino):
+        position = 0
+    added,skipped = 0,0
+    batch = []
+    last_position,last_inode = position,inode
+    #how far has been saved to the database
+    saved = (position,inode)
+    try:
+        for line,last_position,last_inode in tail(path,position,follow,stopping):
+            if(line is None):
+                idle = batch or (last_position,last_inode) != saved
+            else:
+                idle = False
+                event = parse_event(line)
+                if(event is None):
+                    if(line.strip()):
+                        skipped += 1
+                else:
+                    batch.append(event)
+            if(idle or len(batch) >= batch_size):
+                database_methods.insert_events(batch,path,last_position,last_inode)
+                added += len(batch)
+                batch = []
+                saved = (last_position,last_inode)
+    finally:
+        #save whatever is left, including the position when there were no events at all
+        if(batch or (last_position,last_inode) != saved):
+            database_methods.insert_events(batch,path,last_position,last_inode)
+            added += len(batch)
+        database_methods.release_connection()
+    return added,skipped
+
+#if the script is run as it self and not as a dependancy
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description='Read network event logs into the ticketing database')
+    parser.add_argument('paths',nargs='+',help='Log files to read')
+    parser.add_argument('--follow',action='store_true',help='Keep waiting for new lines (only one file can be followed)')
+    parser.add_argument('--restart',action='store_true',help='Read the files from the start instead of where the last run stopped, events already read are added again')
+    args = parser.parse_args()
+
+    database_methods.table_init()
+    try:
+        for path in args.paths:
+            added,skipped = ingest_file(path,args.follow,args.restart)
+            print(f"{path}: {added} events added, {skipped} lines skipped")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        database_methods.close_pool()
@@ -1,27 +1,131 @@
 from flask_wtf.csrf import CSRFProtect
-from flask import Flask, render_template,redirect,session,request
+from flask import Flask, Blueprint, render_template,redirect,session,request,Response,jsonify,stream_with_context,g,current_app
+import json
+import time
+import threading
+from markupsafe import Markup, escape
 from forms import *
 import datetime
 import database_methods
 from flask_bootstrap import Bootstrap
 
 
-#Initial the flask application, this what stores and recognises the API endpoints
-app = Flask(__name__)
-#Initialise Bootstrap used to help style forms.
-Bootstrap(app)
-#Session key used to sign session cookies, security feature to prevent cookie tampering.
-app.config['SECRET_KEY'] = 'CHANGEME'
-#Cross Site Request Forgery protection, declaration and initialisation. Helps prevents malicious attacks through form submission.
-csrf = CSRFProtect(app)
-csrf.init_app(app)
-
-#Generate the databases if they don't already exist, if they do it will do nothing.
-database_methods.table_init()
+#The API endpoints, registered on the application by create_app
+views = Blueprint('views',__name__)
+#Cross Site Request Forgery protection, declaration. Helps prevents malicious attacks through form submission.
+csrf = CSRFProtect()
+
+#Build the flask application, this what stores and recognises the API endpoints. config overrides the default settings.
+#The database is created or upgraded first unless bootstrap is False, run this before a pre-forking server forks its workers (see gunicorn.conf.py)
+#and it only happens once. Each worker sets up its own database connections, writer thread and caches the first time it needs them.
+def create_app(config=None,bootstrap=True):
+	app = Flask(__name__)
+	#Session key used to sign session cookies, security feature to prevent cookie tampering.
+	app.config['SECRET_KEY'] = 'CHANGEME'
+	if(config):
+		app.config.update(config)
+	#Initialise Bootstrap used to help style forms.
+	Bootstrap(app)
+	csrf.init_app(app)
+	app.register_blueprint(views)
+	app.before_request(start_request_stats)
+	app.after_request(report_request_stats)
+	app.teardown_appcontext(release_db_connection)
+	#Generate the databases if they don't already exist, if they do it will do nothing.
+	if(bootstrap):
+		database_methods.bootstrap()
+	return app
+
+#Once a request (application context) has finished, hand its database connection back to the pool so it can be reused.
+def release_db_connection(exception):
+	database_methods.release_connection()
+
+#Totals for each route since the process started, for /metrics: requests, seconds handling them, SQL statements run and seconds spent in the database.
+route_stats = {}
+_route_stats_lock = threading.Lock()
+
+#Start counting the database work done by this request.
+def start_request_stats():
+	database_methods.reset_request_stats()
+	g.request_started = time.perf_counter()
+
+#Report the database work done by the request in its headers and add it to the route's totals.
+#In debug mode the slowest statements and where they were run from are included too, like a debug toolbar.
+def report_request_stats(response):
+	stats = database_methods.request_stats()
+	response.headers['X-DB-Queries'] = str(stats['queries'])
+	response.headers['X-DB-Time'] = f"{stats['time'] * 1000:.2f}"
+	response.headers['X-DB-Connections'] = str(stats['connections'])
+	if(current_app.debug):
+		slowest = sorted(stats['slowest'],key=lambda statement: statement['time'],reverse=True)
+		response.headers['X-DB-Slowest'] = " | ".join(f"{statement['time'] * 1000:.2f}ms {statement['caller']}: {database_methods.normalise_sql(statement['sql'])}" for statement in slowest)
+	route = request.url_rule.rule if request.url_rule else 'unmatched'
+	with _route_stats_lock:
+		totals = route_stats.setdefault(route,{'requests':0,'time':0.0,'queries':0,'db_time':0.0})
+		totals['requests'] += 1
+		totals['time'] += time.perf_counter() - g.get('request_started',time.perf_counter())
+		totals['queries'] += stats['queries']
+		totals['db_time'] += stats['time']
+	return response
+
+#Escape a label value for the Prometheus text format
+def prometheus_label(value):
+	return str(value).replace('\\','\\\\').replace('"','\\"').replace('\n','\\n')
+
+#One metric in the Prometheus text format, samples are (labels, value) pairs.
+def prometheus_metric(name,kind,description,samples):
+	lines = [f"# HELP {name} {description}",f"# TYPE {name} {kind}"]
+	for labels,value in samples:
+		label_text = ",".join(f'{label}="{prometheus_label(text)}"' for label,text in labels.items())
+		lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+	return "\n".join(lines)
+
+#API endpoint for Prometheus to scrape, with database, connection pool and per route request totals. Only totals are shown, no SQL or ticket data, so no login is needed.
+@views.route('/metrics')
+def metrics():
+	queries = dict(database_methods.query_stats)
+	pool = database_methods.get_pool_stats()
+	writer = database_methods.get_writer_stats()
+	with _route_stats_lock:
+		routes = {route:dict(totals) for route,totals in route_stats.items()}
+	text = [
+		prometheus_metric('ticketing_db_queries_total','counter','SQL statements run',[({},queries['queries'])]),
+		prometheus_metric('ticketing_db_query_seconds_total','counter','Time spent running SQL statements and fetching their rows',[({},round(queries['time'],6))]),
+		prometheus_metric('ticketing_db_slow_queries_total','counter',f'SQL statements slower than {database_methods.SLOW_QUERY_THRESHOLD} seconds',[({},queries['slow'])]),
+		prometheus_metric('ticketing_db_connections_opened_total','counter','Database connections opened',[({},queries['connections'])]),
+		prometheus_metric('ticketing_db_pool_size','gauge','Most connections the pool will open',[({},database_methods.POOL_SIZE)]),
+		prometheus_metric('ticketing_db_pool_hits_total','counter','Connections reused from the pool',[({},pool['hits'])]),
+		prometheus_metric('ticketing_db_pool_misses_total','counter','Connections opened because the pool had none free',[({},pool['misses'])]),
+		prometheus_metric('ticketing_db_pool_waits_total','counter','Times a request waited for a connection to be released',[({},pool['waits'])]),
+		prometheus_metric('ticketing_db_pool_wait_seconds_total','counter','Time spent waiting for a connection to be released',[({},round(pool['wait_time'],6))]),
+		prometheus_metric('ticketing_db_pool_open','gauge','Connections the pool has open',[({},pool['open'])]),
+		prometheus_metric('ticketing_db_pool_idle','gauge','Open connections not in use',[({},pool['idle'])]),
+		prometheus_metric('ticketing_db_writes_total','counter','Writes run by the writer thread',[({},writer['writes'])]),
+		prometheus_metric('ticketing_db_write_failures_total','counter','Writes that raised an error and were rolled back',[({},writer['failures'])]),
+		prometheus_metric('ticketing_db_write_commits_total','counter','Transactions committed by the writer thread, each holding a group of writes',[({},writer['commits'])]),
+		prometheus_metric('ticketing_db_writes_queued','gauge','Writes waiting for the writer thread',[({},writer['queued'])]),
+		prometheus_metric('ticketing_http_requests_total','counter','Requests handled',[({'route':route},totals['requests']) for route,totals in routes.items()]),
+		prometheus_metric('ticketing_http_request_seconds_total','counter','Time spent handling requests, not counting streamed responses',[({'route':route},round(totals['time'],6)) for route,totals in routes.items()]),
+		prometheus_metric('ticketing_http_request_db_queries_total','counter','SQL statements run by requests',[({'route':route},totals['queries']) for route,totals in routes.items()]),
+		prometheus_metric('ticketing_http_request_db_seconds_total','counter','Time requests spent in the database',[({'route':route},round(totals['db_time'],6)) for route,totals in routes.items()]),
+	]
+	return Response("\n".join(text) + "\n",mimetype='text/plain; version=0.0.4')
+
+#The logged in user's id, kept in the session from login so routes don't have to look it up. Sessions from before it was kept are filled in on first use.
+def current_user_id():
+	if(session.get('user_id') is None):
+		session['user_id'] = database_methods.user_id_from_name(session['username'])
+	return session['user_id']
+
+#The logged in user's selected queue, kept in the session alongside their id.
+def current_user_queue():
+	if(session.get('queue_id') is None):
+		session['queue_id'] = database_methods.get_user_queue(session['username'])
+	return session['queue_id']
 
 #Uses a check for a username set in the session variables, this indicates a successful login.
 #Renders the homepage of the site
-@app.route('/')
+@views.route('/')
 def home():
 	if('username' in session):
 		#fetch the busiest queues (max 3) to show on the home page stats
@@ -35,14 +139,12 @@ def home():
 		return redirect('/Login')
 
 #Endpoint for use creation.
-@app.route('/Create',methods=['POST','GET'])
+@views.route('/Create',methods=['POST','GET'])
 def create_user():
-	#initialise a database connection
-	db,cur = database_methods.db_connection()
 	#Create a the form in memory, ready to be passed into the template.
 	form = CreateUser()
 	#dynamically generates a selection of all queues available to select as primary queue
-	form.queue.choices = [(queue[0], queue[1]) for queue in cur.execute('SELECT id, name FROM queue').fetchall()]
+	form.queue.choices = database_methods.queue_choices()
 	#initialise message, used to pass information to show the user, should the form fail.
 	message=""
 	#if form validates (passes any validators, see forms.py to see validators)
@@ -57,7 +159,7 @@ def create_user():
 	return render_template('Create.html',form=form, message=message)
 
 #Creates the login endpoint
-@app.route('/Login',methods=['POST','GET'])
+@views.route('/Login',methods=['POST','GET'])
 def login():
 	if not ('username' in session):
 		#Initialise the login form
@@ -66,7 +168,8 @@ def login():
 		if form.validate_on_submit():
 			#check for a valid password match for the username provided
 			if(database_methods.check_login(form.uname.data,form.pword.data)):
-				#If password check is successful, add username to session and set logged in session variable
+				#If password check is successful, add username (shown as the user's name), their id and queue to session and set logged in session variable
+				session['user_id'],session['queue_id'] = database_methods.user_details(form.uname.data)
 				session['username'] = form.uname.data
 				session['loggedin'] = True
 				return redirect('/')
@@ -80,12 +183,14 @@ def login():
 		return redirect('/Profile')
 
 #Api Endpoint for logging the user out
-@app.route('/Logout')
+@views.route('/Logout')
 def logout():
 	#if user has previously successfully logged in
 	if ('username' in session):
-		#remove username from session
+		#remove username, id and queue from session
 		del session['username'] 
+		session.pop('user_id',None)
+		session.pop('queue_id',None)
 		#unset the loggedin variable
 		session['loggedin'] = False
 	
@@ -93,16 +198,15 @@ def logout():
 	return redirect('/')
 
 #API endpoint for creating a new ticket.
-@app.route('/NewTicket',methods=['POST','GET'])
+@views.route('/NewTicket',methods=['POST','GET'])
 def create_new_ticket():
 	if('username' in session):
-		db,cur = database_methods.db_connection()
-		#Get the user's id from the username stored in the session variable
-		user = database_methods.user_id_from_name(session['username'])
+		#Get the user's id, kept in the session since they logged in
+		user = current_user_id()
 		#initialise the New Ticket form
 		form = NewTicket()
 		#Dynamically generate the choices for a queue list, providing all options available
-		form.queue.choices = [(queue[0], queue[1]) for queue in cur.execute('SELECT id, name FROM queue').fetchall()]
+		form.queue.choices = database_methods.queue_choices()
 		if form.validate_on_submit():
 			#Generate a new ticket, since this is a manually created ticket, the creator is assinged as the owner, status starts as under investigation and started time is the minute its created.
 			database_methods.insert_ticket(form.name.data,form.queue.data,form.content.data,user,datetime.datetime.now())
@@ -115,7 +219,7 @@ def create_new_ticket():
 		return redirect('/')
 
 #API endpoint for creating a new queue
-@app.route('/NewQueue',methods=['POST','GET'])
+@views.route('/NewQueue',methods=['POST','GET'])
 def create_new_queue():
 	if('username' in session):
 		#Initialise the New Queue form
@@ -135,7 +239,7 @@ def create_new_queue():
 		return redirect('/')
 
 #API endpoint for creating a new comment
-@app.route('/NewComment/<ticketid>',methods=['POST','GET'])
+@views.route('/NewComment/<ticketid>',methods=['POST','GET'])
 def create_new_comment(ticketid):
 	if('username' in session):
 		#Initialise the New Comment form
@@ -144,7 +248,7 @@ def create_new_comment(ticketid):
 		form.frameworkstep.choices = [(framework_step[0], framework_step[1]) for framework_step in [(1,'Preparation'),(2,'Detection and Analysis'),(3,'Containment,Eradication and Recovery'),(4,'Post-Incident Activity')]]
 		if form.validate_on_submit():
 			#Add the comment to the database, using data from the form.
-			database_methods.insert_comment(form.comment.data,database_methods.user_id_from_name(session['username']),ticketid,datetime.datetime.now(),form.frameworkstep.data)
+			database_methods.insert_comment(form.comment.data,current_user_id(),ticketid,datetime.datetime.now(),form.frameworkstep.data)
 			#render the ticket which the comment has been left on, presenting the new comment.
 			return redirect(f'/ViewTicket/{ticketid}')
 		#render the template that the form will be shown on and pass the form in.
@@ -153,7 +257,7 @@ def create_new_comment(ticketid):
 		return redirect('/')
 
 #API endpoint for adding new key information
-@app.route('/NewKeyinfo/<ticketid>',methods=['POST','GET'])
+@views.route('/NewKeyinfo/<ticketid>',methods=['POST','GET'])
 def create_new_keyinfo(ticketid):
 	if('username' in session):
 		#Initialise the key information form
@@ -169,7 +273,7 @@ def create_new_keyinfo(ticketid):
 		return redirect('/')
 
 #API endpoint for adding relationships between tickets
-@app.route('/NewRelationship/<pid>',methods=['POST','GET'])
+@views.route('/NewRelationship/<pid>',methods=['POST','GET'])
 def create_new_relationship(pid):
 	if('username' in session):
 		message = ""
@@ -189,113 +293,202 @@ def create_new_relationship(pid):
 		return redirect('/')
 
 #API endpoint to show the list of all queues
-@app.route('/Queues')
+@views.route('/Queues')
 def show_queues():
 	if('username' in session):
-		db,cur = database_methods.db_connection()
 		#Find all queues and return them
-		queues = cur.execute('SELECT * FROM queue').fetchall()
+		queues = database_methods.queue_choices()
 		#Pass the found queues into the template, to show all queues in a list.
 		return render_template('Queues.html',queues=queues)
 	
 	return redirect('/')
 
 #API endpoint to show the user's profile
-@app.route('/Profile')
+@views.route('/Profile')
 def show_profile():
 	if('username' in session):
-		#get user's database id from their username
-		user_id = database_methods.user_id_from_name(session['username'])
-		db,cur = database_methods.db_connection()
-		#select user's open tickets to be displayed from oldest to newest (ASCENDING order)
-		tickets = cur.execute('SELECT tickets.name, queue.name, tickets.queue, tickets.id FROM tickets INNER JOIN queue ON tickets.queue = queue.id WHERE owner = ? AND tickets.status != "Resolved" ORDER BY created ASC',(user_id,)).fetchall()
-		#pass tickets and user id to the page and render user's account 
-		return render_template('Profile.html',id=user_id,tickets=tickets)
+		#get user's database id, kept in the session since they logged in
+		user_id = current_user_id()
+		#select the first page of the user's open tickets to be displayed from oldest to newest (ASCENDING order), the rest are loaded on demand
+		tickets,after = database_methods.user_tickets_page(user_id)
+		#pass tickets, how many there are in total and user id to the page and render user's account 
+		return render_template('Profile.html',id=user_id,tickets=tickets,total=database_methods.user_ticket_count(user_id),after=after)
 	else:
 		return redirect('/Login')
 
+#API endpoint returning the next page of the user's open tickets as JSON, after the ticket id given.
+@views.route('/ProfileTickets')
+def profile_tickets():
+	if('username' in session):
+		user_id = current_user_id()
+		tickets,after = database_methods.user_tickets_page(user_id,request.args.get('after',type=int))
+		return jsonify(tickets=[{'name':ticket[0],'queue':ticket[1],'id':ticket[3]} for ticket in tickets],after=after)
+	return redirect('/Login')
+
 #API endpoint to view a specified queue
-@app.route('/ViewQueue/<queueid>')
+@views.route('/ViewQueue/<queueid>')
 def view_queue(queueid):
 	if('username' in session):
-		db,cur = database_methods.db_connection()
+		#fetch the name of the queue using the id specified, None if there isn't a queue with that id
+		name = database_methods.queue_name(queueid)
 		#if a queue exists with the id specified
-		if(cur.execute('SELECT 1 FROM queue WHERE id = ?',queueid)):
-			#fetch the name of the queue using the id specified
-			name = cur.execute('SELECT name FROM queue WHERE id = ?',(queueid,)).fetchone()[0]
-			#fetch tickets from the queue and organise them by status
-			new,under_investigation,on_hold = database_methods.tickets_by_status(queueid)
-			#add the length of all lists to find the total amount of tickets
-			amount = (len(new) + len(under_investigation) + len(on_hold))
-			#Use the method for calculating averages to get the queue's average response time
-			avg_pick_up = str(database_methods.get_average_response(queueid)) + " Minutes"
-			#fetch the amount of tickets created in the last day
-			tix_last_day = database_methods.get_queue_created_lastday(queueid)
+		if(name is not None):
+			#the latest change to the queue, read before its tickets so the page can ask for anything that changes after this point
+			version = database_methods.queue_version(queueid)
+			#fetch the number of tickets with each status, and the first page of each status, the rest are loaded on demand
+			counts = database_methods.queue_status_counts(queueid)
+			sections = [(status,counts[status]) + database_methods.queue_tickets_page(queueid,status) for status in database_methods.OPEN_STATUSES]
+			#add the counts of all statuses to find the total amount of tickets
+			amount = sum(counts.values())
+			#Use the last day's metrics to get the queue's average response time and the amount of tickets created in the last day
+			report = database_methods.metrics_report('24h',queueid)
+			avg_pick_up = str(report['totals']['average_response']) + " Minutes"
+			tix_last_day = report['totals']['created']
 			#render template using data gathered to fill in the statistics.
-			return render_template('ViewQueue.html',name=name,amount=amount,new = new,ui = under_investigation,oh = on_hold, avg=avg_pick_up, ticksday=tix_last_day)
+			return render_template('ViewQueue.html',name=name,amount=amount,sections=sections, avg=avg_pick_up, ticksday=tix_last_day, queueid=queueid, version=version)
+	return redirect("/")
+
+#API endpoint returning the next page of a queue's tickets with a status as JSON, after the ticket id given.
+@views.route('/QueueTickets/<queueid>')
+def queue_tickets(queueid):
+	if('username' in session):
+		status = request.args.get('status','New')
+		if(status not in database_methods.OPEN_STATUSES):
+			return jsonify(error='Unknown status'),400
+		tickets,after = database_methods.queue_tickets_page(queueid,status,request.args.get('after',type=int))
+		return jsonify(tickets=[{'id':ticket[0],'name':ticket[1],'owner':ticket[2],'created':str(ticket[3]),'status':ticket[4]} for ticket in tickets],after=after)
+	return redirect("/")
+
+#How long (seconds) a live queue stream stays open before the browser is asked to reconnect, so streams don't tie up a worker forever.
+QUEUE_STREAM_DURATION = 300
+#How often (seconds) streams and long polls check for changes made by other processes, such as the email ingester.
+QUEUE_CHECK_INTERVAL = 2
+#How long (seconds) between keepalive comments on an idle stream, stops proxies closing it.
+QUEUE_KEEPALIVE = 20
+#Longest a long poll request is allowed to wait for a change.
+QUEUE_MAX_WAIT = 30
+
+#Wait until there are changes to a queue after since, or until the deadline passes. Returns (changes, reset) like queue_changes.
+#The database connection is handed back between checks, so waiting clients don't hold pooled connections.
+def wait_for_queue_changes(queueid,since,deadline):
+	while True:
+		changes,reset = database_methods.queue_changes(queueid,since)
+		database_methods.release_connection()
+		remaining = deadline - time.monotonic()
+		if(changes or reset or remaining <= 0):
+			return changes,reset
+		database_methods.wait_for_changes(min(QUEUE_CHECK_INTERVAL,remaining))
+
+#API endpoint streaming changes to a queue's tickets as server sent events, used by the queue page instead of refreshing.
+#Carries on from the Last-Event-ID header when the browser reconnects, so no changes are missed.
+@views.route('/QueueEvents/<queueid>')
+def queue_events(queueid):
+	if('username' in session):
+		since = request.headers.get('Last-Event-ID',type=int)
+		if(since is None):
+			since = request.args.get('since',0,type=int)
+		def stream():
+			nonlocal since
+			yield f"retry: {QUEUE_CHECK_INTERVAL * 1000}\n\n"
+			finish = time.monotonic() + QUEUE_STREAM_DURATION
+			while time.monotonic() < finish:
+				changes,reset = wait_for_queue_changes(queueid,since,min(finish,time.monotonic() + QUEUE_KEEPALIVE))
+				if(reset):
+					yield "event: reset\ndata: {}\n\n"
+					return
+				for change in changes:
+					since = change['id']
+					yield f"id: {change['id']}\nevent: ticket\ndata: {json.dumps(change)}\n\n"
+				#only part of the queue is on the page, so send the real number of tickets with each status
+				if(changes):
+					yield f"event: counts\ndata: {json.dumps(database_methods.queue_status_counts(queueid))}\n\n"
+					database_methods.release_connection()
+				if not(changes):
+					yield ": keepalive\n\n"
+		response = Response(stream_with_context(stream()),mimetype='text/event-stream')
+		response.headers['Cache-Control'] = 'no-cache'
+		#stop nginx and similar proxies from buffering the stream
+		response.headers['X-Accel-Buffering'] = 'no'
+		return response
+	return redirect("/")
+
+#API endpoint for long polling a queue's changes, for browsers or proxies that can't hold a stream open.
+#Returns the changes after since as JSON, waiting up to wait seconds for one. The queue's latest change id is the ETag, so an unchanged queue answers 304.
+@views.route('/QueueChanges/<queueid>')
+def queue_changes(queueid):
+	if('username' in session):
+		since = request.args.get('since',0,type=int)
+		wait = max(0,min(request.args.get('wait',0,type=int),QUEUE_MAX_WAIT))
+		#nothing has changed since the version the client already has, and it doesn't want to wait
+		if(not wait and str(database_methods.queue_version(queueid)) in request.if_none_match):
+			return Response(status=304)
+		changes,reset = wait_for_queue_changes(queueid,since,time.monotonic() + wait)
+		version = changes[-1]['id'] if changes else max(since,database_methods.queue_version(queueid))
+		response = jsonify(changes=changes,reset=reset,version=version,counts=database_methods.queue_status_counts(queueid))
+		response.set_etag(str(version))
+		response.headers['Cache-Control'] = 'no-cache'
+		#answers 304 if the client's If-None-Match already has this version
+		return response.make_conditional(request)
 	return redirect("/")
 
+#API endpoint reporting ticket metrics per queue and analyst over a range (1h, 24h, 7d, 30d or 90d, ?range=7d), optionally for one queue (?queue=1).
+#Returns JSON with ?format=json, otherwise shows the report page.
+@views.route('/Reports')
+def show_reports():
+	if('username' in session):
+		period = request.args.get('range','7d')
+		report = database_methods.metrics_report(period,request.args.get('queue',type=int))
+		if not(report):
+			return jsonify(error='Unknown range',ranges=list(database_methods.REPORT_RANGES)),400
+		if(request.args.get('format') == 'json'):
+			return jsonify(report)
+		return render_template('Reports.html',report=report,ranges=database_methods.REPORT_RANGES)
+	return redirect('/')
+
+#Content type of each export format
+EXPORT_MIMETYPES = {
+	'csv':'text/csv',
+	'jsonl':'application/x-ndjson',
+}
+
+#API endpoint streaming every ticket created in a range, with its comments, key info, determination and timings, as CSV or JSON Lines.
+#start and end are ISO dates or times (either can be left out to leave that end open) and queue limits it to one queue, archived tickets are included.
+#The export is written as it is read, so it can be any size without the whole of it being held in memory.
+@views.route('/Export/<format>')
+def export_tickets(format):
+	if('username' in session):
+		if(format not in database_methods.EXPORT_FORMATS):
+			return jsonify(error='Unknown format',formats=list(database_methods.EXPORT_FORMATS)),400
+		try:
+			start,end = [datetime.datetime.fromisoformat(request.args[name]) if request.args.get(name) else None for name in ('start','end')]
+		except ValueError:
+			return jsonify(error='start and end must be ISO dates or times'),400
+		tickets = database_methods.export_tickets(start,end,request.args.get('queue',type=int))
+		response = Response(stream_with_context(database_methods.EXPORT_FORMATS[format](tickets)),mimetype=EXPORT_MIMETYPES[format])
+		name = "-".join(["tickets"] + [value.date().isoformat() for value in (start,end) if value])
+		response.headers['Content-Disposition'] = f'attachment; filename="{name}.{format}"'
+		#stop nginx and similar proxies from buffering the export
+		response.headers['X-Accel-Buffering'] = 'no'
+		return response
+	return redirect('/')
+
 #API endpoint to view a specified ticket, by id.
-@app.route('/ViewTicket/<ticketid>')
+@views.route('/ViewTicket/<ticketid>')
 def view_ticket(ticketid):
 	if('username' in session):
-		isOwner = False
-		db,cur = database_methods.db_connection()
-		#fetch the ticket data for the ticket held at the id provided
-		ticket = cur.execute('SELECT name,content,created,id,status,owner FROM tickets WHERE id = ?',(ticketid,)).fetchone()
-		#fetch all key information for this ticket.
-		key = cur.execute('SELECT info,infotype,id FROM keyinfo WHERE ticket = ?',(ticketid,)).fetchall()
-		#fetch all of the comments for the ticket
-		comments = cur.execute('SELECT comment,name,datetime,stage,commenter,comments.id FROM comments INNER JOIN users ON commenter = users.id WHERE post = ? ORDER BY datetime DESC',(ticketid,)).fetchall()
-		#fetch all the relationships for the ticket.
-		relations = cur.execute(f'SELECT relationships.ticketone, tickets.name, relationships.id FROM relationships INNER JOIN tickets ON ticketone = tickets.id WHERE tickettwo = {ticketid} UNION SELECT relationships.tickettwo, tickets.name, relationships.id FROM relationships INNER JOIN tickets ON tickettwo = tickets.id WHERE ticketone = {ticketid}').fetchall()
-
-		#fetch the knowledge mapping of the ticket, should it have. Other wise is false.
-		knowledge_id = database_methods.has_incident_identifier(ticket[0])
-
-		#if there is any key information
-		if(key):
-			#for each piece of key information (enum works like a key, value pairs loop)
-			for index,value in enumerate(key):
-				#fetch the amount of times this key info has been seen before
-				occurances = cur.execute('SELECT COUNT(id) FROM keyinfo WHERE info = ?',(value[0],)).fetchone()[0]
-				#reassign the value into the key tuple, by unpacking values and adding it onto the end, needed as tuples are immutable
-				key[index] =  *value,occurances
-			
-			#Sort the key list based on id and reverse order
-			key.sort(key=lambda x: x[2], reverse=True)
-		
-		#If the ticket has comments
-		if(comments):
-			#list to assign string value based on the integer provided as the framework step, used in lookups.
-			lookup = ["Preparation","Detection and Analysis","Containment, Eradication and Recovery","Post-Incident Activity"]
-			
-			#for each comment
-			for index,value in enumerate(comments):
-				
-				#reassign the current comment, to have the string value of the framework step as well as all of the original contents
-				comments[index] = *value[0:3],lookup[value[3]-1],*value[3:]
-
-
-				#if the user is the creator of the comment
-				if (value[4] == database_methods.user_id_from_name(session['username'])):
-					#unpack tuple, add a true value to the end of the tuple or reassign value
-					comments[index] = *comments[index],True
-				else:
-					#same as abovee but with false value
-					comments[index] = *comments[index],False
-
-		#if the user is the owner of the current ticket, assign isOwner to True
-		if(ticket[5] == database_methods.user_id_from_name(session['username'])):
-			isOwner = True
+		#load the ticket, its key info (with how often each has been seen), comments, relationships and knowledge mapping all in one go
+		detail = database_methods.load_ticket_detail(ticketid,current_user_id())
+		#if the ticket doesn't exist, go home
+		if not(detail):
+			return redirect('/')
 
 		#render template passing the values into populate data
-		return render_template('ViewTicket.html',ticket=ticket,key=key,comments=comments,relations=relations,Owner=isOwner,knowledge=knowledge_id)
+		return render_template('ViewTicket.html',**detail)
 	else:
 		return redirect('/')
 
 #API endpoint to View an Incident summary, organised by incident response framework step
-@app.route('/ViewSummary/<ticketid>')
+@views.route('/ViewSummary/<ticketid>')
 def view_incident_summary(ticketid):
 	if('username' in session):
 		#fetches comments using the summarise by framework, which uses ticketid to fetch all comments
@@ -305,14 +498,13 @@ def view_incident_summary(ticketid):
 		return redirect('/')
 
 #API endpoint used to display a particular piece of keyinfo and show all instances of it, using the value (ie the IP address)
-@app.route('/ViewKeyInfo/<keyinfovalue>')
+@views.route('/ViewKeyInfo/<keyinfovalue>')
 def present_key_info(keyinfovalue):
 	if('username' in session):
-		db,cur = database_methods.db_connection()
 		#initialise ticket_id_list, used to pass a list of just ticket ids into the template
 		ticket_id_list = []
-		#fetch all information about the specified piece of key info
-		related = cur.execute('SELECT info,ticket,infotype FROM keyinfo WHERE info = ?',(keyinfovalue,)).fetchall()
+		#fetch all information about the specified piece of key info, on hot and archived tickets
+		related = database_methods.key_info_tickets(keyinfovalue)
 		#if related tickets are found
 		if(related):
 			#create a list, by taking just the second value (ticket id) from related, leaving only ticket ids
@@ -325,10 +517,9 @@ def present_key_info(keyinfovalue):
 		return redirect("/")
 
 #API endpoint to resolve/close down a ticket.
-@app.route('/Resolve/<id>',methods=['POST','GET'])
+@views.route('/Resolve/<id>',methods=['POST','GET'])
 def resolve_ticket(id):
 	if('username' in session):
-		db,cur = database_methods.db_connection()
 		#initialise the set determination form
 		form = SetDetermination()
 		#upon successful submission
@@ -341,7 +532,7 @@ def resolve_ticket(id):
 		return render_template('SetDetermination.html',form=form)
 
 #API endpoint to re-open a closed ticket.	
-@app.route('/Reopen/<ticketid>')
+@views.route('/Reopen/<ticketid>')
 def reopen_ticket(ticketid):
 	if('username' in session):
 		#use the reopen function and pass the specified id to it.
@@ -351,7 +542,7 @@ def reopen_ticket(ticketid):
 		return redirect('/')
 
 #API endpoint to take an unowned ticket
-@app.route('/TakeTicket/<ticketid>')
+@views.route('/TakeTicket/<ticketid>')
 def take_tickets(ticketid):
 	if('username' in session):
 		#use the take new ticket function, specify ticketid and the name of user taking the ticket.
@@ -362,15 +553,18 @@ def take_tickets(ticketid):
 		redirect('/')
 
 #API endpoint to Update the values of a ticket (title,body,etc)
-@app.route('/UpdateTicket/<ticketid>',methods=['POST','GET'])
+@views.route('/UpdateTicket/<ticketid>',methods=['POST','GET'])
 def update_ticket(ticketid):
 	#Initialise update ticket form
 	form = UpdateTicket()
 	db,cur = database_methods.db_connection()
-	#fetch the current values of the ticket, so they can be placed into the form to be edited.
-	current_values = cur.execute('SELECT name,content,queue,status FROM tickets WHERE id = ?',(ticketid,)).fetchone()
+	#fetch the current values of the ticket, so they can be placed into the form to be edited. Archived tickets can be edited too, update_ticket restores them.
+	current_values = cur.execute(f"SELECT name,content,queue,status FROM {database_methods.hot_and_archived('tickets')} WHERE id = ?",(ticketid,)).fetchone()
+	#if the ticket doesn't exist, go home
+	if not(current_values):
+		return redirect('/')
 	#for id,queue name in the queue database table - This is used to populate a select field.
-	form.queue.choices = [(queue[0], queue[1]) for queue in cur.execute('SELECT id, name FROM queue').fetchall()]
+	form.queue.choices = database_methods.queue_choices()
 	#populate status select field with values
 	form.status.choices = [ status for status in ["Under Investigation","On-Hold"]]
 	#Set Values to the Current Values
@@ -389,37 +583,36 @@ def update_ticket(ticketid):
 	return render_template('EditTicket.html',form=form)
 
 #API endpoint to get the user's queue and redirect them to it
-@app.route('/FindMyQueue')
+@views.route('/FindMyQueue')
 def find_my_queue():
 	if('username' in session):
-		#use the current user's queue from user name
-		queue_to_show = database_methods.get_user_queue(session['username'])
+		#use the current user's queue, kept in the session
+		queue_to_show = current_user_queue()
 		#view the user's queue, found using the above function
 		return redirect(f'/ViewQueue/{queue_to_show}')
 	else:
 		return redirect('/')
 
 #API endpoint used to change a user's queue
-@app.route('/ChangeQueue',methods=['GET','POST'])
+@views.route('/ChangeQueue',methods=['GET','POST'])
 def change_queue():
 	if('username' in session):
 		#initialise the form for changing queues
 		form = ChangeQueue()
-		db,cur = database_methods.db_connection()
-		#get user id from using the username, found in session.
-		user = database_methods.user_id_from_name(session['username'])
+		#get user id, found in session.
+		user = current_user_id()
 		#populate a select field using all of the values of the queue table in the database.
-		form.queue.choices = [(queue[0], queue[1]) for queue in cur.execute('SELECT id, name FROM queue').fetchall()]
+		form.queue.choices = database_methods.queue_choices()
 
 		#if the page is being retrieve and is not form submission, populate page with the current information.
 		if(request.method == 'GET'):
-			current_value = cur.execute('SELECT queue FROM users WHERE id = ?',(user,)).fetchone()[0]
-			form.queue.default = current_value
+			form.queue.default = current_user_queue()
 			form.process()
 
 		if form.validate_on_submit():
-			#update user queue using function, passing in the new queue id and the user's name
+			#update user queue using function, passing in the new queue id and the user's id, and keep the session's copy in step
 			database_methods.update_user_queue(form.queue.data,user)
+			session['queue_id'] = form.queue.data
 			#redirect to user's profile
 			return redirect('/Profile')
 		else:
@@ -427,7 +620,7 @@ def change_queue():
 	return('/')
 
 #API endpoint used for updating a comment
-@app.route('/UpdateComment/<commentid>',methods=['GET','POST'])
+@views.route('/UpdateComment/<commentid>',methods=['GET','POST'])
 def update_comment(commentid):
 	if('username' in session):
 		db,cur = database_methods.db_connection()
@@ -442,36 +635,47 @@ def update_comment(commentid):
 		#if the form is being retrieved (not POST request)
 		if(request.method == 'GET'):
 			#grab the comments current value and populate the text box on form with it.
-			current_value = cur.execute('SELECT comment FROM comments WHERE id = ?',(commentid,)).fetchone()[0]
+			current_value = cur.execute(f"SELECT comment FROM {database_methods.hot_and_archived('comments')} WHERE id = ?",(commentid,)).fetchone()[0]
 			form.comment.default = current_value
 			form.process()
 		return render_template('UpdateComment.html',form=form,id=commentid)
 	else:
 		return redirect('/')
 
+#Turns the snippet of matching text from a search result into HTML, escaping the text and highlighting the matched words.
+def highlight_snippet(snippet):
+	return Markup(str(escape(snippet)).replace('\x02','<mark>').replace('\x03','</mark>'))
+
 #API endpoint used to search database.
-@app.route("/Search")
+@views.route("/Search")
 def search():
 	if('username' in session):
 		#Fetch the search query string, passed in as a form submission under the name search.
-		term = request.args.get('search')
+		term = request.args.get('search','')
+		#The page of results to show, starting from 0
+		page = request.args.get('page',0,type=int)
+		if(page < 0):
+			page = 0
 		#Initialise results and id_list, prevent issues should no results be returned
-		results = ""
+		results = []
 		id_list = ""
+		more = False
 		#if the search term is not blank
 		if not(term.isspace() or term == ""):
 			#search database using term, with function.
-			results = database_methods.search(term)
+			results,more = database_methods.search(term,page)
+			#swap the raw snippet for a highlighted one, ready to display
+			results = [(*result[0:4],highlight_snippet(result[4])) for result in results]
 			#if any results are returned
 			if(results):
 				#return a list of just ticket ids taken from the search results
 				id_list = list(map(lambda a: a[0],results))
-		return render_template('Search.html',results=results,ids=id_list)
+		return render_template('Search.html',results=results,ids=id_list,term=term,page=page,more=more)
 	else:
 		return redirect('/')
 
 #API endpoint to remove relationship between two tickets specified
-@app.route("/RemoveRelationship/<previousticket>/<tickettoremove>")
+@views.route("/RemoveRelationship/<previousticket>/<tickettoremove>")
 def remove_relationship(previousticket,tickettoremove):
 	if('username' in session):
 		#remove the specified relationship, using function by passing the id of the ticket of the relationship.
@@ -482,7 +686,7 @@ def remove_relationship(previousticket,tickettoremove):
 		return('/')
 
 #API endpoint used to update key information
-@app.route('/UpdateKeyInfo/<keyinfoid>',methods=['GET','POST'])
+@views.route('/UpdateKeyInfo/<keyinfoid>',methods=['GET','POST'])
 def update_key_information(keyinfoid):
 	if('username' in session):
 		message = ""
@@ -492,14 +696,14 @@ def update_key_information(keyinfoid):
 		if form.validate_on_submit():
 			#update key information using information provided from form.
 			if(database_methods.update_keyinfo(keyinfoid,form.infotype.data,form.info.data)):
-				#find the ticket the key info is on and open it
-				ticket = cur.execute('SELECT ticket FROM keyinfo WHERE id = ?',(keyinfoid,)).fetchone()[0]
+				#find the ticket the key info is on and open it, looking in the archive as well rather than relying on update_keyinfo having restored the ticket
+				ticket = cur.execute(f"SELECT ticket FROM {database_methods.hot_and_archived('keyinfo')} WHERE id = ?",(keyinfoid,)).fetchone()[0]
 				return redirect(f"/ViewTicket/{ticket}")
 			else:
 				message = "Key Information With This Title Already Exists"
 		if(request.method == 'GET'):
 			#find the current values of the key information and set the form's fields values to it.
-			current_value = cur.execute('SELECT infotype,info FROM keyinfo WHERE id = ?',(keyinfoid,)).fetchone()
+			current_value = cur.execute(f"SELECT infotype,info FROM {database_methods.hot_and_archived('keyinfo')} WHERE id = ?",(keyinfoid,)).fetchone()
 			form.infotype.default = current_value[0]
 			form.info.default = current_value[1]
 			form.process()	
@@ -508,29 +712,29 @@ def update_key_information(keyinfoid):
 		return('/')
 
 #API endpoint to Remove a piece of key information
-@app.route('/RemoveKeyInfo/<keyinfoid>')
+@views.route('/RemoveKeyInfo/<keyinfoid>')
 def remove_key_information(keyinfoid):
 	db,cur = database_methods.db_connection()
 	#find the ticket that the key information relates to
-	ticket = cur.execute('SELECT ticket FROM keyinfo WHERE id = ?',(keyinfoid,)).fetchone()[0]
+	ticket = cur.execute(f"SELECT ticket FROM {database_methods.hot_and_archived('keyinfo')} WHERE id = ?",(keyinfoid,)).fetchone()[0]
 	#remove the key information using id
 	database_methods.remove_keyinfo(keyinfoid)
 	#return to the ticket the keyinformation was used on.
 	return redirect(f'/ViewTicket/{ticket}')
 
 #API endpoint to remove comments
-@app.route('/RemoveComment/<commentid>')
+@views.route('/RemoveComment/<commentid>')
 def remove_comment(commentid):
 	db,cur = database_methods.db_connection()
 	#use the specified comment id to find the ticket it was left on
-	ticket = cur.execute('SELECT post FROM comments WHERE id = ?',(commentid,)).fetchone()[0]
+	ticket = cur.execute(f"SELECT post FROM {database_methods.hot_and_archived('comments')} WHERE id = ?",(commentid,)).fetchone()[0]
 	#remove the comment by specifying id to the function
 	database_methods.remove_comment(commentid)
 	#return to the ticket the comment was left on
 	return redirect(f'/ViewTicket/{ticket}')
 
 #API endpoint used to link multiple tickets to a select "root" (primary) ticket
-@app.route('/LinkToRoot/<idlist>',methods=['GET','POST'])
+@views.route('/LinkToRoot/<idlist>',methods=['GET','POST'])
 def link_many_to_root(idlist):
 	if('username' in session):
 		message = ""
@@ -551,44 +755,44 @@ def link_many_to_root(idlist):
 	return redirect('/')
 
 #API endpoint to recursively relate tickets (ie each ticket specified is related to each other)
-@app.route('/RecursiveRelate/<idlist>',methods=['GET','POST'])
+@views.route('/RecursiveRelate/<idlist>',methods=['GET','POST'])
 def add_recursive_relationships(idlist):
 	if('username' in session):
 		#processes the list, removing the square brace, any spaces and whitespace. Leaving a comma seperated value list, which is then split to make a python list, with one entry per ticket it
 		idlist = idlist.replace("[","").replace("]","").replace(" ","").strip().split(",")
 		#if there's atleast two ticket ids provided.
 		if(len(idlist) >= 2):
-			#use the recursive relation function to link each ticket to every other
-			database_methods.recursive_relate(idlist)
+			#use the recursive relation function to link each ticket to every other, or just to the first ticket if ?star=1 is given
+			database_methods.recursive_relate(idlist,request.args.get('star',0,type=int) == 1)
 			#go to the user's queue
 			return redirect(f'/FindMyQueue')
 
 	return redirect('/')
 
 #API endpoint used to close any open tickets linked to the current ticket.
-@app.route('/CloseLinked/<ticketid>')
+@views.route('/CloseLinked/<ticketid>')
 def close_all_linked_tickets(ticketid):
 	if('username' in session):
 		#pass the ticket of the relationships you want to close, along with username to bulk close related tickets
-		database_methods.close_linked_tickets(ticketid,database_methods.user_id_from_name(session['username']))
+		database_methods.close_linked_tickets(ticketid,current_user_id())
 		#go to the ticket that had its related tickets closed.
 		return redirect(f'/ViewTicket/{ticketid}')
 	else:
 		return redirect('/')
 
 #API Endpoint to view any knowledge mappings that exist in the database.
-@app.route('/Knowledge')
+@views.route('/Knowledge')
 def display_knowledge_base():
 	if('username' in session):
-		db,cur = database_methods.db_connection()
-		knowledge = cur.execute('SELECT id, title FROM knowledgemap ORDER BY id ASC')
+		#every mapping with its ticket totals, false positive percentage and volume in the last seven days
+		knowledge = database_methods.knowledge_mappings_with_stats()
 
 		return render_template('Knowledge.html',knowledge=knowledge)
 	else:
 		return redirect('/')
 
 #API endpoint to serve the form used to add new knowledge mappings to database.
-@app.route('/CreateKnowledge',methods=['GET','POST'])
+@views.route('/CreateKnowledge',methods=['GET','POST'])
 def create_knowledge_entry():
 	if('username' in session):
 		#initialise form
@@ -608,7 +812,7 @@ def create_knowledge_entry():
 		return redirect('/')
 
 #API Endpoint to view a particular knowledge mapping
-@app.route('/ViewKnowledge/<knowledgeid>')
+@views.route('/ViewKnowledge/<knowledgeid>')
 def view_knowledge_entry(knowledgeid):
 	if('username' in session):
 		db,cur = database_methods.db_connection()
@@ -623,7 +827,7 @@ def view_knowledge_entry(knowledgeid):
 		return redirect('/')
 
 #API endpoint to remove a particular mapping from the database
-@app.route('/RemoveKnowledge/<knowledgeid>')
+@views.route('/RemoveKnowledge/<knowledgeid>')
 def remove_knowledge_entry(knowledgeid):
 	if('username' in session):
 		database_methods.remove_knowledgebase_entry(knowledgeid)
@@ -632,11 +836,10 @@ def remove_knowledge_entry(knowledgeid):
 		return redirect('/')
 
 #Create a piece of guidance for a specified mapping
-@app.route('/CreateGuidance/<mapid>',methods=["GET","POST"])
+@views.route('/CreateGuidance/<mapid>',methods=["GET","POST"])
 def create_knowledge_guidance(mapid):
 	if('username' in session):
 		message = ""
-		db,cur = database_methods.db_connection()
 		form = CreateGuidance()
 
 		if(form.validate_on_submit()):
@@ -653,13 +856,12 @@ def create_knowledge_guidance(mapid):
 		return redirect('/')
 
 #API endpoint to remove a piece of guidance from a knowledge mapping
-@app.route('/RemoveGuidance/<guidanceid>')
+@views.route('/RemoveGuidance/<guidanceid>')
 def remove_guidance_entry(guidanceid):
 	if('username' in session):
 		db,cur = database_methods.db_connection()
 		#find the mapping that the guidance exists on
 		knowledge = cur.execute('SELECT knowledgemap FROM knowledge WHERE id = ?',(guidanceid,)).fetchone()[0]
-		db.close()
 		#remove the guidance from database using the right function to do so
 		database_methods.remove_guidance_entry_fromdb(guidanceid)
 		return redirect(f'/ViewKnowledge/{knowledge}')
@@ -667,7 +869,7 @@ def remove_guidance_entry(guidanceid):
 		return redirect('/')
 
 #API Endpoint to update the values kept inside the guidance for a knowledge mapping
-@app.route('/UpdateGuidance/<guidanceid>',methods=['GET','POST'])
+@views.route('/UpdateGuidance/<guidanceid>',methods=['GET','POST'])
 def update_guidance(guidanceid):
 	if('username' in session):
 		form = UpdateGuidance()
@@ -692,7 +894,7 @@ def update_guidance(guidanceid):
 		return redirect('/')
 
 #API endpoint to update a knowledge mapping
-@app.route('/UpdateKnowledge/<mapid>',methods=['GET','POST'])
+@views.route('/UpdateKnowledge/<mapid>',methods=['GET','POST'])
 def update_knowledge_mapping(mapid):
 	if('username' in session):
 		db,cur = database_methods.db_connection()
@@ -722,4 +924,4 @@ def update_knowledge_mapping(mapid):
 #if the script is run as it self and not as a dependancy
 if __name__ == "__main__":
 	#use the flask built in server
-    app.run(debug=True)
\ No newline at end of file
+    create_app().run(debug=True)
\ No newline at end of file
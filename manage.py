@@ -0,0 +1,94 @@
+import argparse
+import sys
+from datetime import datetime
+import database_methods
+
+#Command line tool for maintenance tasks on the ticketing database, run with "python manage.py <command>"
+
+#Apply any outstanding schema migrations and seed the default rows.
+def migrate(args):
+	database_methods.table_init()
+	print(f"Database is at schema version {database_methods.schema_version()}")
+
+#Check that none of the hot queries fall back to a full table scan, exits with an error code if any do.
+def check_plans(args):
+	failures = database_methods.check_query_plans()
+	for name,detail in failures:
+		print(f"{name}: {detail}")
+	if(failures):
+		return 1
+	print("All hot queries use an index")
+
+#Rebuild the full text search index from the existing tickets, comments and key info.
+def rebuild_search(args):
+	total = database_methods.rebuild_search_index()
+	print(f"Indexed {total} rows for search")
+
+#Rebuild the incident clusters from the relationships between tickets.
+def rebuild_clusters(args):
+	total = database_methods.rebuild_clusters()
+	print(f"Rebuilt {total} incident clusters")
+
+#Rebuild the indicator reputation stats from the key info on every ticket.
+def rebuild_ioc_stats(args):
+	total = database_methods.rebuild_ioc_stats()
+	print(f"Rebuilt stats for {total} indicators")
+
+#Recreate the metric triggers (picking up the current SLA) and rebuild the metric buckets from the tickets table.
+def rebuild_metrics(args):
+	total = database_methods.rebuild_metrics()
+	print(f"Rebuilt {total} metric buckets")
+
+#Move tickets resolved more than --days ago into the archive database.
+def archive(args):
+	moved = database_methods.archive_resolved_tickets(args.days)
+	hot,archived = database_methods.archive_counts()
+	print(f"Archived {moved} tickets, {hot} tickets are hot and {archived} archived")
+
+#Write tickets created between --start and --end, with their comments and key info, as CSV or JSON Lines to --output or standard output.
+def export(args):
+	output = open(args.output,'w',newline='',encoding='utf-8') if args.output else sys.stdout
+	try:
+		for chunk in database_methods.EXPORT_FORMATS[args.format](database_methods.export_tickets(args.start,args.end,args.queue)):
+			output.write(chunk)
+	finally:
+		if(args.output):
+			output.close()
+
+#Each command name and the function that runs it, along with the help text shown for it and any extra arguments it takes as (flags, argparse options) pairs.
+COMMANDS = {
+	'migrate':(migrate,'Create or upgrade the database schema',()),
+	'check-plans':(check_plans,'Fail if a hot query falls back to a table scan',()),
+	'rebuild-search':(rebuild_search,'Backfill or repair the full text search index',()),
+	'rebuild-clusters':(rebuild_clusters,'Rebuild the incident clusters from the relationships table',()),
+	'rebuild-ioc-stats':(rebuild_ioc_stats,'Rebuild the indicator reputation stats from the key info table',()),
+	'rebuild-metrics':(rebuild_metrics,'Rebuild the queue and analyst metric buckets from the tickets table',()),
+	'archive':(archive,'Move old resolved tickets into the archive database',(
+		(('--days',),{'type':int,'default':database_methods.ARCHIVE_AFTER_DAYS,'help':'Archive tickets resolved more than this many days ago'}),
+	)),
+	'export':(export,'Export tickets with their comments and key info as CSV or JSON Lines',(
+		(('--format',),{'choices':list(database_methods.EXPORT_FORMATS),'default':'csv','help':'Output format'}),
+		(('--start',),{'type':datetime.fromisoformat,'help':'Only tickets created at or after this ISO date or time'}),
+		(('--end',),{'type':datetime.fromisoformat,'help':'Only tickets created before this ISO date or time'}),
+		(('--queue',),{'type':int,'help':'Only tickets in this queue id'}),
+		(('--output',),{'help':'File to write to, standard output by default'}),
+	)),
+}
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description='Ticketing system database maintenance')
+	subparsers = parser.add_subparsers(dest='command',required=True)
+	for name,(function,help_text,arguments) in COMMANDS.items():
+		subparser = subparsers.add_parser(name,help=help_text)
+		for flags,options in arguments:
+			subparser.add_argument(*flags,**options)
+		subparser.set_defaults(function=function)
+	args = parser.parse_args(argv)
+	try:
+		return args.function(args) or 0
+	finally:
+		database_methods.close_pool()
+
+#if the script is run as it self and not as a dependancy
+if __name__ == "__main__":
+	sys.exit(main())
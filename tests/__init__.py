@@ -0,0 +1 @@
+#Tests for the ticketing system, run them from the repository root with "python -m pytest tests"
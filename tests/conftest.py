@@ -0,0 +1,38 @@
+from datetime import datetime
+import pytest
+import database_methods
+
+#Points the app at a new database file (and archive) in the test's temporary directory, without creating any tables. The pool, writer thread
+#and caches are shut down afterwards so nothing opened against one test's database is handed to the next.
+@pytest.fixture
+def empty_database(tmp_path,monkeypatch):
+    monkeypatch.setattr(database_methods,'DATABASE',str(tmp_path / 'Tickets.db'))
+    monkeypatch.setattr(database_methods,'ARCHIVE_DATABASE',None)
+    yield database_methods
+    database_methods.close_pool()
+    database_methods.invalidate_metadata_cache()
+    database_methods._stats_cache.update(expires=0,stats=None)
+
+#A fresh database at the latest schema, with the default queue and user.
+@pytest.fixture
+def database(empty_database):
+    empty_database.table_init()
+    return empty_database
+
+#The flask test client, logged in as the default user. Skipped where flask isn't installed.
+@pytest.fixture
+def client(database):
+    pytest.importorskip('flask')
+    import main
+    app = main.create_app({'TESTING':True,'WTF_CSRF_ENABLED':False},bootstrap=False)
+    with app.test_client() as client:
+        with client.session_transaction() as session:
+            session['username'] = 'Nobody'
+        yield client
+
+#Creates tickets in the default queue, owned by nobody: new_ticket(name, created=None, status="New") returns the new ticket's id.
+@pytest.fixture
+def new_ticket(database):
+    def create(name='Suspicious login',created=None,status='New',content='Seen on the VPN gateway'):
+        return database.insert_ticket(name,1,content,1,created or datetime.now(),status)
+    return create
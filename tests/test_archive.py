@@ -0,0 +1,94 @@
+from datetime import datetime, timedelta
+import pytest
+
+LONG_AGO = datetime.now() - timedelta(days=200)
+
+#Five tickets resolved long ago, each with a comment and the same IP as key info, the first three linked together, plus one recent open ticket linked to the last.
+@pytest.fixture
+def old_tickets(database,new_ticket):
+    database.add_knowledgebase_entry('Beaconing','Hosts calling out to C2')
+    tickets = []
+    for number in range(5):
+        ticket = new_ticket(f'INC1 beacon {number}',created=LONG_AGO)
+        database.insert_comment(f'zebra comment {number}',1,ticket,LONG_AGO,1)
+        database.insert_keyinfo('10.9.9.9',ticket,'IP')
+        database.resolve_ticket(ticket,'False Positive')
+        tickets.append(ticket)
+    database.relate_tickets(tickets[0:3])
+    hot = new_ticket('Recent beacon')
+    database.insert_keyinfo('10.9.9.9',hot,'IP')
+    database.insert_relationship(tickets[4],hot)
+    database.write(lambda cur: cur.execute('UPDATE tickets SET completed = ? WHERE status = "Resolved"',(LONG_AGO,)))
+    return tickets,hot
+
+#Everything the pages read about a set of tickets, which archiving must not change.
+def views(database,tickets):
+    return {
+        'detail':[database.load_ticket_detail(ticket,1) for ticket in tickets],
+        'reputation':database.ioc_reputation('10.9.9.9'),
+        'keyinfo':database.key_info_stats('10.9.9.9'),
+        'keyinfo_tickets':sorted(database.key_info_tickets('10.9.9.9')),
+        'knowledge':database.stats_by_knowledge(1),
+        'search':database.search('zebra'),
+    }
+
+#Archiving moves old resolved tickets out of the hot database but every page still shows the same thing, even after rebuilding the derived tables.
+def test_archive_keeps_views(database,old_tickets):
+    tickets,hot = old_tickets
+    before = views(database,tickets + [hot])
+    #batches smaller than the number of tickets, so a relationship's tickets are archived in different batches
+    assert database.archive_resolved_tickets(90,batch=2) == 5
+    assert database.archive_counts() == (1,5)
+    assert views(database,tickets + [hot]) == before
+    for rebuild in (database.rebuild_search_index,database.rebuild_ioc_stats,database.rebuild_metrics,database.rebuild_clusters):
+        rebuild()
+    assert views(database,tickets + [hot]) == before
+    db,cur = database.db_connection()
+    #the relationship with the hot ticket stays hot
+    assert cur.execute('SELECT count(*) FROM archive.relationships').fetchone() == (3,)
+    assert cur.execute('PRAGMA archive.integrity_check').fetchone() == ('ok',)
+
+#Reopening an archived ticket brings it back, with its rows, and it can be archived again later.
+def test_archive_restore_round_trip(database,old_tickets):
+    tickets,hot = old_tickets
+    database.archive_resolved_tickets(90)
+    database.reopen_closed_ticket(tickets[1])
+    assert database.archive_counts() == (2,4)
+    db,cur = database.db_connection()
+    assert cur.execute('SELECT status FROM main.tickets WHERE id = ?',(tickets[1],)).fetchone() == ('Under Investigation',)
+    assert cur.execute('SELECT count(*) FROM main.comments WHERE post = ?',(tickets[1],)).fetchone() == (1,)
+    assert cur.execute('SELECT count(*) FROM main.keyinfo WHERE ticket = ?',(tickets[1],)).fetchone() == (1,)
+    assert cur.execute('SELECT count(*) FROM main.relationships').fetchone() == (3,)
+    assert database.load_ticket_detail(tickets[1],1)['cluster'][1] == 3
+
+    database.resolve_ticket(tickets[1],'False Positive')
+    database.write(lambda cur: cur.execute('UPDATE tickets SET completed = ? WHERE id = ?',(LONG_AGO,tickets[1])))
+    assert database.archive_resolved_tickets(90) == 1
+    assert database.archive_counts() == (1,5)
+
+#Changing any row of an archived ticket, a comment here, moves the ticket back into the hot database first.
+def test_editing_archived_rows_restores(database,old_tickets):
+    tickets,hot = old_tickets
+    database.archive_resolved_tickets(90)
+    db,cur = database.db_connection()
+    comment = cur.execute('SELECT id FROM archive.comments WHERE post = ?',(tickets[2],)).fetchone()[0]
+    database.update_comment(comment,'edited')
+    assert database.archive_counts() == (2,4)
+    assert cur.execute('SELECT comment FROM main.comments WHERE id = ?',(comment,)).fetchone() == ('edited',)
+
+#A ticket given a new comment between being copied to the archive and removed from the hot database stays hot.
+def test_ticket_changed_while_archiving_stays(database,old_tickets):
+    tickets,hot = old_tickets
+    ids = database._copy_to_archive(datetime.now() - timedelta(days=90),10)
+    database.insert_comment('late comment',1,tickets[0],datetime.now(),1)
+    assert database._remove_archived(ids) == 4
+    assert database.archive_counts() == (2,4)
+    db,cur = database.db_connection()
+    assert cur.execute('SELECT count(*) FROM main.comments WHERE post = ?',(tickets[0],)).fetchone() == (2,)
+
+#The edit form loads an archived ticket's values.
+def test_edit_form_loads_archived_ticket(client,database,old_tickets):
+    tickets,hot = old_tickets
+    database.archive_resolved_tickets(90)
+    page = client.get(f'/UpdateTicket/{tickets[0]}').get_data(as_text=True)
+    assert 'INC1 beacon 0' in page
@@ -0,0 +1,44 @@
+import multiprocessing
+import pytest
+
+def default_rows(database):
+    db,cur = database.db_connection()
+    return cur.execute('SELECT COUNT(*) FROM queue').fetchone()[0],cur.execute('SELECT COUNT(*) FROM users').fetchone()[0]
+
+#Bootstrapping creates the database at the latest version with its default rows, and hands nothing open down to forked workers.
+def test_bootstrap_creates_and_closes(empty_database):
+    assert not empty_database.is_bootstrapped()
+    empty_database.bootstrap()
+    assert empty_database.get_pool_stats()['open'] == 0
+    assert empty_database._writer is None
+    assert empty_database.is_bootstrapped()
+    assert default_rows(empty_database) == (1,1)
+
+#Bootstrapping an up to date database changes nothing.
+def test_bootstrap_again(database):
+    database.insert_queue('Phishing')
+    database.bootstrap()
+    assert database.is_bootstrapped()
+    assert default_rows(database) == (2,1)
+
+#Several processes bootstrapping at the same moment end up with one set of default rows between them.
+@pytest.mark.skipif('fork' not in multiprocessing.get_all_start_methods(),reason='needs fork')
+def test_concurrent_bootstrap(empty_database):
+    context = multiprocessing.get_context('fork')
+    processes = [context.Process(target=empty_database.bootstrap) for _ in range(4)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(30)
+    assert [process.exitcode for process in processes] == [0] * 4
+    assert empty_database.is_bootstrapped()
+    assert default_rows(empty_database) == (1,1)
+
+#The app factory bootstraps unless told not to.
+def test_create_app_bootstraps(empty_database):
+    pytest.importorskip('flask')
+    import main
+    main.create_app({'TESTING':True},bootstrap=False)
+    assert not empty_database.is_bootstrapped()
+    main.create_app({'TESTING':True})
+    assert empty_database.is_bootstrapped()
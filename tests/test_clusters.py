@@ -0,0 +1,51 @@
+#The (root, size) of a ticket's incident cluster, as shown on its page.
+def cluster(database,ticket):
+    return database.load_ticket_detail(ticket,1)['cluster']
+
+#Which tickets are in the same cluster as each other, leaving aside which of them is the root.
+def partition(database,tickets):
+    clusters = {}
+    for ticket in tickets:
+        root,size = cluster(database,ticket)
+        clusters.setdefault((root,size),set()).add(ticket)
+    return sorted(sorted(members) for members in clusters.values())
+
+def relationship_id(database,t1,t2):
+    db,cur = database.db_connection()
+    return cur.execute('SELECT id FROM relationships WHERE ticketone = ? AND tickettwo = ?',(t1,t2)).fetchone()[0]
+
+#Linking tickets joins their clusters, and unlinking splits them again.
+def test_relating_and_unrelating(database,new_ticket):
+    one,two,three,four = (new_ticket(f'Ticket {number}') for number in range(4))
+    assert database.insert_relationship(one,two)
+    assert database.insert_relationship(two,three)
+    assert cluster(database,one) == cluster(database,three)
+    assert cluster(database,one)[1] == 3
+    assert cluster(database,four) == (four,1)
+
+    database.remove_relationship(relationship_id(database,one,two))
+    assert cluster(database,one) == (one,1)
+    assert cluster(database,two) == cluster(database,three)
+    assert cluster(database,two)[1] == 2
+
+#Rebuilding the clusters from the relationships groups the tickets the same way as maintaining them write by write.
+def test_rebuild_matches_maintained(database,new_ticket):
+    tickets = [new_ticket(f'Ticket {number}') for number in range(6)]
+    for t1,t2 in ((0,1),(2,3),(3,4),(1,4)):
+        database.insert_relationship(tickets[t1],tickets[t2])
+    maintained = partition(database,tickets)
+    assert maintained == [tickets[0:5],tickets[5:6]]
+    database.rebuild_clusters()
+    assert partition(database,tickets) == maintained
+
+#Closing linked tickets resolves the rest of the cluster, however they are linked, and makes the ticket its root.
+def test_close_linked_tickets(database,new_ticket):
+    one,two,three = (new_ticket(f'Ticket {number}') for number in range(3))
+    database.insert_relationship(one,two)
+    database.insert_relationship(two,three)
+    database.close_linked_tickets(two,1)
+    db,cur = database.db_connection()
+    statuses = dict(cur.execute('SELECT id,status FROM tickets'))
+    assert statuses == {one:'Resolved',two:'New',three:'Resolved'}
+    assert cur.execute('SELECT count(*) FROM comments').fetchone() == (2,)
+    assert cluster(database,one) == (two,3)
@@ -0,0 +1,36 @@
+from datetime import datetime
+
+#The dashboard stats come from the last day's metrics: tickets created, false positive rate, the busiest queues and the analysts who resolved most.
+def test_dashboard_stats(database,new_ticket):
+    database.insert_queue('Phishing')
+    database.insert_user('alice','pw','alice@example.com',1)
+    tickets = [new_ticket(f'Ticket {number}') for number in range(3)]
+    database.insert_ticket('Phish',2,'Body',1,datetime.now(),'New')
+    database.write(lambda cur: cur.execute('UPDATE tickets SET owner = 2 WHERE id IN (?,?)',tickets[0:2]))
+    database.resolve_ticket(tickets[0],'False Positive')
+    database.resolve_ticket(tickets[1],'True Positive')
+    stats = database.compute_dashboard_stats()
+    assert stats['created'] == 4
+    assert stats['false_positive'] == 50
+    assert stats['busiest_queues'] == [(3,'Incident Response'),(1,'Phishing')]
+    assert stats['effective_analysts'] == [('alice',2)]
+
+#Nothing resolved means no analysts to show.
+def test_dashboard_stats_when_quiet(database):
+    stats = database.compute_dashboard_stats()
+    assert (stats['created'],stats['effective_analysts'],stats['busiest_queues']) == (0,False,[])
+
+#The stats are worked out once per STATS_TTL and shared until then.
+def test_dashboard_stats_are_cached(database,new_ticket,monkeypatch):
+    assert database.get_dashboard_stats()['created'] == 0
+    new_ticket()
+    assert database.get_dashboard_stats()['created'] == 0
+    monkeypatch.setattr(database,'STATS_TTL',0)
+    database._stats_cache['expires'] = 0
+    assert database.get_dashboard_stats()['created'] == 1
+
+def test_home_page(client,database,new_ticket):
+    new_ticket()
+    response = client.get('/')
+    assert response.status_code == 200
+    assert 'Incident Response' in response.get_data(as_text=True)
@@ -0,0 +1,101 @@
+import threading
+import time
+import pytest
+import email_ingester
+from fake_imap_server import FakeIMAPServer
+
+SENDER = 'alerts@example.com'
+
+@pytest.fixture
+def server():
+    server = FakeIMAPServer().start()
+    yield server
+    server.stop()
+
+def ingester(server):
+    return email_ingester.MailIngester(host='127.0.0.1',port=server.port,ssl=False,user='any',pwd='any',sender=SENDER)
+
+def ticket_names(database):
+    db,cur = database.db_connection()
+    names = [name for name, in cur.execute('SELECT name FROM tickets ORDER BY id')]
+    database.release_connection()
+    return names
+
+#Wait up to timeout seconds for there to be count tickets.
+def wait_for_tickets(database,count,timeout=10):
+    deadline = time.monotonic() + timeout
+    while(len(ticket_names(database)) < count and time.monotonic() < deadline):
+        time.sleep(0.05)
+    return ticket_names(database)
+
+#Run the ingester as a service in a thread, stopping it at the end of the test
+@pytest.fixture
+def service(database,server):
+    running = ingester(server)
+    thread = threading.Thread(target=running.run)
+    thread.start()
+    yield running
+    running.stop()
+    thread.join()
+
+#Unread mail from the alert sender becomes tickets with their key info, in the queue named before the hyphen. Other mail is left alone.
+def test_run_once(database,server):
+    server.add_message('1 - Multiple SSH Failures at 10.0.0.1','Host:10.0.0.1,Account:root',SENDER)
+    server.add_message('Newsletter','Not an alert','news@example.com')
+    mail = ingester(server)
+    mail.run_once()
+    assert ticket_names(database) == ['Multiple SSH Failures at 10.0.0.1']
+    db,cur = database.db_connection()
+    assert cur.execute('SELECT info FROM keyinfo').fetchall() == [('10.0.0.1',)]
+    assert mail.stats['fetched'] == 1 and mail.stats['created'] == 1
+    #the mail has been read, so running again creates nothing
+    ingester(server).run_once()
+    assert len(ticket_names(database)) == 1
+
+#Repeats of the same alert are counted as deduplicated, not created.
+def test_duplicate_alerts(database,server):
+    for repeat in range(3):
+        server.add_message('1 - Port scan from 10.0.0.2','Host:10.0.0.2',SENDER)
+    mail = ingester(server)
+    mail.run_once()
+    assert ticket_names(database) == ['Port scan from 10.0.0.2']
+    assert (mail.stats['created'],mail.stats['deduplicated']) == (1,2)
+
+#The service picks up mail as it arrives, announced over IDLE.
+def test_service_picks_up_new_mail(database,server,service):
+    server.add_message('1 - First alert','Body',SENDER)
+    assert wait_for_tickets(database,1) == ['First alert']
+    server.add_message('1 - Second alert','Body',SENDER)
+    assert wait_for_tickets(database,2) == ['First alert','Second alert']
+
+#When the connection drops the service reconnects and carries on.
+def test_service_reconnects(database,server,monkeypatch):
+    monkeypatch.setattr(email_ingester,'BACKOFF_START',0.05)
+    running = ingester(server)
+    thread = threading.Thread(target=running.run)
+    thread.start()
+    try:
+        server.add_message('1 - Before','Body',SENDER)
+        assert wait_for_tickets(database,1) == ['Before']
+        server.drop_connections()
+        server.add_message('1 - After','Body',SENDER)
+        assert wait_for_tickets(database,2) == ['Before','After']
+        assert running.stats['reconnects'] >= 1
+    finally:
+        running.stop()
+        thread.join()
+
+#Servers without IDLE are polled instead.
+def test_service_polls_without_idle(database,monkeypatch):
+    monkeypatch.setattr(email_ingester,'POLL_INTERVAL',0.1)
+    server = FakeIMAPServer(idle=False).start()
+    running = ingester(server)
+    thread = threading.Thread(target=running.run)
+    thread.start()
+    try:
+        server.add_message('1 - Polled alert','Body',SENDER)
+        assert wait_for_tickets(database,1) == ['Polled alert']
+    finally:
+        running.stop()
+        thread.join()
+        server.stop()
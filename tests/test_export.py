@@ -0,0 +1,73 @@
+import csv
+import io
+import json
+from datetime import datetime, timedelta
+import pytest
+import manage
+
+START = datetime(2026,10,1,9,0)
+
+#Six tickets an hour apart, alternating between two queues, each with key info and a comment. The first two are archived.
+@pytest.fixture
+def tickets(database,new_ticket):
+    database.insert_queue('Phishing')
+    ids = []
+    for number in range(6):
+        ticket = database.insert_ticket(f'Ticket {number}',1 + number % 2,f'Body, with "quotes" {number}',1,START + timedelta(hours=number),'New')
+        database.insert_keyinfo(f'10.0.0.{number}',ticket,'IP')
+        database.insert_comment(f'Comment {number}',1,ticket,START + timedelta(hours=number,minutes=30),1)
+        ids.append(ticket)
+    for ticket in ids[0:2]:
+        database.resolve_ticket(ticket,'True Positive')
+    database.write(lambda cur: cur.execute('UPDATE tickets SET completed = ? WHERE status = "Resolved"',(START - timedelta(days=200),)))
+    assert database.archive_resolved_tickets(90) == 2
+    return ids
+
+#Tickets come out in created order from the hot database and the archive together, with their own key info and comments, however they are batched.
+def test_export_tickets(database,tickets):
+    exported = list(database.export_tickets(batch=4))
+    assert [ticket['id'] for ticket in exported] == tickets
+    assert [[entry['info'] for entry in ticket['keyinfo']] for ticket in exported] == [[f'10.0.0.{number}'] for number in range(6)]
+    assert [[entry['comment'] for entry in ticket['comments']] for ticket in exported] == [[f'Comment {number}'] for number in range(6)]
+    assert exported[0]['created'] == START and exported[0]['queue'] == 'Incident Response'
+
+#The range includes its start but not its end, and can be narrowed to one queue.
+def test_export_filters(database,tickets):
+    exported = database.export_tickets(START + timedelta(hours=1),START + timedelta(hours=4))
+    assert [ticket['id'] for ticket in exported] == tickets[1:4]
+    exported = database.export_tickets(START + timedelta(hours=1),queue=2)
+    assert [ticket['id'] for ticket in exported] == tickets[1::2]
+
+def test_export_csv(database,tickets):
+    text = ''.join(database.export_csv(database.export_tickets()))
+    rows = list(csv.DictReader(io.StringIO(text)))
+    assert [int(row['id']) for row in rows] == tickets
+    assert rows[0]['content'] == 'Body, with "quotes" 0'
+    assert rows[0]['keyinfo'] == 'IP: 10.0.0.0'
+    #an empty export still has its header
+    assert ''.join(database.export_csv(database.export_tickets(START + timedelta(days=1)))).strip() == ','.join(database.EXPORT_CSV_COLUMNS)
+
+def test_export_jsonl(database,tickets):
+    lines = ''.join(database.export_jsonl(database.export_tickets())).splitlines()
+    exported = [json.loads(line) for line in lines]
+    assert [ticket['id'] for ticket in exported] == tickets
+    assert exported[0]['created'] == START.isoformat()
+
+#The output is sent in chunks rather than as one string.
+def test_export_is_chunked(database,tickets,monkeypatch):
+    monkeypatch.setattr(database,'EXPORT_CHUNK_SIZE',100)
+    chunks = list(database.export_jsonl(database.export_tickets()))
+    assert len(chunks) > 1
+
+def test_export_route(client,database,tickets):
+    response = client.get('/Export/csv?start=2026-10-01T10:00&end=2026-10-01T12:00')
+    assert response.status_code == 200
+    assert response.headers['Content-Disposition'] == 'attachment; filename="tickets-2026-10-01-2026-10-01.csv"'
+    assert [int(row['id']) for row in csv.DictReader(io.StringIO(response.get_data(as_text=True)))] == tickets[1:3]
+    assert client.get('/Export/xml').status_code == 400
+    assert client.get('/Export/csv?start=yesterday').status_code == 400
+
+def test_export_command(database,tickets,tmp_path):
+    output = tmp_path / 'tickets.jsonl'
+    assert manage.main(['export','--format','jsonl','--queue','1','--output',str(output)]) == 0
+    assert [json.loads(line)['id'] for line in output.read_text().splitlines()] == tickets[0::2]
@@ -0,0 +1,40 @@
+import sqlite3
+import pytest
+
+def tickets(database):
+    db,cur = database.db_connection()
+    return cur.execute('SELECT id,name,queue,occurrences FROM tickets ORDER BY id').fetchall()
+
+#A burst of alerts is written in one go, returning each alert's ticket id in order, with its key info. Unknown queues fall back to the default.
+def test_ingest_batch(database):
+    ids,folded = database.ingest_tickets([('SSH brute force',1,'Host 10.0.0.1',['10.0.0.1']),('Port scan',7,'Host 10.0.0.2',['10.0.0.2','10.0.0.2'])])
+    assert folded == 0
+    assert tickets(database) == [(ids[0],'SSH brute force',1,1),(ids[1],'Port scan',1,1)]
+    db,cur = database.db_connection()
+    assert cur.execute('SELECT ticket,info FROM keyinfo ORDER BY id').fetchall() == [(ids[0],'10.0.0.1'),(ids[1],'10.0.0.2')]
+
+#A batch that fails is written not at all, rather than in part.
+def test_failed_batch_writes_nothing(database):
+    with pytest.raises(sqlite3.IntegrityError):
+        database.ingest_tickets([('Good alert',1,'Body',False),(None,1,'Body',False)])
+    assert tickets(database) == []
+
+#Repeats of an open alert within the window are folded into its ticket, in the same batch or a later one, and reported as folded.
+def test_duplicates_are_folded(database):
+    alert = ('SSH brute force',1,'Host 10.0.0.1',['10.0.0.1'])
+    ids,folded = database.ingest_tickets([alert,alert,('Other',1,'Body',False)],dedup_window=10)
+    assert (ids[0] == ids[1],folded) == (True,1)
+    ids,folded = database.ingest_tickets([alert],dedup_window=10)
+    assert folded == 1
+    assert tickets(database)[0][3] == 3
+    #without a window every alert gets a ticket
+    assert database.ingest_tickets([alert],dedup_window=0)[1] == 0
+    assert len(tickets(database)) == 3
+
+#An alert whose ticket has been resolved opens a new ticket.
+def test_resolved_tickets_are_not_folded_into(database):
+    alert = ('SSH brute force',1,'Host 10.0.0.1',False)
+    (first,),folded = database.ingest_tickets([alert],dedup_window=10)
+    database.resolve_ticket(first,'True Positive')
+    (second,),folded = database.ingest_tickets([alert],dedup_window=10)
+    assert second != first and folded == 0
@@ -0,0 +1,49 @@
+import logging
+
+#Statements differing only in their values normalise to the same text.
+def test_normalise_sql(database):
+    assert database.normalise_sql("SELECT * FROM tickets WHERE id IN (1, 2,3) AND name = 'it''s'\n  LIMIT 10") == 'SELECT * FROM tickets WHERE id IN (...) AND name = ? LIMIT ?'
+
+#Every statement run through a pooled connection is counted against the current thread's request.
+def test_request_stats_count_statements(database):
+    db,cur = database.db_connection()
+    stats = database.reset_request_stats()
+    cur.execute('SELECT 1').fetchone()
+    cur.execute('SELECT 2').fetchall()
+    assert stats['queries'] == 2
+    assert [statement['sql'] for statement in stats['slowest']] == ['SELECT 1','SELECT 2']
+    assert stats['slowest'][0]['caller'].startswith('test_instrumentation.py:')
+
+#Statements over the threshold are logged once each and counted in the totals.
+def test_slow_query_log(database,monkeypatch,caplog):
+    db,cur = database.db_connection()
+    monkeypatch.setattr(database,'SLOW_QUERY_THRESHOLD',0)
+    slow = database.query_stats['slow']
+    with caplog.at_level(logging.WARNING,logger='database_methods.slow_queries'):
+        cur.execute('SELECT 1 WHERE 2 = 2').fetchall()
+    assert [record.getMessage().split(': ',1)[1] for record in caplog.records] == ['SELECT ? WHERE ? = ?']
+    assert database.query_stats['slow'] == slow + 1
+
+#Each response reports the request's database work in its headers, with the slowest statements in debug mode.
+def test_headers(client,new_ticket):
+    ticket = new_ticket()
+    response = client.get(f'/ViewTicket/{ticket}')
+    assert int(response.headers['X-DB-Queries']) > 0
+    assert float(response.headers['X-DB-Time']) >= 0
+    assert 'X-DB-Connections' in response.headers
+    assert 'X-DB-Slowest' not in response.headers
+    client.application.debug = True
+    assert 'database_methods.py' in client.get(f'/ViewTicket/{ticket}').headers['X-DB-Slowest']
+
+#/metrics shows the totals per route in the Prometheus text format, without needing a login.
+def test_metrics_endpoint(client):
+    client.get('/FindMyQueue')
+    with client.session_transaction() as session:
+        session.clear()
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+    text = response.get_data(as_text=True)
+    assert '# TYPE ticketing_db_queries_total counter' in text
+    assert 'ticketing_http_requests_total{route="/FindMyQueue"}' in text
+    assert 'ticketing_db_pool_size ' in text
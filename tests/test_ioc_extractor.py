@@ -0,0 +1,41 @@
+import pytest
+import ioc_extractor
+from benchmarks import ioc_extraction
+
+@pytest.mark.parametrize('text,expected',[
+    ('Host:10.0.0.1,Account:root',[('10.0.0.1','ipv4')]),
+    ('src IP10.0.0.1 dst',[('10.0.0.1','ipv4')]),
+    ('Blocked 192.168.0.0/16 at the edge',[('192.168.0.0/16','cidr')]),
+    ('mac=00:1a:2b:3c:4d:5e',[('00:1a:2b:3c:4d:5e','mac')]),
+    ('Reply to jsmith@example.co.uk',[('jsmith@example.co.uk','email')]),
+    ('See https://evil.example.com/payload.exe.',[('https://evil.example.com/payload.exe','url')]),
+    ('Beacon to c2.evil.io every minute',[('c2.evil.io','domain')]),
+    ('Patched CVE-2021-44228 today',[('CVE-2021-44228','cve')]),
+    ('Hash d41d8cd98f00b204e9800998ecf8427e',[('d41d8cd98f00b204e9800998ecf8427e','md5')]),
+    ('Source fe80::1ff:fe23:4567:890a',[('fe80::1ff:fe23:4567:890a','ipv6')]),
+])
+def test_indicator_types(text,expected):
+    assert ioc_extractor.extract(text) == expected
+
+#Things that look a little like indicators but aren't.
+@pytest.mark.parametrize('text',[
+    'Opened report.xlsm and run.py',
+    'Version 1.2.3 released',
+    'Address 300.1.1.1 is out of range',
+    'Ratio 10:30 at 12:45',
+])
+def test_false_matches_are_dropped(text):
+    assert [kind for value,kind in ioc_extractor.extract(text) if kind in ('ipv4','domain','ipv6')] == []
+
+#Indicators come back in the order they first appear, each once.
+def test_order_and_duplicates():
+    assert ioc_extractor.extract_values('10.0.0.2 then 10.0.0.1 then 10.0.0.2') == ['10.0.0.2','10.0.0.1']
+
+#The single pass extractor finds every IP and email the original comma splitting extraction found.
+def test_matches_original_extraction():
+    assert ioc_extraction.check_equivalence(ioc_extraction.build_corpus(1,16 * 1024)) == []
+
+#The email ingester reports no key info when a message carries no indicators.
+def test_email_without_indicators():
+    import email_ingester
+    assert email_ingester.CheckForKeyinfo('Hello','Nothing to see here') == False
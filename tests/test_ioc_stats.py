@@ -0,0 +1,54 @@
+from datetime import datetime,timedelta
+
+def reputation(database,value):
+    stats = database.ioc_reputation(value)
+    return stats and (stats['sightings'],stats['resolved'],stats['false_positives'],stats['volume'])
+
+def keyinfo_id(database,ticket,value):
+    db,cur = database.db_connection()
+    return cur.execute('SELECT id FROM keyinfo WHERE ticket = ? AND info = ?',(ticket,value)).fetchone()[0]
+
+#Sightings, resolutions and false positives follow the key info and tickets as they change.
+def test_stats_follow_writes(database,new_ticket):
+    assert database.ioc_reputation('10.0.0.1') is None
+    assert database.key_info_stats('10.0.0.1') == (0,0,0,None,None)
+    one,two,three = (new_ticket(f'Ticket {number}') for number in range(3))
+    database.insert_keyinfo('10.0.0.1',one,'IP')
+    database.auto_key_info(two,[' 10.0.0.1 '])
+    database.insert_keyinfo('10.0.0.1',three,'IP')
+    assert reputation(database,'10.0.0.1') == (3,0,0,3)
+
+    database.resolve_ticket(one,'False Positive')
+    database.resolve_ticket(two,'True Positive')
+    assert reputation(database,'10.0.0.1') == (3,2,1,3)
+    assert database.key_info_stats('10.0.0.1')[:3] == (3,50,3)
+
+    database.remove_keyinfo(keyinfo_id(database,three,'10.0.0.1'))
+    assert reputation(database,'10.0.0.1') == (2,2,1,2)
+    database.update_keyinfo(keyinfo_id(database,one,'10.0.0.1'),'IP','10.0.0.9')
+    assert reputation(database,'10.0.0.1') == (1,1,0,1)
+    assert reputation(database,'10.0.0.9') == (1,1,1,1)
+
+#Indicators are matched ignoring case and surrounding whitespace.
+def test_lookup_ignores_case(database,new_ticket):
+    database.insert_keyinfo('Evil.Example.COM',new_ticket(),'Domain')
+    assert reputation(database,'  evil.example.com ') == (1,0,0,1)
+
+#Only sightings on tickets created in the last 7 days count towards the volume.
+def test_volume_is_last_seven_days(database,new_ticket):
+    old = new_ticket('Old',created=datetime.now() - timedelta(days=10))
+    recent = new_ticket('Recent')
+    database.insert_keyinfo('10.0.0.1',old,'IP')
+    database.insert_keyinfo('10.0.0.1',recent,'IP')
+    assert reputation(database,'10.0.0.1') == (2,0,0,1)
+
+#Rebuilding the stats from the key info gives the same numbers as maintaining them write by write.
+def test_rebuild_matches_maintained(database,new_ticket):
+    tickets = [new_ticket(f'Ticket {number}') for number in range(4)]
+    for ticket in tickets:
+        database.insert_keyinfo('10.0.0.1',ticket,'IP')
+    database.insert_keyinfo('bad@example.com',tickets[0],'Email')
+    database.resolve_ticket(tickets[0],'False Positive')
+    maintained = {value:database.ioc_reputation(value) for value in ('10.0.0.1','bad@example.com')}
+    assert database.rebuild_ioc_stats() == 2
+    assert {value:database.ioc_reputation(value) for value in maintained} == maintained
@@ -0,0 +1,43 @@
+from datetime import datetime, timedelta
+
+def add_guidance(database):
+    database.add_knowledgebase_entry('Phishing','Suspicious emails')
+    db,cur = database.db_connection()
+    mapid = cur.execute('SELECT id FROM knowledgemap WHERE title = ?',('Phishing',)).fetchone()[0]
+    database.create_knowledge_guidance('Block sender','Add the sender to the blocklist',mapid)
+    guidanceid = cur.execute('SELECT id FROM knowledge WHERE knowledgemap = ?',(mapid,)).fetchone()[0]
+    database.release_connection()
+    return mapid,guidanceid
+
+#Removing guidance sends the user back to its mapping, and leaves the request's connection in the pool for the next request.
+def test_remove_guidance(client,database):
+    for attempt in range(database.POOL_SIZE + 1):
+        mapid,guidanceid = add_guidance(database)
+        response = client.get(f'/RemoveGuidance/{guidanceid}')
+        assert response.status_code == 302
+        assert response.headers['Location'].endswith(f'/ViewKnowledge/{mapid}')
+        database.remove_knowledgebase_entry(mapid)
+    assert database.get_pool_stats()['open'] <= database.POOL_SIZE
+    db,cur = database.db_connection()
+    assert cur.execute('SELECT count(*) FROM knowledge').fetchone() == (0,)
+
+#A ticket is mapped to the knowledge mapping named in its title, its page links to the mapping only if it exists, and renaming the ticket moves it.
+def test_ticket_knowledge_mapping(database,new_ticket):
+    database.add_knowledgebase_entry('Phishing','Suspicious emails')
+    ticket = new_ticket('Reported email INC1')
+    unmapped = new_ticket('Reported email INC7')
+    assert database.load_ticket_detail(ticket,1)['knowledge'] == 1
+    assert database.load_ticket_detail(unmapped,1)['knowledge'] is False
+    database.update_ticket('Reported email',"Seen on the VPN gateway",1,'New',ticket)
+    assert database.load_ticket_detail(ticket,1)['knowledge'] is False
+
+#Mapping stats count every ticket ever mapped, the percentage resolved as false positives and the tickets from the last seven days.
+def test_knowledge_stats(database,new_ticket):
+    database.add_knowledgebase_entry('Phishing','Suspicious emails')
+    database.add_knowledgebase_entry('Malware','Endpoint detections')
+    old = new_ticket('INC1 old report',created=datetime.now() - timedelta(days=30))
+    for number in range(3):
+        new_ticket(f'INC1 report {number}')
+    database.resolve_ticket(old,'False Positive')
+    assert database.stats_by_knowledge(1) == (4,25,3)
+    assert database.knowledge_mappings_with_stats() == [(1,'Phishing',4,25,3),(2,'Malware',0,0,0)]
@@ -0,0 +1,51 @@
+import threading
+import time
+import log_ingester
+
+EVENTS = (
+    '2023-02-08 17:15:24.895682,LDAP,10.128.38.68,10.10.1.82,SERVE "/recruitment.txt",SUCCESS\n',
+    '2023-02-08 17:15:45.775682,SSH,10.11.1.12,10.128.200.235,CONNECTION CREATED,SUCCESS as ROOT\n',
+    '2023-02-08 17:16:02.105682,HTTP,10.10.1.82,10.128.38.68,GET "/",\n',
+)
+
+def event_count(database):
+    db,cur = database.db_connection()
+    return cur.execute('SELECT count(*) FROM events').fetchone()[0]
+
+#Wait up to timeout seconds for the events table to hold count events.
+def wait_for_events(database,count,timeout=5):
+    deadline = time.monotonic() + timeout
+    while(event_count(database) != count and time.monotonic() < deadline):
+        time.sleep(0.02)
+    return event_count(database)
+
+def test_ingest_file(database,tmp_path):
+    log = tmp_path / 'incident.log'
+    log.write_text(''.join(EVENTS) + 'not an event\n')
+    assert log_ingester.ingest_file(str(log)) == (3,1)
+    #a second run carries on from where the first stopped
+    with open(log,'a') as file:
+        file.write(EVENTS[0])
+    assert log_ingester.ingest_file(str(log)) == (1,0)
+    assert event_count(database) == 4
+
+#Lines appended to a followed file are written once it goes quiet, long before a batch fills, and while the ingester is still running.
+def test_follow_writes_partial_batches(database,tmp_path,monkeypatch):
+    monkeypatch.setattr(log_ingester,'FOLLOW_INTERVAL',0.02)
+    log = tmp_path / 'incident.log'
+    log.write_text(EVENTS[0])
+    stopping = threading.Event()
+    result = []
+    follower = threading.Thread(target=lambda: result.append(log_ingester.ingest_file(str(log),follow=True,stopping=stopping)))
+    follower.start()
+    try:
+        assert wait_for_events(database,1) == 1
+        with open(log,'a') as file:
+            file.write(EVENTS[1] + EVENTS[2])
+        assert wait_for_events(database,3) == 3
+        assert follower.is_alive()
+        assert database.get_log_position(str(log))[0] == log.stat().st_size
+    finally:
+        stopping.set()
+        follower.join()
+    assert result == [(3,0)]
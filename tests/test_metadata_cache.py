@@ -0,0 +1,49 @@
+#Change the users or queue tables behind the cache's back, as another process would.
+def external_write(database,sql,parameters=()):
+    database.write(lambda cur: cur.execute(sql,parameters))
+
+#Once loaded, users and queues are answered from memory without touching the database.
+def test_lookups_are_cached(database):
+    assert database.user_details('Nobody') == (1,0)
+    stats = database.reset_request_stats()
+    assert database.user_id_from_name('Nobody') == 1
+    assert database.get_user_queue('Nobody') == 0
+    assert database.queue_exists(1)
+    assert stats['queries'] == 0
+
+#This process's own changes are seen straight away.
+def test_own_changes_invalidate(database):
+    assert database.queue_choices() == [(1,'Incident Response')]
+    assert database.insert_queue('Phishing')
+    assert database.queue_choices() == [(1,'Incident Response'),(2,'Phishing')]
+    database.update_user_queue(2,1)
+    assert database.get_user_queue('Nobody') == 2
+    assert database.insert_user('Analyst','secret','analyst@example.com',2)
+    assert database.user_details('Analyst')[1] == 2
+
+#Other processes' changes are noticed through the generation once the check interval has passed.
+def test_other_processes_changes(database,monkeypatch):
+    monkeypatch.setattr(database,'METADATA_CHECK_INTERVAL',3600)
+    assert database.get_user_queue('Nobody') == 0
+    external_write(database,'INSERT INTO queue (name) VALUES (?)',('Phishing',))
+    external_write(database,'UPDATE users SET queue = 2 WHERE id = 1')
+    assert database.get_user_queue('Nobody') == 0
+    monkeypatch.setattr(database,'METADATA_CHECK_INTERVAL',0)
+    assert database.get_user_queue('Nobody') == 2
+
+#A queue or user that isn't cached yet is looked up again rather than reported missing.
+def test_miss_reloads(database,monkeypatch):
+    monkeypatch.setattr(database,'METADATA_CHECK_INTERVAL',3600)
+    assert database.queue_choices() == [(1,'Incident Response')]
+    external_write(database,'INSERT INTO queue (name) VALUES (?)',('Phishing',))
+    assert database.queue_name(2) == 'Phishing'
+    assert database.queue_name('junk') is None
+    external_write(database,'INSERT INTO users (name,pwd,email,queue) VALUES (?,?,?,?)',('Analyst','x','analyst@example.com',2))
+    assert database.user_id_from_name('Analyst') == 2
+    assert database.user_id_from_name('Nobody else') is None
+
+#A session from before the user's id was kept gets it filled in on first use.
+def test_session_keeps_identity(client):
+    client.get('/Profile')
+    with client.session_transaction() as session:
+        assert session['user_id'] == 1
@@ -0,0 +1,95 @@
+import sqlite3
+from datetime import datetime, timedelta
+import pytest
+
+#The tables as the first release created them, before migrations existed: timestamps are text written by datetime.now(), "Null" when unset.
+BASELINE_SCHEMA = (
+    'CREATE TABLE tickets(id integer PRIMARY KEY, name text not null, status text not null, owner integer not null, queue integer not null, content text not null, created text not null, started text, completed text, determination text)',
+    'CREATE TABLE queue(id integer PRIMARY KEY, name text not null)',
+    'CREATE TABLE users(id integer PRIMARY KEY, name text not null, pwd text not null, email text not null, queue integer not null)',
+    'CREATE TABLE keyinfo(id integer PRIMARY KEY, ticket integer, infotype text, info text)',
+    'CREATE TABLE comments(id integer PRIMARY KEY, comment text not null, commenter integer not null, post integer not null, datetime text not null, stage integer not null)',
+    'CREATE TABLE relationships(id integer PRIMARY KEY, ticketone not null, tickettwo not null)',
+    'CREATE TABLE knowledgemap(id integer PRIMARY KEY, title text not null, body text not null)',
+    'CREATE TABLE knowledge(id integer PRIMARY KEY, knowledgemap integer not null, title text not null, body text not null)',
+)
+
+#When the baseline rows were written, to the millisecond as that is what timestamps are kept to.
+NOW = datetime.now().replace(microsecond=123000)
+
+#A database written by the first release: two queues and a user, four tickets (one resolved as a false positive, two linked), with key info and a comment.
+@pytest.fixture
+def baseline(empty_database):
+    db = sqlite3.connect(empty_database.DATABASE)
+    for statement in BASELINE_SCHEMA:
+        db.execute(statement)
+    db.execute('INSERT INTO queue(name) VALUES ("Incident Response"),("Phishing")')
+    db.execute('INSERT INTO users(name,pwd,email,queue) VALUES ("Nobody","0","null@null.com",0)')
+    db.execute('INSERT INTO knowledgemap(title,body) VALUES ("Beaconing","Hosts calling out to C2")')
+    tickets = (
+        ('INC1 beacon from workstation',"Resolved",1,1,'Host 10.0.0.5 beaconing',str(NOW - timedelta(hours=2)),str(NOW - timedelta(hours=1,minutes=50)),str(NOW - timedelta(hours=1)),'False Positive'),
+        ('Phishing email reported',"New",1,2,'Sender evil@example.com',str(NOW - timedelta(hours=1)),'Null','Null',None),
+        ('Brute force on VPN',"Under Investigation",1,1,'Source 10.0.0.9',str(NOW - timedelta(days=3)),str(NOW - timedelta(days=3)),'Null',None),
+        ('Old malware ticket',"Resolved",1,1,'Old detection',str(NOW - timedelta(days=40)),str(NOW - timedelta(days=40)),str(NOW - timedelta(days=39)),'True Positive'),
+    )
+    db.executemany('INSERT INTO tickets(name,status,owner,queue,content,created,started,completed,determination) VALUES (?,?,?,?,?,?,?,?,?)',tickets)
+    db.execute('INSERT INTO keyinfo(ticket,infotype,info) VALUES (1,"IP","10.0.0.5"),(3,"IP","10.0.0.9"),(3,"IP","10.0.0.5")')
+    db.execute('INSERT INTO comments(comment,commenter,post,datetime,stage) VALUES ("Blocked at the proxy",1,1,?,2)',(str(NOW - timedelta(hours=1)),))
+    db.execute('INSERT INTO relationships(ticketone,tickettwo) VALUES (1,3)')
+    db.commit()
+    db.close()
+    empty_database.table_init()
+    return empty_database
+
+#A database from before migrations is brought to the latest version, keeping every row, and passes SQLite's own checks.
+def test_baseline_is_migrated(baseline):
+    assert baseline.schema_version() == baseline.MIGRATIONS[-1][0]
+    assert baseline.is_bootstrapped()
+    db,cur = baseline.db_connection()
+    counts = [cur.execute(f'SELECT count(*) FROM {table}').fetchone()[0] for table in ('tickets','keyinfo','comments','relationships','queue','users')]
+    assert counts == [4,3,1,1,2,1]
+    assert cur.execute('PRAGMA integrity_check').fetchone() == ('ok',)
+
+#Every query the pages depend on uses an index once the baseline schema is migrated.
+def test_hot_queries_use_indexes(baseline):
+    assert baseline.check_query_plans() == []
+
+#Running the migrations again changes nothing.
+def test_migrations_run_once(baseline):
+    db,cur = baseline.db_connection()
+    applied = cur.execute('SELECT version,applied FROM schema_version ORDER BY version').fetchall()
+    tickets = cur.execute('SELECT * FROM tickets ORDER BY id').fetchall()
+    baseline.table_init()
+    assert cur.execute('SELECT version,applied FROM schema_version ORDER BY version').fetchall() == applied
+    assert cur.execute('SELECT * FROM tickets ORDER BY id').fetchall() == tickets
+    assert cur.execute('SELECT count(*) FROM queue').fetchone() == (2,)
+
+#Tables filled in from existing rows by the migrations: the search index, knowledge mappings, clusters and indicator stats.
+def test_derived_tables_are_backfilled(baseline):
+    assert [result[0] for result in baseline.search('beaconing')[0]] == [1]
+    assert baseline.load_ticket_detail(1,1)['knowledge'] == 1
+    assert baseline.load_ticket_detail(1,1)['cluster'][1] == 2
+    assert baseline.stats_by_knowledge(1)[0:2] == (1,100)
+
+#Ids of deleted tickets are never handed out again.
+def test_ids_are_not_reused(baseline):
+    baseline.write(lambda cur: cur.execute('DELETE FROM tickets WHERE id = 4'))
+    assert baseline.insert_ticket('New ticket',1,'Body',1,datetime.now()) == 5
+
+#Text timestamps become epoch milliseconds, "Null" becomes NULL, and they read back as the datetimes that were written.
+def test_timestamps_are_converted(baseline):
+    db,cur = baseline.db_connection()
+    assert cur.execute('SELECT DISTINCT typeof(created) FROM tickets').fetchall() == [('integer',)]
+    assert cur.execute('SELECT created,started,completed FROM tickets WHERE id = 1').fetchone() == (NOW - timedelta(hours=2),NOW - timedelta(hours=1,minutes=50),NOW - timedelta(hours=1))
+    assert cur.execute('SELECT started,completed FROM tickets WHERE id = 2').fetchone() == (None,None)
+    assert cur.execute('SELECT datetime FROM comments').fetchone() == (NOW - timedelta(hours=1),)
+    #datetimes passed to queries are compared as epoch milliseconds
+    assert cur.execute('SELECT id FROM tickets WHERE created > ? ORDER BY id',(NOW - timedelta(days=1),)).fetchall() == [(1,),(2,)]
+
+def test_epoch_ms_conversion(database):
+    moment = datetime(2026,10,18,8,30,15,250000)
+    assert database.from_epoch_ms(database.to_epoch_ms(moment)) == moment
+    assert database.to_epoch_ms(str(moment)) == database.to_epoch_ms(moment)
+    assert database.to_epoch_ms(1234) == 1234
+    assert [database.to_epoch_ms(value) for value in (None,'','Null','None')] == [None] * 4
+    assert database.from_epoch_ms(None) is None
@@ -0,0 +1,46 @@
+import sqlite3
+import threading
+import database_methods
+
+#A connection closed while checked out is dropped when released, and the pool still hands out a working connection.
+def test_release_closed_connection(database):
+    db,cur = database.db_connection()
+    db.close()
+    database.release_connection()
+    db,cur = database.db_connection()
+    assert cur.execute('SELECT 1').fetchone() == (1,)
+
+#Releasing more closed connections than the pool holds never uses up its places.
+def test_closed_connections_do_not_exhaust_pool(database):
+    for attempt in range(database.POOL_SIZE + 1):
+        db,cur = database.db_connection()
+        db.close()
+        database.release_connection()
+    assert database.get_pool_stats()['open'] <= database.POOL_SIZE
+    db,cur = database.db_connection()
+    assert cur.execute('SELECT count(*) FROM users').fetchone() == (1,)
+
+#If a replacement can't be opened the closed connection's place is given back, so a later checkout opens a new one.
+def test_release_gives_back_place_when_reopen_fails(database,monkeypatch):
+    db,cur = database.db_connection()
+    opened = database.get_pool_stats()['open']
+    db.close()
+    def fail():
+        raise sqlite3.OperationalError('unable to open database file')
+    monkeypatch.setattr(database_methods,'_open_connection',fail)
+    database.release_connection()
+    assert database.get_pool_stats()['open'] == opened - 1
+
+#Connections go back to the pool at the end of each thread's work, and are reused by the next.
+def test_connections_are_reused(database):
+    def work():
+        db,cur = database.db_connection()
+        cur.execute('SELECT 1').fetchone()
+        database.release_connection()
+    for attempt in range(database.POOL_SIZE * 2):
+        thread = threading.Thread(target=work)
+        thread.start()
+        thread.join()
+    stats = database.get_pool_stats()
+    assert stats['open'] <= database.POOL_SIZE
+    assert stats['hits'] > 0
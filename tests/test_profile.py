@@ -0,0 +1,23 @@
+from datetime import datetime,timedelta
+
+#The profile lists the user's open tickets oldest first, a page at a time, leaving out resolved ones and other users' tickets.
+def test_user_tickets_pages(database,new_ticket):
+    start = datetime.now() - timedelta(hours=1)
+    tickets = [new_ticket(f'Ticket {number}',created=start + timedelta(minutes=number)) for number in range(5)]
+    database.resolve_ticket(tickets[2],'True Positive')
+    database.write(lambda cur: cur.execute('UPDATE tickets SET owner = 2 WHERE id = ?',(tickets[4],)))
+    assert database.user_ticket_count(1) == 3
+    page,after = database.user_tickets_page(1,limit=2)
+    assert [row[3] for row in page] == tickets[0:2]
+    assert after == tickets[1]
+    page,after = database.user_tickets_page(1,after,limit=2)
+    assert [row[3] for row in page] == [tickets[3]]
+    assert after is None
+    assert page[0][:3] == ('Ticket 3','Incident Response',1)
+
+#The rest of the profile's tickets are loaded as JSON after the last one shown.
+def test_profile_tickets_route(client,new_ticket):
+    start = datetime.now() - timedelta(hours=1)
+    one,two = (new_ticket(f'Ticket {number}',created=start + timedelta(minutes=number)) for number in range(2))
+    assert client.get('/Profile').status_code == 200
+    assert client.get(f'/ProfileTickets?after={one}').get_json() == {'tickets':[{'name':'Ticket 1','queue':'Incident Response','id':two}],'after':None}
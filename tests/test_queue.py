@@ -0,0 +1,36 @@
+import re
+from datetime import datetime, timedelta
+
+#The queue page tags each row with its created time in the same format live changes send, which the page uses to put changed tickets in order.
+def test_rows_carry_created_time(client,database,new_ticket):
+    created = datetime(2026,10,18,8,0,1,500000)
+    ticket = new_ticket(created=created)
+    page = client.get('/ViewQueue/1').get_data(as_text=True)
+    assert re.search(rf'id="ticket-{ticket}" data-created="([^"]*)"',page).group(1) == str(created)
+    changes = client.get('/QueueChanges/1?since=0').get_json()['changes']
+    assert changes[-1]['ticket']['created'] == str(created)
+
+#Pages run oldest first by (created, id), so tickets created at the same moment are neither skipped nor repeated.
+def test_queue_pages(database,new_ticket):
+    start = datetime(2026,10,18,8,0)
+    tickets = [new_ticket(created=start + timedelta(seconds=number // 2)) for number in range(7)]
+    seen,after = [],None
+    while True:
+        page,after = database.queue_tickets_page(1,'New',after,limit=3)
+        seen += [ticket[0] for ticket in page]
+        if(after is None):
+            break
+    assert seen == tickets
+
+#Changes to a queue's tickets are listed after the version the page was loaded at, with whether the ticket is still open there.
+def test_queue_changes(database,new_ticket):
+    version = database.queue_version(1)
+    ticket = new_ticket()
+    changes,reset = database.queue_changes(1,version)
+    assert not reset
+    assert [(change['ticket']['id'],change['open']) for change in changes] == [(ticket,True)]
+    version = changes[-1]['id']
+    database.resolve_ticket(ticket,'True Positive')
+    changes,reset = database.queue_changes(1,version)
+    assert [(change['ticket']['id'],change['open']) for change in changes] == [(ticket,False)]
+    assert database.queue_changes(1,changes[-1]['id']) == ([],False)
@@ -0,0 +1,47 @@
+#Every relationship as a sorted pair, whichever way round it was stored.
+def relationships(database):
+    db,cur = database.db_connection()
+    return sorted(tuple(sorted(pair)) for pair in cur.execute('SELECT ticketone,tickettwo FROM relationships').fetchall())
+
+def cluster(database,ticket):
+    return database.load_ticket_detail(ticket,1)['cluster']
+
+#Without a root or star every ticket is linked to every other one, in one cluster.
+def test_recursive_relate_links_every_pair(database,new_ticket):
+    one,two,three = (new_ticket(f'Ticket {number}') for number in range(3))
+    assert database.recursive_relate([str(one),str(two),str(three)]) == 3
+    assert relationships(database) == [(one,two),(one,three),(two,three)]
+    assert cluster(database,three) == cluster(database,one)
+    assert cluster(database,one)[1] == 3
+
+#With star the tickets are only linked to the first.
+def test_star_links_to_first(database,new_ticket):
+    one,two,three = (new_ticket(f'Ticket {number}') for number in range(3))
+    assert database.recursive_relate([one,two,three],star=True) == 2
+    assert relationships(database) == [(one,two),(one,three)]
+    assert cluster(database,one)[1] == 3
+
+#Pairs already related either way round aren't added again, and junk ids are ignored.
+def test_existing_pairs_and_bad_ids_skipped(database,new_ticket):
+    one,two,three = (new_ticket(f'Ticket {number}') for number in range(3))
+    database.insert_relationship(two,one)
+    assert database.recursive_relate([one,'abc',two,'9999',three,one]) == 2
+    assert relationships(database) == [(one,two),(one,three),(two,three)]
+    assert database.recursive_relate([one,two,three]) == 0
+
+#Relating to a root links each ticket to it, and nothing happens when the root doesn't exist.
+def test_bulk_relate_to_root(database,new_ticket):
+    root,one,two = (new_ticket(f'Ticket {number}') for number in range(3))
+    assert database.bulk_relate_to_root([one,two],'9999') == False
+    assert database.bulk_relate_to_root([one,two],'root') == False
+    assert relationships(database) == []
+    assert database.bulk_relate_to_root([str(one),str(two)],str(root)) == True
+    assert relationships(database) == [(root,one),(root,two)]
+    assert database.bulk_relate_to_root([one,two],root) == False
+
+#The route takes a bracketed comma separated list.
+def test_recursive_relate_route(client,database,new_ticket):
+    one,two = new_ticket('First'),new_ticket('Second')
+    response = client.get(f'/RecursiveRelate/[{one}, {two}]')
+    assert response.status_code == 302
+    assert relationships(database) == [(one,two)]
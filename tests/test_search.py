@@ -0,0 +1,51 @@
+from datetime import datetime
+
+def found(database,term):
+    return [result[0] for result in database.search(term)[0]]
+
+#Titles, bodies, comments and key info are all searched, words match as prefixes and punctuation is taken literally.
+def test_search_finds_every_field(database,new_ticket):
+    title = new_ticket('Ransomware on fileserver',content='Encrypted shares')
+    comment = new_ticket('Odd login')
+    database.insert_comment('Looks like ransomware staging',1,comment,datetime.now(),1)
+    keyinfo = new_ticket('Port scan')
+    database.insert_keyinfo('203.0.113.7',keyinfo,'IP')
+    assert set(found(database,'ransom')) == {title,comment}
+    assert found(database,'203.0.113.7') == [keyinfo]
+    assert found(database,'encrypted shares') == [title]
+    assert database.search('   ') == ([],False)
+
+#A match in the title ranks above a match in the body.
+def test_title_matches_rank_first(database,new_ticket):
+    body = new_ticket('Suspicious process',content='phishing attachment opened')
+    title = new_ticket('Phishing campaign',content='Several users reported it')
+    assert found(database,'phishing') == [title,body]
+
+#The index follows edits and deletes, and rebuilding it gives the same results.
+def test_index_follows_changes(database,new_ticket):
+    ticket = new_ticket('Malware alert')
+    database.update_ticket('Beacon alert','Seen on the VPN gateway',1,'New',ticket)
+    assert found(database,'malware') == []
+    assert found(database,'beacon') == [ticket]
+    database.insert_comment('temporary note',1,ticket,datetime.now(),1)
+    db,cur = database.db_connection()
+    comment = cur.execute('SELECT id FROM comments').fetchone()[0]
+    database.remove_comment(comment)
+    assert found(database,'temporary') == []
+    assert database.rebuild_search_index() == 1
+    assert found(database,'beacon') == [ticket]
+
+def test_search_pages(database,new_ticket):
+    tickets = [new_ticket(f'Beacon {number}') for number in range(5)]
+    first,more = database.search('beacon',per_page=3)
+    assert more and len(first) == 3
+    second,more = database.search('beacon',page=1,per_page=3)
+    assert not more
+    assert sorted(result[0] for result in first + second) == tickets
+
+#Words that matched are highlighted in the snippet, with the rest of it escaped.
+def test_search_page(client,database,new_ticket):
+    new_ticket('Beacon <script>',content='Beacon to c2')
+    page = client.get('/Search?search=beacon').get_data(as_text=True)
+    assert '&lt;script&gt;' in page and 'Beacon <script>' not in page
+    assert '<mark>' in page
@@ -0,0 +1,42 @@
+from datetime import datetime, timedelta
+
+#Key info with how often each value has been seen on any ticket, comments newest first with their framework step, and relationships either way round.
+def test_ticket_detail(database,new_ticket):
+    database.insert_user('alice','pw','alice@example.com',1)
+    ticket,other,third = new_ticket('Beacon'),new_ticket('Other beacon'),new_ticket('Third')
+    database.insert_keyinfo('10.0.0.5',ticket,'IP')
+    database.insert_keyinfo('evil.example.com',ticket,'Domain')
+    database.insert_keyinfo('10.0.0.5',other,'IP')
+    database.insert_comment('First look',2,ticket,datetime.now() - timedelta(minutes=5),1)
+    database.insert_comment('Contained',1,ticket,datetime.now(),3)
+    database.insert_relationship(other,ticket)
+    database.insert_relationship(ticket,third)
+
+    detail = database.load_ticket_detail(ticket,1)
+    assert detail['ticket'][0:5] == ('Beacon','Seen on the VPN gateway',detail['ticket'][2],ticket,'New')
+    assert [(info,count) for info,infotype,id,count in detail['key']] == [('evil.example.com',1),('10.0.0.5',2)]
+    assert [(comment[0],comment[1],comment[3],comment[-1]) for comment in detail['comments']] == [
+        ('Contained','Nobody','Containment, Eradication and Recovery',True),
+        ('First look','alice','Preparation',False),
+    ]
+    assert sorted(relation[0] for relation in detail['relations']) == [other,third]
+    assert detail['cluster'][1] == 3
+    assert database.load_ticket_detail(9999,1) is None
+
+#Loading a ticket takes the same number of queries however much key info and how many comments it has.
+def test_ticket_detail_query_count(database,new_ticket):
+    def queries(ticket):
+        database.reset_request_stats()
+        database.load_ticket_detail(ticket,1)
+        return database.request_stats()['queries']
+    small,large = new_ticket('Small'),new_ticket('Large')
+    database.insert_keyinfo('10.0.0.1',small,'IP')
+    for number in range(25):
+        database.insert_keyinfo(f'10.0.1.{number}',large,'IP')
+        database.insert_comment(f'Comment {number}',1,large,datetime.now(),1)
+    assert queries(large) == queries(small)
+
+def test_view_ticket_page(client,database,new_ticket):
+    ticket = new_ticket('Beacon from workstation')
+    assert 'Beacon from workstation' in client.get(f'/ViewTicket/{ticket}').get_data(as_text=True)
+    assert client.get('/ViewTicket/9999').status_code == 302
@@ -0,0 +1,66 @@
+import sqlite3
+import threading
+import time
+import pytest
+import database_methods
+
+def add_queue(cur,name):
+    cur.execute('INSERT INTO queue(name) VALUES (?)',(name,))
+    return cur.lastrowid
+
+def fail(cur):
+    cur.execute('INSERT INTO queue(name) VALUES (?)',('Undone',))
+    raise ValueError('write failed')
+
+def queue_names(database):
+    db,cur = database.db_connection()
+    return [name for name, in cur.execute('SELECT name FROM queue ORDER BY id')]
+
+#Writes submitted together share a transaction, but one that fails is undone on its own.
+def test_failing_write_is_isolated(database):
+    futures = [database.submit_write(add_queue,'First'),database.submit_write(fail),database.submit_write(add_queue,'Second')]
+    assert futures[0].result() and futures[2].result()
+    with pytest.raises(ValueError):
+        futures[1].result()
+    assert queue_names(database) == ['Incident Response','First','Second']
+
+#A writer that can't open its connection fails the write straight away instead of leaving it waiting, and the next write starts a new writer.
+def test_writer_open_failure(database,monkeypatch):
+    database.stop_writer()
+    def refuse():
+        raise sqlite3.OperationalError('unable to open database file')
+    with monkeypatch.context() as patch:
+        patch.setattr(database_methods,'_open_connection',refuse)
+        started = time.monotonic()
+        with pytest.raises(sqlite3.OperationalError):
+            database.write(add_queue,'Lost')
+        assert time.monotonic() - started < database.WRITE_TIMEOUT
+    database.write(add_queue,'Kept')
+    assert queue_names(database) == ['Incident Response','Kept']
+
+#An unexpected error in the writer fails the writes it was running, and writing carries on afterwards.
+def test_writer_crash(database,monkeypatch):
+    def crash(cur,writes):
+        raise RuntimeError('writer crashed')
+    with monkeypatch.context() as patch:
+        patch.setattr(database_methods,'_commit_write_group',crash)
+        with pytest.raises(RuntimeError):
+            database.write(add_queue,'Lost')
+    database.write(add_queue,'Kept')
+    assert queue_names(database) == ['Incident Response','Kept']
+
+#A write stuck behind a slow one gives up after WRITE_TIMEOUT, and is never run once the writer gets to it.
+def test_write_timeout(database,monkeypatch):
+    monkeypatch.setattr(database_methods,'WRITE_TIMEOUT',0.1)
+    started,release = threading.Event(),threading.Event()
+    def slow(cur):
+        started.set()
+        release.wait()
+    blocking = database.submit_write(slow)
+    started.wait()
+    with pytest.raises(sqlite3.OperationalError):
+        database.write(add_queue,'Late')
+    release.set()
+    blocking.result()
+    database.write(add_queue,'Kept')
+    assert queue_names(database) == ['Incident Response','Kept']